@@ -1,7 +1,7 @@
-from numba import jit
+from numba import jit, prange
 import numpy as np
 
-@jit(nopython=True)
+@jit(nopython=True, parallel=True)
 def ARF_process_f_s_spherical(
     geometry, sxmin, sxmax, symin, symax, sstep, distance, fmin, fmax, fstep, scale
 ):
@@ -51,6 +51,8 @@ def ARF_process_f_s_spherical(
         np.mean(geometry[:, 2]),
     )
 
+    s_space = sstep
+
     # get number of points.
     nsx = int(np.round(((sxmax - sxmin) / s_space) + 1))
     nsy = int((np.round((symax - symin) / s_space) + 1))
@@ -58,15 +60,20 @@ def ARF_process_f_s_spherical(
     nf = int(np.ceil((fmax + fstep / 10.0 - fmin) / fstep))
 
     # make empty array for output.
-    buff = np.zeros(nf)
     transff = np.empty((nsx, nsy))
     slow_xs = np.linspace(sxmin, sxmax + s_space, nsx)
     slow_ys = np.linspace(symin, symax + s_space, nsy)
     ARF_arr = np.zeros((nsx * nsy, 3))
 
     # do the processing... many nested loops...
-    for i, sx in enumerate(slow_xs):
-        for j, sy in enumerate(slow_ys):
+    for i in prange(slow_xs.shape[0]):
+        # frequency buffer private to the thread running this row
+        buff = np.zeros(nf)
+
+        for j in range(slow_ys.shape[0]):
+
+            sx = slow_xs[i]
+            sy = slow_ys[j]
 
             # get the slowness and backazimuth of the vector
             abs_slow = np.sqrt(sx ** 2 + sy ** 2)
@@ -141,7 +148,7 @@ def ARF_process_f_s_spherical(
                 buff[int(k)] = abs(_sum) ** 2
             transff[i, j] = np.sum(buff)  # cumtrapz(buff, dx=fstep)[-1]
 
-            point = int(int(j) + int(slow_xs.shape[0] * i))
+            point = int(int(j) + int(slow_ys.shape[0] * i))
             ARF_arr[point] = np.array([sx, sy, np.sum(buff)])
 
     # normalise the array response function
@@ -4,7 +4,8 @@ from scipy.signal import hilbert
 from obspy import UTCDateTime
 from obspy.signal.util import util_geo_km
 from geo_sphere_calcs import deg_km_az_baz
-from obspy.taup import TauPyModel
+from travel_time_tables import get_model
+from predictions import predict_baz_slow
 from utilities import myround, clip_traces
 
 class array:
@@ -237,6 +238,47 @@ class array:
 
 
 
+    def pred_baz_slow_table(self, phases, one_eighty=True, mod="prem"):
+        """
+        Predicts the baz and horizontal slownesses of the given phases like
+        pred_baz_slow, but returns a typed structured array from the travel
+        time tables instead of strings. See predictions.predict_baz_slow.
+
+        Parameters
+        ----------
+        phases : list of strings
+            Phases for which the baz and horizontal slowness will be calculated
+
+        one_eighty : Bool
+            If True (default), major arc arrivals arrive from a backazimuth 180 degrees away.
+
+        mod : string
+            1D velocity model to use (default is PREM).
+
+        Returns
+        -------
+        preds : structured numpy array
+            One row for each arrival with the fields of predictions.prediction_dtype
+            e.g. preds[preds["phase"] == "SKS"]["slow_x_baz"].
+        """
+
+        center_lon, center_lat, center_elev = self.geometry(
+            distance="degrees", return_center=True
+            )
+
+        st = self.stream
+
+        return predict_baz_slow(
+            evla=float(st[0].stats.sac.evla),
+            evlo=float(st[0].stats.sac.evlo),
+            evdp=float(st[0].stats.sac.evdp),
+            stla=float(center_lat),
+            stlo=float(center_lon),
+            phases=phases,
+            one_eighty=one_eighty,
+            mod=mod,
+        )
+
     def pred_baz_slow(self, phases, one_eighty=True):
         """
         Predicts the baz and horizontal slownesses of the given phases using the infomation in the Obspy stream.
@@ -284,7 +326,7 @@ class array:
         )
 
         # use TauP to predict the slownesses
-        model = TauPyModel(model="prem")
+        model = get_model("prem")
 
         tap_out = model.get_travel_times(
             source_depth_in_km=float(evdp),
@@ -0,0 +1,1167 @@
+from numba import jit, prange
+import numpy as np
+from delay_tables import delay_table_xy, delay_table_pol
+from slow_vec_calcs import get_slow_baz, get_max_power_loc, get_max_power_loc_pol
+
+
+def trace_spectra(traces, sampling_rate, fmin=None, fmax=None):
+    """
+    Fourier transforms the traces once so they can be shifted and stacked
+    in the frequency domain. Only the frequencies between fmin and fmax are
+    kept so the cost of beamforming scales with the band of interest.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        2D array containing the traces the user wants to conduct analysis with. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    fmin : float
+        Minimum frequency to keep. If None (default), starts at 0 Hz.
+
+    fmax : float
+        Maximum frequency to keep. If None (default), goes up to the Nyquist frequency.
+
+    Returns
+    -------
+    spectra : 2D numpy array of complex floats
+        Spectra of the traces in the band, shape [n,nf].
+    freqs : 1D numpy array of floats
+        Frequencies of the spectra in Hz.
+    weights : 1D numpy array of floats
+        Weights of each frequency when summing power over the
+        one-sided spectrum (1 for 0 Hz and Nyquist, 2 otherwise).
+    band : 1D numpy array of ints
+        Indices of the kept frequencies in the full one-sided spectrum.
+    """
+
+    npts = traces.shape[1]
+    spectra = np.fft.rfft(traces, axis=1)
+    freqs = np.fft.rfftfreq(npts, d=1.0 / sampling_rate)
+
+    weights = np.full(freqs.shape, 2.0)
+    weights[0] = 1.0
+    if npts % 2 == 0:
+        weights[-1] = 1.0
+
+    keep = np.ones(freqs.shape, dtype=bool)
+    if fmin is not None:
+        keep &= freqs >= fmin
+    if fmax is not None:
+        keep &= freqs <= fmax
+
+    band = np.where(keep)[0]
+
+    return spectra[:, band], freqs[band], weights[band], band
+
+
+def phasor_spectra(phase_traces, sampling_rate):
+    """
+    Fourier transforms the unit phasors of the instantaneous phase traces.
+    These are used to get the phase stack for phase weighted stacking.
+    The spectra are returned with the zero frequency in the centre so the
+    frequencies are evenly spaced.
+
+    Parameters
+    ----------
+    phase_traces : 2D numpy array of floats
+        2D numpy array containing the instantaneous phase at each time point
+        that the user wants to use in the phase weighted stack. Shape of [n,p]
+        where n is the number of traces and p is the points in each trace.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    Returns
+    -------
+    spectra : 2D numpy array of complex floats
+        Spectra of the phasors, shape [n,p].
+    freqs : 1D numpy array of floats
+        Frequencies of the spectra in Hz.
+    """
+
+    npts = phase_traces.shape[1]
+    spectra = np.fft.fftshift(np.fft.fft(np.exp(phase_traces * 1j), axis=1), axes=1)
+    freqs = np.fft.fftshift(np.fft.fftfreq(npts, d=1.0 / sampling_rate))
+
+    return spectra, freqs
+
+
+@jit(nopython=True, fastmath=True)
+def beam_spectra_row(spectra, freqs, delay_row, sampling_rate):
+    """
+    Shifts and stacks the trace spectra for each set of point shifts in
+    delay_row. The shifts are applied as phase ramps so fractions of a
+    point are applied exactly.
+
+    Parameters
+    ----------
+    spectra : 2D numpy array of complex floats
+        Spectra of the traces, shape [n,nf].
+
+    freqs : 1D numpy array of floats
+        Evenly spaced frequencies of the spectra in Hz.
+
+    delay_row : 2D numpy array of floats
+        Point shifts for each station, shape [m,n] where m is the number
+        of slowness vectors e.g. one row of a delay table.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    Returns
+    -------
+    beams : 2D numpy array of complex floats
+        Summed (not averaged) spectra of shape [m,nf].
+    """
+
+    ntrace = spectra.shape[0]
+    nf = freqs.shape[0]
+    nbeam = delay_row.shape[0]
+
+    beams = np.zeros((nbeam, nf), dtype=np.complex128)
+
+    if nf == 0:
+        return beams
+
+    df = 0.0
+    if nf > 1:
+        df = freqs[1] - freqs[0]
+
+    for b in range(nbeam):
+        for n in range(ntrace):
+            tau = delay_row[b, n] / sampling_rate
+            # phase ramp is built up one frequency step at a time
+            ramp = np.exp(complex(0.0, -2.0 * np.pi * freqs[0] * tau))
+            step = np.exp(complex(0.0, -2.0 * np.pi * df * tau))
+            for k in range(nf):
+                beams[b, k] += spectra[n, k] * ramp
+                ramp *= step
+
+    return beams
+
+
+@jit(nopython=True, fastmath=True, parallel=True)
+def freq_power_grids(spectra, freqs, weights, npts, delay_table, sampling_rate):
+    """
+    Calculates the linear stack power and F-statistic power for each set
+    of point shifts in a delay table. The power is found from the beam
+    spectrum (Parseval's theorem) so the stacked traces are never formed.
+
+    Parameters
+    ----------
+    spectra : 2D numpy array of complex floats
+        Spectra of the traces from trace_spectra.
+
+    freqs : 1D numpy array of floats
+        Frequencies of the spectra from trace_spectra.
+
+    weights : 1D numpy array of floats
+        Weights of the frequencies from trace_spectra.
+
+    npts : int
+        Number of points in the traces.
+
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    Returns
+    -------
+    lin_tp : 2D numpy array of floats.
+        Linear stack power grid.
+    F_tp : 2D numpy array of floats.
+        F-statistic power grid.
+    """
+
+    ntrace = spectra.shape[0]
+    nf = freqs.shape[0]
+    ny = delay_table.shape[0]
+    nx = delay_table.shape[1]
+
+    lin_tp = np.zeros((ny, nx))
+    F_tp = np.zeros((ny, nx))
+
+    # the energy of each trace does not change when it is shifted
+    trace_energy = 0.0
+    for n in range(ntrace):
+        for k in range(nf):
+            trace_energy += weights[k] * (spectra[n, k].real ** 2 + spectra[n, k].imag ** 2)
+    trace_energy /= npts
+
+    for i in prange(ny):
+        beams = beam_spectra_row(spectra, freqs, delay_table[i], sampling_rate)
+        for j in range(nx):
+
+            power_lin = 0.0
+            for k in range(nf):
+                power_lin += weights[k] * (beams[j, k].real ** 2 + beams[j, k].imag ** 2)
+            power_lin /= npts * ntrace ** 2
+
+            # F statistic
+            Residuals_Power_Int = trace_energy - (ntrace * power_lin)
+            F = (ntrace - 1) * ((ntrace * power_lin) / Residuals_Power_Int)
+
+            lin_tp[i, j] = power_lin
+            F_tp[i, j] = power_lin * F
+
+    return lin_tp, F_tp
+
+
+def freq_pws_grid(
+    spectra, freqs, band, npts, phase_spectra, phase_freqs, delay_table, sampling_rate, degree
+):
+    """
+    Calculates the phase weighted stack power for each set of point shifts
+    in a delay table. The linear and phase stacks are shifted in the frequency
+    domain then transformed back to time for the phase weighting, one row of
+    the grid at a time.
+
+    Parameters
+    ----------
+    spectra : 2D numpy array of complex floats
+        Spectra of the traces from trace_spectra.
+
+    freqs : 1D numpy array of floats
+        Frequencies of the spectra from trace_spectra.
+
+    band : 1D numpy array of ints
+        Indices of the kept frequencies from trace_spectra.
+
+    npts : int
+        Number of points in the traces.
+
+    phase_spectra : 2D numpy array of complex floats
+        Spectra of the phasors from phasor_spectra.
+
+    phase_freqs : 1D numpy array of floats
+        Frequencies of the phasor spectra from phasor_spectra.
+
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    degree : float
+        The degree for the phase weighted stacking to reduce incoherent arrivals by.
+
+    Returns
+    -------
+    pws_tp : 2D numpy array of floats.
+        Phase weighted stacked power grid.
+    """
+
+    ntrace = spectra.shape[0]
+    ny = delay_table.shape[0]
+    nx = delay_table.shape[1]
+
+    pws_tp = np.zeros((ny, nx))
+    full = np.zeros((nx, (npts // 2) + 1), dtype=np.complex128)
+
+    for i in range(ny):
+        full[:, band] = beam_spectra_row(spectra, freqs, delay_table[i], sampling_rate)
+        lin_stacks = np.fft.irfft(full, n=npts, axis=1) / ntrace
+
+        phase_beams = beam_spectra_row(phase_spectra, phase_freqs, delay_table[i], sampling_rate)
+        phase_stacks = (
+            np.absolute(np.fft.ifft(np.fft.ifftshift(phase_beams, axes=1), axis=1)) / ntrace
+        )
+
+        phase_weight_stacks = lin_stacks * (phase_stacks**degree)
+        pws_tp[i] = np.sum(phase_weight_stacks**2, axis=1)
+
+    return pws_tp
+
+
+@jit(nopython=True, fastmath=True)
+def _xy_slow_baz(slow_xs, slow_ys):
+    """
+    Backazimuth and slowness of each slowness vector in the XY grid.
+    """
+
+    bazs = np.zeros((slow_ys.shape[0], slow_xs.shape[0]))
+    abs_slows = np.zeros((slow_ys.shape[0], slow_xs.shape[0]))
+
+    for i in range(slow_ys.shape[0]):
+        for j in range(slow_xs.shape[0]):
+            abs_slow, baz = get_slow_baz(slow_xs[j], slow_ys[i], "az")
+            abs_slows[i, j] = abs_slow
+            bazs[i, j] = baz
+
+    return abs_slows, bazs
+
+
+def _xy_grid(sxmin, sxmax, symin, symax, s_space):
+    """
+    Slowness values of the XY grid used by the BF_XY_* functions.
+    """
+
+    nsx = int(np.round(((sxmax - sxmin) / s_space), 0) + 1)
+    nsy = int(np.round(((symax - symin) / s_space), 0) + 1)
+
+    slow_xs = np.linspace(sxmin, sxmax + s_space, nsx)
+    slow_ys = np.linspace(symin, symax + s_space, nsy)
+
+    return slow_xs, slow_ys
+
+
+def _pol_grid(smin, smax, bazmin, bazmax, s_space, baz_space):
+    """
+    Slowness and backazimuth values of the polar grid used by the BF_Pol_* functions.
+    """
+
+    nslow = int(np.round(((smax - smin) / s_space) + 1))
+    nbaz = int(np.round(((bazmax - bazmin) / baz_space) + 1))
+
+    slows = np.linspace(smin, smax + s_space, nslow)
+    bazs = np.linspace(bazmin, bazmax + baz_space, nbaz)
+
+    return slows, bazs
+
+
+def _xy_results(slow_xs, slow_ys, tps):
+    """
+    Makes the results array [slow_x, slow_y, powers..., baz, abs_slow]
+    with each power column normalised.
+    """
+
+    abs_slows, bazs = _xy_slow_baz(slow_xs, slow_ys)
+    slow_x_grid, slow_y_grid = np.meshgrid(slow_xs, slow_ys)
+
+    columns = [slow_x_grid, slow_y_grid] + list(tps) + [bazs, abs_slows]
+    results_arr = np.array([c.T.ravel() for c in columns]).T
+
+    for c in range(2, 2 + len(tps)):
+        results_arr[:, c] /= results_arr[:, c].max()
+
+    return results_arr
+
+
+def _pol_results(slows, bazs, tps):
+    """
+    Makes the results array [baz, slow, powers...] with each power
+    column normalised.
+    """
+
+    bazs_grid, slows_grid = np.meshgrid(bazs, slows)
+
+    columns = [bazs_grid, slows_grid] + list(tps)
+    results_arr = np.array([c.T.ravel() for c in columns]).T
+
+    for c in range(2, 2 + len(tps)):
+        results_arr[:, c] /= results_arr[:, c].max()
+
+    return results_arr
+
+
+def _pol_peak(tp, slows, bazs, interpolate=False):
+    """
+    [baz, slow] of the maximum power value in a polar grid.
+    """
+
+    return get_max_power_loc_pol(tp, slows, bazs, interpolate)[0]
+
+
+def BF_XY_all_freq(
+    traces,
+    phase_traces,
+    sampling_rate,
+    geometry,
+    distance,
+    sxmin,
+    sxmax,
+    symin,
+    symax,
+    s_space,
+    degree,
+    fmin=None,
+    fmax=None,
+    type='circ',
+    elevation=False,
+    incidence=90,
+    delay_table=None,
+    interpolate=False,
+):
+    """
+    Frequency domain version of BF_XY_all. The traces are Fourier transformed once
+    and each slowness vector is applied as a phase ramp, so the time shifts
+    are not rounded to whole points. This means the traces can be decimated
+    before beamforming without losing accuracy in the beams.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        2D array containing the traces the user wants to conduct analysis with. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+
+    phase_traces : 2D numpy array of floats
+        2D numpy array containing the instantaneous phase at each time point
+        that the user wants to use in the phase weighted stack. Shape of [n,p]
+        where n is the number of traces and p is the points in each trace.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    sxmax : float
+        Maximum magnitude of slowness on x axis, used for creating the slowness grid.
+
+    sxmin : float
+        Minimun magnitude of the slowness on x axis, used for creating the slowness grid.
+
+    symax : float
+        Maximum magnitude of slowness on y axis, used for creating the slowness grid.
+
+    symin : float
+        Minimun magnitude of the slowness on y axis, used for creating the slowness grid.
+
+    s_space : float
+        The slowness interval for each step e.g. 0.1.
+
+    degree : float
+        The degree for the phase weighted stacking to reduce incoherent arrivals by.
+
+    fmin : float
+        Minimum frequency used in the linear stack and F-statistic. If None
+        (default), all frequencies up to fmax are used.
+
+    fmax : float
+        Maximum frequency used in the linear stack and F-statistic. If None
+        (default), all frequencies above fmin are used.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_xy.
+        If None (default), the table is calculated here.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
+    Returns
+    -------
+    lin_tp : 2D numpy array of floats.
+        Linear stack power grid.
+    pws_tp : 2D numpy array of floats.
+        Phase weighted stacked power grid.
+    f_tp : 2D numpy array of floats.
+        F-statistic power grid.
+    results_arr : 2D numpy array of floats.
+        Contains power values for:
+        [slow_x, slow_y, power_pws, power_F,
+        power_lin, baz, abs_slow]
+    peaks : 2D array of floats.
+        Array contains 3 rows describing the X,Y points
+        of the maximum power value for linear, phase
+        weighted and F-statistic respectively.
+    """
+
+    if delay_table is None:
+        delay_table = delay_table_xy(
+            geometry=geometry,
+            distance=distance,
+            sxmin=sxmin,
+            sxmax=sxmax,
+            symin=symin,
+            symax=symax,
+            s_space=s_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+
+    npts = traces.shape[1]
+    spectra, freqs, weights, band = trace_spectra(traces, sampling_rate, fmin, fmax)
+    phase_spectra, phase_freqs = phasor_spectra(phase_traces, sampling_rate)
+
+    lin_tp, F_tp = freq_power_grids(spectra, freqs, weights, npts, delay_table, sampling_rate)
+    pws_tp = freq_pws_grid(
+        spectra, freqs, band, npts, phase_spectra, phase_freqs, delay_table, sampling_rate, degree
+    )
+
+    slow_xs, slow_ys = _xy_grid(sxmin, sxmax, symin, symax, s_space)
+    results_arr = _xy_results(slow_xs, slow_ys, [pws_tp, F_tp, lin_tp])
+
+    # now find the peak in this:
+    peaks = np.empty((3, 2))
+    peaks[0] = get_max_power_loc(
+        tp=lin_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
+    )
+    peaks[1] = get_max_power_loc(
+        tp=pws_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
+    )
+    peaks[2] = get_max_power_loc(
+        tp=F_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
+    )
+
+    return lin_tp, pws_tp, F_tp, results_arr, peaks
+
+
+def BF_XY_Lin_freq(
+    traces,
+    sampling_rate,
+    geometry,
+    distance,
+    sxmin,
+    sxmax,
+    symin,
+    symax,
+    s_space,
+    fmin=None,
+    fmax=None,
+    type='circ',
+    elevation=False,
+    incidence=90,
+    delay_table=None,
+    interpolate=False,
+):
+    """
+    Frequency domain version of BF_XY_Lin. See BF_XY_all_freq for details.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        2D array containing the traces the user wants to conduct analysis with. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+    sxmax : float
+        Maximum magnitude of slowness on x axis, used for creating the slowness grid.
+    sxmin : float
+        Minimun magnitude of the slowness on x axis, used for creating the slowness grid.
+    symax : float
+        Maximum magnitude of slowness on y axis, used for creating the slowness grid.
+    symin : float
+        Minimun magnitude of the slowness on y axis, used for creating the slowness grid.
+    s_space : float
+        The slowness interval for each step e.g. 0.1.
+    fmin : float
+        Minimum frequency used in the stack. If None (default), starts at 0 Hz.
+    fmax : float
+        Maximum frequency used in the stack. If None (default), goes up to Nyquist.
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront. default
+        is 'circ'.
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_xy.
+        If None (default), the table is calculated here.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
+    Returns
+    -------
+    lin_tp : 2D numpy array of floats.
+        Linear stack power grid.
+    results_arr : 2D numpy array of floats.
+        Contains power values for:
+        [slow_x, slow_y, power_lin, baz, abs_slow]
+    peaks : 2D array of floats.
+        Array contains 1 row describing the X,Y point
+        of the maximum power value.
+    """
+
+    if delay_table is None:
+        delay_table = delay_table_xy(
+            geometry=geometry,
+            distance=distance,
+            sxmin=sxmin,
+            sxmax=sxmax,
+            symin=symin,
+            symax=symax,
+            s_space=s_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+
+    npts = traces.shape[1]
+    spectra, freqs, weights, band = trace_spectra(traces, sampling_rate, fmin, fmax)
+
+    lin_tp, F_tp = freq_power_grids(spectra, freqs, weights, npts, delay_table, sampling_rate)
+
+    slow_xs, slow_ys = _xy_grid(sxmin, sxmax, symin, symax, s_space)
+    results_arr = _xy_results(slow_xs, slow_ys, [lin_tp])
+
+    peaks = np.empty((1, 2))
+    peaks[0] = get_max_power_loc(
+        tp=lin_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
+    )
+
+    return lin_tp, results_arr, peaks
+
+
+def BF_XY_PWS_freq(
+    traces,
+    phase_traces,
+    sampling_rate,
+    geometry,
+    distance,
+    sxmin,
+    sxmax,
+    symin,
+    symax,
+    s_space,
+    degree,
+    fmin=None,
+    fmax=None,
+    type='circ',
+    elevation=False,
+    incidence=90,
+    delay_table=None,
+    interpolate=False,
+):
+    """
+    Frequency domain version of BF_XY_PWS. See BF_XY_all_freq for details.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        2D array containing the traces the user wants to conduct analysis with. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+
+    phase_traces : 2D numpy array of floats
+        2D numpy array containing the instantaneous phase at each time point
+        that the user wants to use in the phase weighted stack. Shape of [n,p]
+        where n is the number of traces and p is the points in each trace.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth].
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    sxmax : float
+        Maximum magnitude of slowness on x axis, used for creating the slowness grid.
+
+    sxmin : float
+        Minimun magnitude of the slowness on x axis, used for creating the slowness grid.
+
+    symax : float
+        Maximum magnitude of slowness on y axis, used for creating the slowness grid.
+
+    symin : float
+        Minimun magnitude of the slowness on y axis, used for creating the slowness grid.
+
+    s_space : float
+        The slowness interval for each step e.g. 0.1.
+
+    degree : float
+        The degree for the phase weighted stacking to reduce incoherent arrivals by.
+
+    fmin : float
+        Minimum frequency used in the linear stack. If None (default), starts at 0 Hz.
+
+    fmax : float
+        Maximum frequency used in the linear stack. If None (default), goes up to Nyquist.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_xy.
+        If None (default), the table is calculated here.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
+    Returns
+    -------
+    pws_tp : 2D numpy array of floats.
+        Phase weighted stacked power grid.
+    results_arr : 2D numpy array of floats.
+        Contains power values for:
+        [slow_x, slow_y, power_pws, baz, abs_slow]
+    peaks : 2D array of floats.
+        Array contains 1 row describing the X,Y point
+        of the maximum power value.
+    """
+
+    if delay_table is None:
+        delay_table = delay_table_xy(
+            geometry=geometry,
+            distance=distance,
+            sxmin=sxmin,
+            sxmax=sxmax,
+            symin=symin,
+            symax=symax,
+            s_space=s_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+
+    npts = traces.shape[1]
+    spectra, freqs, weights, band = trace_spectra(traces, sampling_rate, fmin, fmax)
+    phase_spectra, phase_freqs = phasor_spectra(phase_traces, sampling_rate)
+
+    pws_tp = freq_pws_grid(
+        spectra, freqs, band, npts, phase_spectra, phase_freqs, delay_table, sampling_rate, degree
+    )
+
+    slow_xs, slow_ys = _xy_grid(sxmin, sxmax, symin, symax, s_space)
+    results_arr = _xy_results(slow_xs, slow_ys, [pws_tp])
+
+    peaks = np.empty((1, 2))
+    peaks[0] = get_max_power_loc(
+        tp=pws_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
+    )
+
+    return pws_tp, results_arr, peaks
+
+
+def BF_Pol_all_freq(
+    traces,
+    phase_traces,
+    sampling_rate,
+    geometry,
+    distance,
+    smin,
+    smax,
+    bazmin,
+    bazmax,
+    s_space,
+    baz_space,
+    degree,
+    fmin=None,
+    fmax=None,
+    type='circ',
+    elevation=False,
+    incidence=90,
+    delay_table=None,
+    interpolate=False,
+):
+    """
+    Frequency domain version of BF_Pol_all. The traces are Fourier transformed once
+    and each slowness vector is applied as a phase ramp, so the time shifts
+    are not rounded to whole points.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        2D array containing the traces the user wants to conduct analysis with. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+
+    phase_traces : 2D numpy array of floats
+        2D numpy array containing the instantaneous phase at each time point
+        that the user wants to use in the phase weighted stack. Shape of [n,p]
+        where n is the number of traces and p is the points in each trace.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    smax : float
+        Maximum magnitude of slowness.
+
+    smin : float
+        Minimun magnitude of the slowness.
+
+    bazmin : float
+        Minimum backazimuth value to search over.
+
+    bazmax : float
+        Maximum backazimuth value to search over.
+
+    s_space : float
+        The slowness interval for each step e.g. 0.05.
+
+    baz_space : float
+        The backazimuth interval for each step e.g. 0.1.
+
+    degree : float
+        The degree for the phase weighted stacking to reduce incoherent arrivals by.
+
+    fmin : float
+        Minimum frequency used in the linear stack and F-statistic. If None
+        (default), all frequencies up to fmax are used.
+
+    fmax : float
+        Maximum frequency used in the linear stack and F-statistic. If None
+        (default), all frequencies above fmin are used.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_pol.
+        If None (default), the table is calculated here.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
+    Returns
+    -------
+    lin_tp : 2D numpy array of floats.
+        Linear stack power grid.
+    pws_tp : 2D numpy array of floats.
+        Phase weighted stacked power grid.
+    f_tp : 2D numpy array of floats.
+        F-statistic power grid.
+    results_arr : 2D numpy array of floats.
+        Array contains values for:
+        [baz, slow, power_pws, power_F, power_lin]
+    peaks : 2D numpy array of floats.
+        2D array with 3 rows containing the backazimuth, horizontal
+        slowness points of the maximum power value for
+        linear, phase weighted and F-statistic respectively.
+    """
+
+    if delay_table is None:
+        delay_table = delay_table_pol(
+            geometry=geometry,
+            distance=distance,
+            smin=smin,
+            smax=smax,
+            bazmin=bazmin,
+            bazmax=bazmax,
+            s_space=s_space,
+            baz_space=baz_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+
+    npts = traces.shape[1]
+    spectra, freqs, weights, band = trace_spectra(traces, sampling_rate, fmin, fmax)
+    phase_spectra, phase_freqs = phasor_spectra(phase_traces, sampling_rate)
+
+    lin_tp, F_tp = freq_power_grids(spectra, freqs, weights, npts, delay_table, sampling_rate)
+    pws_tp = freq_pws_grid(
+        spectra, freqs, band, npts, phase_spectra, phase_freqs, delay_table, sampling_rate, degree
+    )
+
+    slows, bazs = _pol_grid(smin, smax, bazmin, bazmax, s_space, baz_space)
+    results_arr = _pol_results(slows, bazs, [pws_tp, F_tp, lin_tp])
+
+    peaks = np.zeros((3, 2))
+    peaks[0] = _pol_peak(lin_tp, slows, bazs, interpolate)
+    peaks[1] = _pol_peak(pws_tp, slows, bazs, interpolate)
+    peaks[2] = _pol_peak(F_tp, slows, bazs, interpolate)
+
+    return lin_tp, pws_tp, F_tp, results_arr, peaks
+
+
+def BF_Pol_Lin_freq(
+    traces,
+    sampling_rate,
+    geometry,
+    distance,
+    smin,
+    smax,
+    bazmin,
+    bazmax,
+    s_space,
+    baz_space,
+    fmin=None,
+    fmax=None,
+    type='circ',
+    elevation=False,
+    incidence=90,
+    delay_table=None,
+    interpolate=False,
+):
+    """
+    Frequency domain version of BF_Pol_Lin. See BF_Pol_all_freq for details.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        2D array containing the traces the user wants to conduct analysis with. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    smax : float
+        Maximum magnitude of slowness.
+
+    smin : float
+        Minimun magnitude of the slowness.
+
+    bazmin : float
+        Minimum backazimuth value to search over.
+
+    bazmax : float
+        Maximum backazimuth value to search over.
+
+    s_space : float
+        The slowness interval for each step e.g. 0.05.
+
+    baz_space : float
+        The backazimuth interval for each step e.g. 0.1.
+
+    fmin : float
+        Minimum frequency used in the stack. If None (default), starts at 0 Hz.
+
+    fmax : float
+        Maximum frequency used in the stack. If None (default), goes up to Nyquist.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_pol.
+        If None (default), the table is calculated here.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
+    Returns
+    -------
+    lin_tp : 2D numpy array of floats.
+        Linear stack power grid.
+    results_arr : 2D numpy array of floats.
+        Array contains values for:
+        [baz, slow, power_lin]
+    peaks : 2D numpy array of floats.
+        2D array with 1 row containing the backazimuth, horizontal
+        slowness point of the maximum power value.
+    """
+
+    if delay_table is None:
+        delay_table = delay_table_pol(
+            geometry=geometry,
+            distance=distance,
+            smin=smin,
+            smax=smax,
+            bazmin=bazmin,
+            bazmax=bazmax,
+            s_space=s_space,
+            baz_space=baz_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+
+    npts = traces.shape[1]
+    spectra, freqs, weights, band = trace_spectra(traces, sampling_rate, fmin, fmax)
+
+    lin_tp, F_tp = freq_power_grids(spectra, freqs, weights, npts, delay_table, sampling_rate)
+
+    slows, bazs = _pol_grid(smin, smax, bazmin, bazmax, s_space, baz_space)
+    results_arr = _pol_results(slows, bazs, [lin_tp])
+
+    peaks = np.zeros((1, 2))
+    peaks[0] = _pol_peak(lin_tp, slows, bazs, interpolate)
+
+    return lin_tp, results_arr, peaks
+
+
+def BF_Pol_PWS_freq(
+    traces,
+    phase_traces,
+    sampling_rate,
+    geometry,
+    distance,
+    smin,
+    smax,
+    bazmin,
+    bazmax,
+    s_space,
+    baz_space,
+    degree,
+    fmin=None,
+    fmax=None,
+    type='circ',
+    elevation=False,
+    incidence=90,
+    delay_table=None,
+    interpolate=False,
+):
+    """
+    Frequency domain version of BF_Pol_PWS. See BF_Pol_all_freq for details.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        2D array containing the traces the user wants to conduct analysis with. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+
+    phase_traces : 2D numpy array of floats
+        2D numpy array containing the instantaneous phase at each time point
+        that the user wants to use in the phase weighted stack. Shape of [n,p]
+        where n is the number of traces and p is the points in each trace.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    smax : float
+        Maximum magnitude of slowness.
+
+    smin : float
+        Minimun magnitude of the slowness.
+
+    bazmin : float
+        Minimum backazimuth value to search over.
+
+    bazmax : float
+        Maximum backazimuth value to search over.
+
+    s_space : float
+        The slowness interval for each step e.g. 0.05.
+
+    baz_space : float
+        The backazimuth interval for each step e.g. 0.1.
+
+    degree : float
+        The degree for the phase weighted stacking to reduce incoherent arrivals by.
+
+    fmin : float
+        Minimum frequency used in the linear stack. If None (default), starts at 0 Hz.
+
+    fmax : float
+        Maximum frequency used in the linear stack. If None (default), goes up to Nyquist.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_pol.
+        If None (default), the table is calculated here.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
+    Returns
+    -------
+    pws_tp : 2D numpy array of floats.
+        Phase weighted stacked power grid.
+    results_arr : 2D numpy array of floats.
+        Array contains values for:
+        [baz, slow, power_pws]
+    peaks : 2D numpy array of floats.
+        2D array with 1 row containing the backazimuth, horizontal
+        slowness point of the maximum power value.
+    """
+
+    if delay_table is None:
+        delay_table = delay_table_pol(
+            geometry=geometry,
+            distance=distance,
+            smin=smin,
+            smax=smax,
+            bazmin=bazmin,
+            bazmax=bazmax,
+            s_space=s_space,
+            baz_space=baz_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+
+    npts = traces.shape[1]
+    spectra, freqs, weights, band = trace_spectra(traces, sampling_rate, fmin, fmax)
+    phase_spectra, phase_freqs = phasor_spectra(phase_traces, sampling_rate)
+
+    pws_tp = freq_pws_grid(
+        spectra, freqs, band, npts, phase_spectra, phase_freqs, delay_table, sampling_rate, degree
+    )
+
+    slows, bazs = _pol_grid(smin, smax, bazmin, bazmax, s_space, baz_space)
+    results_arr = _pol_results(slows, bazs, [pws_tp])
+
+    peaks = np.zeros((1, 2))
+    peaks[0] = _pol_peak(pws_tp, slows, bazs, interpolate)
+
+    return pws_tp, results_arr, peaks
@@ -1,11 +1,12 @@
-from numba import jit
+from numba import jit, prange
 import numpy as np
-from shift_stack import shift_traces, roll_2D, linear_stack_baz_slow
-from slow_vec_calcs import get_slow_baz, get_max_power_loc
+from shift_stack import shift_traces, shift_stack_2D, shift_stack_phase_2D, linear_stack_baz_slow
+from delay_tables import delay_table_pol
+from slow_vec_calcs import get_slow_baz, get_max_power_loc, get_max_power_loc_pol
 
 
 
-@jit(nopython=True, fastmath=True)
+@jit(nopython=True, fastmath=True, parallel=True)
 def BF_Pol_all(
     traces,
     phase_traces,
@@ -21,7 +22,9 @@ def BF_Pol_all(
     degree,
     type='circ',
     elevation=False,
-    incidence=90
+    incidence=90,
+    delay_table=None,
+    interpolate=False
 ):
     """
     Function to search over a range of slowness vectors described in polar coordinates and estimates the
@@ -79,6 +82,15 @@ def BF_Pol_all(
         Not used unless elevation is True. Give incidence angle from vertical
         at the centre of the array to calculate elevation corrections. Default is 90.
 
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_pol.
+        If None (default), the table is calculated here.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
     Returns
     -------
     pws_tp : 2D numpy array of floats.
@@ -115,65 +127,60 @@ def BF_Pol_all(
     F_tp = np.zeros((nslow, nbaz))
     results_arr = np.zeros((nbaz * nslow, 5))
 
+    # unit phasors are shift invariant so only need calculating once
+    phasors = np.exp(phase_traces * 1j)
+
+    # total energy of the traces does not change when they are shifted
+    trace_energy = np.sum(traces**2)
+
     slows = np.linspace(smin, smax + s_space, nslow)
     bazs = np.linspace(bazmin, bazmax + baz_space, nbaz)
 
-    for i in range(slows.shape[0]):
+    # point shifts for each station at each slowness vector
+    if delay_table is None:
+        pts_table = delay_table_pol(
+            geometry=geometry,
+            distance=distance,
+            smin=smin,
+            smax=smax,
+            bazmin=bazmin,
+            bazmax=bazmax,
+            s_space=s_space,
+            baz_space=baz_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+    else:
+        pts_table = delay_table
+
+    for i in prange(slows.shape[0]):
+        # stack buffers private to the thread running this row
+        lin_stack = np.zeros(traces.shape[1])
+        phase_stack = np.zeros(traces.shape[1])
+
         for j in range(bazs.shape[0]):
 
             baz = float(bazs[int(j)])
             slow = float(slows[int(i)])
 
-            # get the slowness and backazimuth of the vector
-
-            # Call function to shift traces
-            shifted_traces_lin = shift_traces(
-                traces=traces,
-                geometry=geometry,
-                abs_slow=float(slow),
-                baz=float(baz),
-                distance=float(distance),
-                centre_x=float(centre_x),
-                centre_y=float(centre_y),
-                sampling_rate=sampling_rate,
-                type=type,
-                elevation=elevation,
-                incidence=incidence
-            )
-            shifted_phase_traces = shift_traces(
-                traces=phase_traces,
-                geometry=geometry,
-                abs_slow=slow,
-                baz=baz,
-                distance=distance,
-                centre_x=centre_x,
-                centre_y=centre_y,
-                sampling_rate=sampling_rate,
-                type=type,
-                elevation=elevation,
-                incidence=incidence
-            )
-
-            lin_stack = np.sum(shifted_traces_lin, axis=0) / ntrace
-            phase_stack = (
-                np.absolute(np.sum(np.exp(shifted_phase_traces * 1j), axis=0)) / ntrace
+            # shift and stack the traces and phasors in one pass
+            lin_stack, phase_stack = shift_stack_phase_2D(
+                traces, phasors, pts_table[i, j], lin_stack, phase_stack
             )
             phase_weight_stack = lin_stack * (phase_stack**degree)
 
-            Residuals_Trace_Beam = np.subtract(shifted_traces_lin, lin_stack)
-            Residuals_Trace_Beam_Power = np.sum(
-                (Residuals_Trace_Beam**2), axis=0
-            )
-
-            Residuals_Power_Int = np.sum(Residuals_Trace_Beam_Power)
-
             power_lin = np.sum(lin_stack**2)
             power_pws = np.sum(phase_weight_stack**2)
 
+            # sum of squared residuals between the shifted traces and the beam
+            Residuals_Power_Int = trace_energy - (ntrace * power_lin)
+
             lin_tp[i, j] = power_lin
             pws_tp[i, j] = power_pws
-            F = (shifted_traces_lin.shape[0] - 1) * (
-                (shifted_traces_lin.shape[0] * power_lin) / (Residuals_Power_Int)
+            F = (ntrace - 1) * (
+                (ntrace * power_lin) / (Residuals_Power_Int)
             )
 
             F_tp[i, j] = power_lin * F
@@ -193,26 +200,13 @@ def BF_Pol_all(
 
     peaks = np.zeros((3, 2))
 
-    iy_lin, ix_lin = np.where(lin_tp == np.amax(lin_tp))
-    iy_pws, ix_pws = np.where(pws_tp == np.amax(pws_tp))
-    iy_F, ix_F = np.where(F_tp == np.amax(F_tp))
-
-    slow_max_lin = slows[iy_lin[0]]
-    baz_max_lin = bazs[ix_lin[0]]
-
-    slow_max_pws = slows[iy_pws[0]]
-    baz_max_pws = bazs[ix_pws[0]]
-
-    slow_max_F = slows[iy_F[0]]
-    baz_max_F = bazs[ix_F[0]]
-
     # Numba doesnt like strings...
     # PWS
     # Lin
     # F_stat
-    peaks[int(0)] = np.array([baz_max_lin, slow_max_lin])
-    peaks[int(1)] = np.array([baz_max_pws, slow_max_pws])
-    peaks[int(2)] = np.array([baz_max_F, slow_max_F])
+    peaks[int(0)] = get_max_power_loc_pol(lin_tp, slows, bazs, interpolate)[0]
+    peaks[int(1)] = get_max_power_loc_pol(pws_tp, slows, bazs, interpolate)[0]
+    peaks[int(2)] = get_max_power_loc_pol(F_tp, slows, bazs, interpolate)[0]
 
     results_arr[:, 2] /= results_arr[:, 2].max()
     results_arr[:, 3] /= results_arr[:, 3].max()
@@ -221,7 +215,7 @@ def BF_Pol_all(
     return lin_tp, pws_tp, F_tp, results_arr, peaks
 
 
-@jit(nopython=True, fastmath=True)
+@jit(nopython=True, fastmath=True, parallel=True)
 def BF_Pol_Lin(
     traces,
     sampling_rate,
@@ -235,7 +229,9 @@ def BF_Pol_Lin(
     baz_space,
     type='circ',
     elevation=False,
-    incidence=90
+    incidence=90,
+    delay_table=None,
+    interpolate=False
 ):
     """
     Function to search over a range of slowness vectors described in polar coordinates and estimates the
@@ -285,6 +281,15 @@ def BF_Pol_Lin(
         Not used unless elevation is True. Give incidence angle from vertical
         at the centre of the array to calculate elevation corrections. Default is 90.
 
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_pol.
+        If None (default), the table is calculated here.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
     Returns
     -------
     lin_tp : 2D numpy array of floats.
@@ -317,27 +322,36 @@ def BF_Pol_Lin(
     slows = np.linspace(smin, smax + s_space, nslow)
     bazs = np.linspace(bazmin, bazmax + baz_space, nbaz)
 
-    for i, slow in enumerate(slows):
-        for j, baz in enumerate(bazs):
+    # point shifts for each station at each slowness vector
+    if delay_table is None:
+        pts_table = delay_table_pol(
+            geometry=geometry,
+            distance=distance,
+            smin=smin,
+            smax=smax,
+            bazmin=bazmin,
+            bazmax=bazmax,
+            s_space=s_space,
+            baz_space=baz_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+    else:
+        pts_table = delay_table
+
+    for i in prange(slows.shape[0]):
+        # stack buffer private to the thread running this row
+        lin_stack = np.zeros(traces.shape[1])
 
-            # get the slowness and backazimuth of the vector
+        for j in range(bazs.shape[0]):
 
-            # Call function to shift traces
-            shifted_traces_lin = shift_traces(
-                traces=traces,
-                geometry=geometry,
-                abs_slow=float(slow),
-                baz=float(baz),
-                distance=float(distance),
-                centre_x=float(centre_x),
-                centre_y=float(centre_y),
-                sampling_rate=sampling_rate,
-                type=type,
-                elevation=elevation,
-                incidence=incidence
-            )
+            slow = float(slows[int(i)])
+            baz = float(bazs[int(j)])
 
-            lin_stack = np.sum(shifted_traces_lin, axis=0) / ntrace
+            # Call function to shift traces
+            lin_stack = shift_stack_2D(traces, pts_table[i, j], lin_stack)
 
             power_lin = np.sum(lin_stack ** 2)
 
@@ -350,12 +364,7 @@ def BF_Pol_Lin(
 
     peaks = np.zeros((1, 2))
 
-    iy_lin, ix_lin = np.where(lin_tp == np.amax(lin_tp))
-
-    slow_max_lin = slows[iy_lin[0]]
-    baz_max_lin = bazs[ix_lin[0]]
-
-    peaks[int(0)] = np.array([baz_max_lin, slow_max_lin])
+    peaks[int(0)] = get_max_power_loc_pol(lin_tp, slows, bazs, interpolate)[0]
 
     results_arr[:, 2] /= results_arr[:, 2].max()
 
@@ -364,7 +373,7 @@ def BF_Pol_Lin(
     return lin_tp, results_arr, peaks
 
 
-@jit(nopython=True, fastmath=True)
+@jit(nopython=True, fastmath=True, parallel=True)
 def BF_Pol_PWS(
     traces,
     phase_traces,
@@ -380,7 +389,9 @@ def BF_Pol_PWS(
     degree,
     type='circ',
     elevation=False,
-    incidence=90
+    incidence=90,
+    delay_table=None,
+    interpolate=False
 ):
     """
     Function to search over a range of slowness vectors described in polar coordinates and estimates the
@@ -438,6 +449,15 @@ def BF_Pol_PWS(
         Not used unless elevation is True. Give incidence angle from vertical
         at the centre of the array to calculate elevation corrections. Default is 90.
 
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_pol.
+        If None (default), the table is calculated here.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
     Returns
     -------
     pws_tp : 2D numpy array of floats.
@@ -467,10 +487,36 @@ def BF_Pol_PWS(
     pws_tp = np.zeros((nslow, nbaz))
     results_arr = np.zeros((nbaz * nslow, 3))
 
+    # unit phasors are shift invariant so only need calculating once
+    phasors = np.exp(phase_traces * 1j)
+
     slows = np.linspace(smin, smax + s_space, nslow)
     bazs = np.linspace(bazmin, bazmax + baz_space, nbaz)
 
-    for i in range(slows.shape[0]):
+    # point shifts for each station at each slowness vector
+    if delay_table is None:
+        pts_table = delay_table_pol(
+            geometry=geometry,
+            distance=distance,
+            smin=smin,
+            smax=smax,
+            bazmin=bazmin,
+            bazmax=bazmax,
+            s_space=s_space,
+            baz_space=baz_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+    else:
+        pts_table = delay_table
+
+    for i in prange(slows.shape[0]):
+        # stack buffers private to the thread running this row
+        lin_stack = np.zeros(traces.shape[1])
+        phase_stack = np.zeros(traces.shape[1])
+
         for j in range(bazs.shape[0]):
 
             baz = float(bazs[int(j)])
@@ -479,36 +525,8 @@ def BF_Pol_PWS(
             # get the slowness and backazimuth of the vector
 
             # Call function to shift traces
-            shifted_traces_lin = shift_traces(
-                traces=traces,
-                geometry=geometry,
-                abs_slow=float(slow),
-                baz=float(baz),
-                distance=float(distance),
-                centre_x=float(centre_x),
-                centre_y=float(centre_y),
-                sampling_rate=sampling_rate,
-                type=type,
-                elevation=elevation,
-                incidence=incidence
-            )
-            shifted_phase_traces = shift_traces(
-                traces=phase_traces,
-                geometry=geometry,
-                abs_slow=slow,
-                baz=baz,
-                distance=distance,
-                centre_x=centre_x,
-                centre_y=centre_y,
-                sampling_rate=sampling_rate,
-                type=type,
-                elevation=elevation,
-                incidence=incidence
-            )
-
-            lin_stack = np.sum(shifted_traces_lin, axis=0) / ntrace
-            phase_stack = (
-                np.absolute(np.sum(np.exp(shifted_phase_traces * 1j), axis=0)) / ntrace
+            lin_stack, phase_stack = shift_stack_phase_2D(
+                traces, phasors, pts_table[i, j], lin_stack, phase_stack
             )
             phase_weight_stack = lin_stack * (phase_stack** degree)
 
@@ -523,11 +541,7 @@ def BF_Pol_PWS(
 
     peaks = np.zeros((1, 2))
 
-    iy_pws, ix_pws = np.where(pws_tp == np.amax(pws_tp))
-    slow_max_pws = slows[iy_pws[0]]
-    baz_max_pws = bazs[ix_pws[0]]
-
-    peaks[int(0)] = np.array([baz_max_pws, slow_max_pws])
+    peaks[int(0)] = get_max_power_loc_pol(pws_tp, slows, bazs, interpolate)[0]
 
     results_arr[:, 2] /= results_arr[:, 2].max()
 
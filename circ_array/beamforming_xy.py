@@ -1,11 +1,12 @@
 
-from numba import jit
+from numba import jit, prange, objmode
 import numpy as np
-from shift_stack import shift_traces, roll_2D
+from shift_stack import shift_traces, shift_stack_2D, shift_stack_phase_2D, shift_accumulate
+from delay_tables import delay_table_xy, shift_vector_index
 from slow_vec_calcs import get_slow_baz, get_max_power_loc
 
 
-@jit(nopython=True, fastmath=True)
+@jit(nopython=True, fastmath=True, parallel=True)
 def BF_XY_all(
     traces,
     phase_traces,
@@ -21,6 +22,9 @@ def BF_XY_all(
     type='circ',
     elevation=False,
     incidence=90,
+    delay_table=None,
+    memoize=False,
+    interpolate=False,
 ):
     """
     Function to search over a range of slowness vectors, described in cartesian coordinates, and measure
@@ -75,6 +79,21 @@ def BF_XY_all(
         Not used unless elevation is True. Give incidence angle from vertical
         at the centre of the array to calculate elevation corrections. Default is 90.
 
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_xy.
+        If None (default), the table is calculated here.
+
+    memoize : bool
+        If True, grid points where every station is shifted by the same whole
+        number of points share one stack instead of recalculating it.
+        shift_vector_stats gives how many stacks this saves for a delay table.
+        Default is False.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
     Returns
     -------
     pws_tp : 2D numpy array of floats.
@@ -112,12 +131,46 @@ def BF_XY_all(
     pws_tp = np.zeros((nsy, nsx))
     F_tp = np.zeros((nsy, nsx))
 
+    # unit phasors are shift invariant so only need calculating once
+    phasors = np.exp(phase_traces * 1j)
+
+    # total energy of the traces does not change when they are shifted
+    trace_energy = np.sum(traces**2)
+
     # calculate slowness values in the grid
     slow_xs = np.linspace(sxmin, sxmax + s_space, nsx)
     slow_ys = np.linspace(symin, symax + s_space, nsy)
 
+    # point shifts for each station at each slowness vector
+    if delay_table is None:
+        pts_table = delay_table_xy(
+            geometry=geometry,
+            distance=distance,
+            sxmin=sxmin,
+            sxmax=sxmax,
+            symin=symin,
+            symax=symax,
+            s_space=s_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+    else:
+        pts_table = delay_table
+
+    # grid points with the same whole number shifts give the same stack
+    if memoize:
+        first_index = shift_vector_index(pts_table).reshape((nsy, nsx))
+    else:
+        first_index = np.arange(nsy * nsx).reshape((nsy, nsx))
+
     # loop over slowness grid
-    for i in range(slow_ys.shape[0]):
+    for i in prange(slow_ys.shape[0]):
+        # stack buffers private to the thread running this row
+        lin_stack = np.zeros(traces.shape[1])
+        phase_stack = np.zeros(traces.shape[1])
+
         for j in range(slow_xs.shape[0]):
 
             sx = float(slow_xs[int(j)])
@@ -126,59 +179,32 @@ def BF_XY_all(
             # get the slowness and backazimuth of the vector
             abs_slow, baz = get_slow_baz(sx, sy, "az")
 
-            point = int(int(i) + int(slow_xs.shape[0] * j))
+            point = int(int(i) + int(slow_ys.shape[0] * j))
 
-            # Call function to shift traces
-            shifted_traces_lin = shift_traces(
-                traces=traces,
-                geometry=geometry,
-                abs_slow=float(abs_slow),
-                baz=float(baz),
-                distance=float(distance),
-                centre_x=float(centre_x),
-                centre_y=float(centre_y),
-                sampling_rate=sampling_rate,
-                type=type,
-                elevation=elevation,
-                incidence=incidence
-            )
+            # only stack at the first grid point with these shifts,
+            # the others are copied from it after the loop
+            if first_index[i, j] != (i * nsx) + j:
+                results_arr[point] = np.array([sx, sy, 0.0, 0.0, 0.0, baz, abs_slow])
+                continue
 
-            lin_stack = np.sum(shifted_traces_lin, axis=0) / ntrace
+            # shift and stack the traces and phasors in one pass
+            lin_stack, phase_stack = shift_stack_phase_2D(
+                traces, phasors, pts_table[i, j], lin_stack, phase_stack
+            )
 
             # linear stack
             power_lin = np.sum(lin_stack**2)
 
             # phase weighted stack
-            shifted_phase_traces = shift_traces(
-                traces=phase_traces,
-                geometry=geometry,
-                abs_slow=abs_slow,
-                baz=baz,
-                distance=distance,
-                centre_x=centre_x,
-                centre_y=centre_y,
-                sampling_rate=sampling_rate,
-                type=type,
-                elevation=elevation,
-                incidence=incidence
-            )
-
-            phase_stack = (
-                np.absolute(np.sum(np.exp(shifted_phase_traces * 1j), axis=0)) / ntrace
-            )
             phase_weight_stack = lin_stack * (phase_stack**degree)
             power_pws = np.sum(phase_weight_stack**2)
 
-            # F statistic
-            Residuals_Trace_Beam = np.subtract(shifted_traces_lin, lin_stack)
-            Residuals_Trace_Beam_Power = np.sum(
-                (Residuals_Trace_Beam**2), axis=0
-            )
-
-            Residuals_Power_Int = np.sum(Residuals_Trace_Beam_Power)
+            # F statistic, the sum of squared residuals between the
+            # shifted traces and the beam is sum(x^2) - N*sum(beam^2)
+            Residuals_Power_Int = trace_energy - (ntrace * power_lin)
 
-            F = (shifted_traces_lin.shape[0] - 1) * (
-                (shifted_traces_lin.shape[0] * power_lin) / (Residuals_Power_Int)
+            F = (ntrace - 1) * (
+                (ntrace * power_lin) / (Residuals_Power_Int)
             )
 
             # store values
@@ -190,16 +216,31 @@ def BF_XY_all(
                 [sx, sy, power_pws, power_lin * F, power_lin, baz, abs_slow]
             )
 
+    # copy the powers from the grid point each stack was calculated at
+    if memoize:
+        for i in range(nsy):
+            for j in range(nsx):
+                fi = first_index[i, j] // nsx
+                fj = first_index[i, j] % nsx
+                lin_tp[i, j] = lin_tp[fi, fj]
+                pws_tp[i, j] = pws_tp[fi, fj]
+                F_tp[i, j] = F_tp[fi, fj]
+
+                point = int(int(i) + int(slow_ys.shape[0] * j))
+                results_arr[point, 2] = pws_tp[i, j]
+                results_arr[point, 3] = F_tp[i, j]
+                results_arr[point, 4] = lin_tp[i, j]
+
     # now find the peak in this:
     peaks = np.empty((3, 2))
     peaks[int(0)] = get_max_power_loc(
-        tp=lin_tp, sxmin=sxmin, symin=symin, s_space=s_space
+        tp=lin_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
     )
     peaks[int(1)] = get_max_power_loc(
-        tp=pws_tp, sxmin=sxmin, symin=symin, s_space=s_space
+        tp=pws_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
     )
     peaks[int(2)] = get_max_power_loc(
-        tp=F_tp, sxmin=sxmin, symin=symin, s_space=s_space
+        tp=F_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
     )
 
     results_arr[:, 2] /= results_arr[:, 2].max()
@@ -209,10 +250,10 @@ def BF_XY_all(
     return lin_tp, pws_tp, F_tp, results_arr, peaks
 
 
-@jit(nopython=True, fastmath=True)
+@jit(nopython=True, fastmath=True, parallel=True)
 def BF_XY_Lin(
     traces, sampling_rate, geometry, distance, sxmin, sxmax, symin, symax, s_space, type='circ',
-    elevation=False, incidence=90
+    elevation=False, incidence=90, delay_table=None, memoize=False, interpolate=False
 ):
     """
     Function to search over a range of slowness vectors, described in cartesian coordinates, and measure
@@ -248,6 +289,21 @@ def BF_XY_Lin(
         Not used unless elevation is True. Give incidence angle from vertical
         at the centre of the array to calculate elevation corrections. Default is 90.
 
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_xy.
+        If None (default), the table is calculated here.
+
+    memoize : bool
+        If True, grid points where every station is shifted by the same whole
+        number of points share one stack instead of recalculating it.
+        shift_vector_stats gives how many stacks this saves for a delay table.
+        Default is False.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
     Returns
     -------
     lin_tp : 2D numpy array of floats.
@@ -281,8 +337,35 @@ def BF_XY_Lin(
     slow_xs = np.linspace(sxmin, sxmax + s_space, nsx)
     slow_ys = np.linspace(symin, symax + s_space, nsy)
 
+    # point shifts for each station at each slowness vector
+    if delay_table is None:
+        pts_table = delay_table_xy(
+            geometry=geometry,
+            distance=distance,
+            sxmin=sxmin,
+            sxmax=sxmax,
+            symin=symin,
+            symax=symax,
+            s_space=s_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+    else:
+        pts_table = delay_table
+
+    # grid points with the same whole number shifts give the same stack
+    if memoize:
+        first_index = shift_vector_index(pts_table).reshape((nsy, nsx))
+    else:
+        first_index = np.arange(nsy * nsx).reshape((nsy, nsx))
+
     # loop over slowness grid
-    for i in range(slow_ys.shape[0]):
+    for i in prange(slow_ys.shape[0]):
+        # stack buffer private to the thread running this row
+        lin_stack = np.zeros(traces.shape[1])
+
         for j in range(slow_xs.shape[0]):
 
             sx = float(slow_xs[int(j)])
@@ -291,24 +374,16 @@ def BF_XY_Lin(
             # get the slowness and backazimuth of the vector
             abs_slow, baz = get_slow_baz(sx, sy, "az")
 
-            point = int(int(i) + int(slow_xs.shape[0] * j))
+            point = int(int(i) + int(slow_ys.shape[0] * j))
 
-            # Call function to shift traces
-            shifted_traces_lin = shift_traces(
-                traces=traces,
-                geometry=geometry,
-                abs_slow=float(abs_slow),
-                baz=float(baz),
-                distance=float(distance),
-                centre_x=float(centre_x),
-                centre_y=float(centre_y),
-                sampling_rate=sampling_rate,
-                type=type,
-                elevation=elevation,
-                incidence=incidence
-            )
+            # only stack at the first grid point with these shifts,
+            # the others are copied from it after the loop
+            if first_index[i, j] != (i * nsx) + j:
+                results_arr[point] = np.array([sx, sy, 0.0, baz, abs_slow])
+                continue
 
-            lin_stack = np.sum(shifted_traces_lin, axis=0) / ntrace
+            # shift and stack the traces
+            lin_stack = shift_stack_2D(traces, pts_table[i, j], lin_stack)
 
             # linear stack
             power_lin = np.sum(lin_stack**2)
@@ -317,10 +392,21 @@ def BF_XY_Lin(
 
             results_arr[point] = np.array([sx, sy, power_lin, baz, abs_slow])
 
+    # copy the powers from the grid point each stack was calculated at
+    if memoize:
+        for i in range(nsy):
+            for j in range(nsx):
+                fi = first_index[i, j] // nsx
+                fj = first_index[i, j] % nsx
+                lin_tp[i, j] = lin_tp[fi, fj]
+
+                point = int(int(i) + int(slow_ys.shape[0] * j))
+                results_arr[point, 2] = lin_tp[i, j]
+
     # now find the peak in this:
     peaks = np.empty((1, 2))
     peaks[int(0)] = get_max_power_loc(
-        tp=lin_tp, sxmin=sxmin, symin=symin, s_space=s_space
+        tp=lin_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
     )
 
     results_arr[:, 2] /= results_arr[:, 2].max()
@@ -328,7 +414,457 @@ def BF_XY_Lin(
     return lin_tp, results_arr, peaks
 
 
-@jit(nopython=True, fastmath=True)
+@jit(nopython=True, fastmath=True, parallel=True)
+def BF_XY_jackknife(
+    traces,
+    phase_traces,
+    sampling_rate,
+    geometry,
+    distance,
+    sxmin,
+    sxmax,
+    symin,
+    symax,
+    s_space,
+    degree,
+    type='circ',
+    elevation=False,
+    incidence=90,
+    delay_table=None,
+    interpolate=False,
+):
+    """
+    Jackknife version of BF_XY_all. For every station, the linear, phase
+    weighted and F-statistic power grids are found with that station left
+    out. At each grid point the full stack is made once and each station
+    is then subtracted from it, so all the leave one out grids cost about
+    the same as one grid search.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        2D array containing the traces the user wants to conduct analysis with. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+
+    phase_traces : 2D numpy array of floats
+        2D array containing the instantaneous phase at each time point
+        that the user wants to use in the phase weighted stacking.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    sxmax : float
+        Maximum magnitude of slowness on x axis, used for creating the slowness grid.
+
+    sxmin : float
+        Minimun magnitude of the slowness on x axis, used for creating the slowness grid.
+
+    symax : float
+        Maximum magnitude of slowness on y axis, used for creating the slowness grid.
+
+    symin : float
+        Minimun magnitude of the slowness on y axis, used for creating the slowness grid.
+
+    s_space : float
+        The slowness interval for each step e.g. 0.1.
+
+    degree : float
+        The degree for the phase weighted stacking to reduce incoherent arrivals by.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_xy.
+        If None (default), the table is calculated here.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
+    Returns
+    -------
+    lin_tps : 3D numpy array of floats.
+        Linear stack power grid with each station left out, shape [n,nsy,nsx].
+    pws_tps : 3D numpy array of floats.
+        Phase weighted stack power grids, shape [n,nsy,nsx].
+    F_tps : 3D numpy array of floats.
+        F-statistic power grids, shape [n,nsy,nsx].
+    peaks : 3D numpy array of floats.
+        For each left out station, 3 rows describing the X,Y points
+        of the maximum power value for linear, phase weighted
+        and F-statistic respectively. Shape [n,3,2].
+    errors : 2D numpy array of floats.
+        Jackknife standard error of the X,Y peak location for linear,
+        phase weighted and F-statistic respectively. Shape [3,2].
+    """
+
+    ntrace = traces.shape[0]
+    npts = traces.shape[1]
+
+    # get number of points.
+    nsx = int(np.round(((sxmax - sxmin) / s_space), 0) + 1)
+    nsy = int(np.round(((symax - symin) / s_space), 0) + 1)
+
+    # make empty array for output.
+    lin_tps = np.zeros((ntrace, nsy, nsx))
+    pws_tps = np.zeros((ntrace, nsy, nsx))
+    F_tps = np.zeros((ntrace, nsy, nsx))
+
+    # unit phasors are shift invariant so only need calculating once
+    phasors = np.exp(phase_traces * 1j)
+
+    # energy of each trace does not change when it is shifted
+    trace_energies = np.zeros(ntrace)
+    for n in range(ntrace):
+        trace_energies[n] = np.sum(traces[n] ** 2)
+    trace_energy = np.sum(trace_energies)
+
+    # point shifts for each station at each slowness vector
+    if delay_table is None:
+        pts_table = delay_table_xy(
+            geometry=geometry,
+            distance=distance,
+            sxmin=sxmin,
+            sxmax=sxmax,
+            symin=symin,
+            symax=symax,
+            s_space=s_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+    else:
+        pts_table = delay_table
+
+    # number of stations in each leave one out stack
+    nsub = ntrace - 1
+
+    # loop over slowness grid
+    for i in prange(nsy):
+        # shifted trace buffers private to the thread running this row
+        shifted = np.zeros((ntrace, npts))
+        shifted_phasors = np.zeros((ntrace, npts), dtype=np.complex128)
+
+        for j in range(nsx):
+
+            shifted[:] = 0.0
+            shifted_phasors[:] = 0.0
+            for n in range(ntrace):
+                p = int(pts_table[i, j, n])
+                shift_accumulate(traces[n], p, shifted[n])
+                shift_accumulate(phasors[n], p, shifted_phasors[n])
+
+            beam_sum = np.sum(shifted, axis=0)
+            phasor_sum = np.sum(shifted_phasors, axis=0)
+
+            # take each station out of the full stack
+            for n in range(ntrace):
+                lin_stack = (beam_sum - shifted[n]) / nsub
+                phase_stack = np.absolute(phasor_sum - shifted_phasors[n]) / nsub
+
+                power_lin = np.sum(lin_stack**2)
+                power_pws = np.sum((lin_stack * (phase_stack**degree)) ** 2)
+
+                # F statistic from the energy of the remaining traces
+                Residuals_Power_Int = (trace_energy - trace_energies[n]) - (
+                    nsub * power_lin
+                )
+                F = (nsub - 1) * ((nsub * power_lin) / (Residuals_Power_Int))
+
+                lin_tps[n, i, j] = power_lin
+                pws_tps[n, i, j] = power_pws
+                F_tps[n, i, j] = power_lin * F
+
+    # now find the peaks in these:
+    peaks = np.zeros((ntrace, 3, 2))
+    for n in range(ntrace):
+        peaks[n, 0] = get_max_power_loc(
+            tp=lin_tps[n],
+            sxmin=sxmin,
+            symin=symin,
+            s_space=s_space,
+            interpolate=interpolate,
+        )[0]
+        peaks[n, 1] = get_max_power_loc(
+            tp=pws_tps[n],
+            sxmin=sxmin,
+            symin=symin,
+            s_space=s_space,
+            interpolate=interpolate,
+        )[0]
+        peaks[n, 2] = get_max_power_loc(
+            tp=F_tps[n],
+            sxmin=sxmin,
+            symin=symin,
+            s_space=s_space,
+            interpolate=interpolate,
+        )[0]
+
+    # jackknife standard error of the peak locations
+    errors = np.zeros((3, 2))
+    for k in range(3):
+        for c in range(2):
+            vals = peaks[:, k, c]
+            errors[k, c] = np.sqrt(
+                (nsub / ntrace) * np.sum((vals - np.mean(vals)) ** 2)
+            )
+
+    return lin_tps, pws_tps, F_tps, peaks, errors
+
+
+@jit(nopython=True, fastmath=True, parallel=True)
+def lin_power_points(traces, pts_table, points, lin_tp):
+    """
+    Calculates the linear stack power at a list of grid points and stores
+    it in lin_tp. Used to evaluate only part of a slowness grid.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        2D array containing the traces the user wants to conduct analysis with. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+    pts_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_xy.
+    points : 2D numpy array of ints
+        [iy, ix] indices of the grid points to evaluate.
+    lin_tp : 2D numpy array of floats
+        Linear stack power grid. Updated in place at the given points.
+
+    Returns
+    -------
+    Nothing
+    """
+
+    for p in prange(points.shape[0]):
+        lin_stack = np.zeros(traces.shape[1])
+
+        iy = points[p, 0]
+        ix = points[p, 1]
+
+        lin_stack = shift_stack_2D(traces, pts_table[iy, ix], lin_stack)
+        lin_tp[iy, ix] = np.sum(lin_stack**2)
+
+
+def BF_XY_Lin_adaptive(
+    traces, sampling_rate, geometry, distance, sxmin, sxmax, symin, symax, s_space,
+    coarse_step=4, threshold=1.5, noise_power=None, type='circ', elevation=False,
+    incidence=90, delay_table=None, interpolate=False
+):
+    """
+    Coarse to fine version of BF_XY_Lin. The linear stack power is first
+    calculated on a coarse grid taking every coarse_step-th slowness value.
+    Local maxima of the coarse grid with power above threshold * noise_power
+    are then refined on the s_space grid by climbing to the highest fine grid
+    point around them. Only the grid points needed to do this are evaluated,
+    so the cost depends on the number of peaks rather than the size of the
+    slowness box. Peaks which are resolved by the coarse grid are found at the
+    same grid points as the dense search.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        2D array containing the traces the user wants to conduct analysis with. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+    sxmax : float
+        Maximum magnitude of slowness on x axis, used for creating the slowness grid.
+    sxmin : float
+        Minimun magnitude of the slowness on x axis, used for creating the slowness grid.
+    symax : float
+        Maximum magnitude of slowness on y axis, used for creating the slowness grid.
+    symin : float
+        Minimun magnitude of the slowness on y axis, used for creating the slowness grid.
+    s_space : float
+        The slowness interval for each step e.g. 0.1.
+    coarse_step : int
+        Number of s_space steps between the points of the coarse grid. The coarse
+        spacing (coarse_step * s_space) needs to be smaller than about half the
+        width of the beam for peaks to be picked up. Default is 4.
+    threshold : float
+        Coarse grid maxima need a power greater than threshold * noise_power to
+        be refined. Default is 1.5.
+    noise_power : float
+        Noise power estimate e.g. from BF_Noise_Threshold_Relative_XY. If None
+        (default), the median power of the coarse grid is used.
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront. default
+        is 'circ'.
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_xy.
+        If None (default), the table is calculated here.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
+    Returns
+    -------
+    lin_tp : 2D numpy array of floats.
+        Linear stack power grid. Only the refined windows around the peaks
+        are filled, the rest is 0 so findpeaks_XY treats it as background.
+    results_arr : 2D numpy array of floats.
+        Contains power values for the evaluated points only:
+        [slow_x, slow_y, power_lin, baz, abs_slow]
+    peaks : 2D array of floats.
+        Array contains 1 row describing the X,Y point
+        of the maximum linear power value.
+    """
+
+    # get number of points.
+    nsx = int(np.round(((sxmax - sxmin) / s_space), 0) + 1)
+    nsy = int(np.round(((symax - symin) / s_space), 0) + 1)
+
+    slow_xs = np.linspace(sxmin, sxmax + s_space, nsx)
+    slow_ys = np.linspace(symin, symax + s_space, nsy)
+
+    # point shifts for each station at each slowness vector
+    # these are cheap compared to the stacking so are made for the whole grid
+    if delay_table is None:
+        pts_table = delay_table_xy(
+            geometry=geometry,
+            distance=distance,
+            sxmin=sxmin,
+            sxmax=sxmax,
+            symin=symin,
+            symax=symax,
+            s_space=s_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+    else:
+        pts_table = delay_table
+
+    lin_tp = np.zeros((nsy, nsx))
+    evaluated = np.zeros((nsy, nsx), dtype=bool)
+    refined = np.zeros((nsy, nsx), dtype=bool)
+
+    def evaluate(iy0, iy1, ix0, ix1):
+        # evaluate any points in the window not done already
+        iy0, ix0 = max(iy0, 0), max(ix0, 0)
+        iy1, ix1 = min(iy1, nsy - 1), min(ix1, nsx - 1)
+        refined[iy0 : iy1 + 1, ix0 : ix1 + 1] = True
+        todo = np.argwhere(~evaluated[iy0 : iy1 + 1, ix0 : ix1 + 1])
+        if todo.shape[0] > 0:
+            todo += np.array([iy0, ix0])
+            lin_power_points(traces, pts_table, todo, lin_tp)
+            evaluated[todo[:, 0], todo[:, 1]] = True
+        return iy0, iy1, ix0, ix1
+
+    # coarse grid always includes the edges of the box
+    coarse_step = max(int(coarse_step), 1)
+    cy = np.unique(np.append(np.arange(0, nsy, coarse_step), nsy - 1))
+    cx = np.unique(np.append(np.arange(0, nsx, coarse_step), nsx - 1))
+
+    coarse_points = np.array(np.meshgrid(cy, cx, indexing="ij")).reshape(2, -1).T
+    lin_power_points(traces, pts_table, coarse_points, lin_tp)
+    evaluated[coarse_points[:, 0], coarse_points[:, 1]] = True
+
+    coarse_tp = lin_tp[np.ix_(cy, cx)]
+
+    if noise_power is None:
+        noise_power = np.median(coarse_tp)
+
+    # local maxima of the coarse grid (8 neighbours)
+    padded = np.pad(coarse_tp, 1, mode="constant", constant_values=-np.inf)
+    neighbours = np.array(
+        [
+            padded[1 + dy : 1 + dy + cy.shape[0], 1 + dx : 1 + dx + cx.shape[0]]
+            for dy in (-1, 0, 1)
+            for dx in (-1, 0, 1)
+            if not (dy == 0 and dx == 0)
+        ]
+    )
+    is_max = (coarse_tp >= neighbours.max(axis=0)) & (
+        coarse_tp > threshold * noise_power
+    )
+
+    # the strongest point is always refined so there is a peak to return
+    is_max[np.unravel_index(np.argmax(coarse_tp), coarse_tp.shape)] = True
+
+    # refine the strongest candidates first
+    ciy, cix = np.where(is_max)
+    order = np.argsort(coarse_tp[ciy, cix])[::-1]
+
+    for c in order:
+        iy, ix = cy[ciy[c]], cx[cix[c]]
+
+        # climb to the highest fine grid point around the candidate
+        # until it is not on the edge of the refined window
+        for n in range(nsy + nsx):
+            iy0, iy1, ix0, ix1 = evaluate(
+                iy - coarse_step, iy + coarse_step, ix - coarse_step, ix + coarse_step
+            )
+            window = lin_tp[iy0 : iy1 + 1, ix0 : ix1 + 1]
+            my, mx = np.unravel_index(np.argmax(window), window.shape)
+            my, mx = my + iy0, mx + ix0
+
+            on_edge = (
+                (my == iy0 and iy0 > 0)
+                or (my == iy1 and iy1 < nsy - 1)
+                or (mx == ix0 and ix0 > 0)
+                or (mx == ix1 and ix1 < nsx - 1)
+            )
+            if (my, mx) == (iy, ix) or not on_edge:
+                break
+            iy, ix = my, mx
+
+    # results for the evaluated points
+    iy_eval, ix_eval = np.where(evaluated)
+    results_arr = np.zeros((iy_eval.shape[0], 5))
+    for p in range(iy_eval.shape[0]):
+        sx = float(slow_xs[ix_eval[p]])
+        sy = float(slow_ys[iy_eval[p]])
+        abs_slow, baz = get_slow_baz(sx, sy, "az")
+        results_arr[p] = np.array(
+            [sx, sy, lin_tp[iy_eval[p], ix_eval[p]], baz, abs_slow]
+        )
+
+    # coarse points outside the refined windows would look like isolated
+    # peaks to findpeaks_XY so are only kept in results_arr
+    lin_tp[~refined] = 0
+
+    # now find the peak in this:
+    peaks = get_max_power_loc(
+        tp=lin_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
+    )
+
+    results_arr[:, 2] /= results_arr[:, 2].max()
+
+    return lin_tp, results_arr, peaks
+
+
+@jit(nopython=True, fastmath=True, parallel=True)
 def BF_XY_PWS(
     traces,
     phase_traces,
@@ -343,7 +879,10 @@ def BF_XY_PWS(
     degree,
     type='circ',
     elevation=False,
-    incidence=90
+    incidence=90,
+    delay_table=None,
+    memoize=False,
+    interpolate=False,
 ):
     """
     Function to search over a range of slowness vectors, described in cartesian coordinates, and measure
@@ -397,6 +936,20 @@ def BF_XY_PWS(
         Not used unless elevation is True. Give incidence angle from vertical
         at the centre of the array to calculate elevation corrections. Default is 90.
 
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_xy.
+        If None (default), the table is calculated here.
+
+    memoize : bool
+        If True, grid points where every station is shifted by the same whole
+        number of points share one stack instead of recalculating it.
+        shift_vector_stats gives how many stacks this saves for a delay table.
+        Default is False.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
 
     Returns
     -------
@@ -428,10 +981,41 @@ def BF_XY_PWS(
     results_arr = np.zeros((nsy * nsx, 5))
     pws_tp = np.zeros((nsy, nsx))
 
+    # unit phasors are shift invariant so only need calculating once
+    phasors = np.exp(phase_traces * 1j)
+
     slow_xs = np.linspace(sxmin, sxmax + s_space, nsx)
     slow_ys = np.linspace(symin, symax + s_space, nsy)
 
-    for i in range(slow_ys.shape[0]):
+    # point shifts for each station at each slowness vector
+    if delay_table is None:
+        pts_table = delay_table_xy(
+            geometry=geometry,
+            distance=distance,
+            sxmin=sxmin,
+            sxmax=sxmax,
+            symin=symin,
+            symax=symax,
+            s_space=s_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+    else:
+        pts_table = delay_table
+
+    # grid points with the same whole number shifts give the same stack
+    if memoize:
+        first_index = shift_vector_index(pts_table).reshape((nsy, nsx))
+    else:
+        first_index = np.arange(nsy * nsx).reshape((nsy, nsx))
+
+    for i in prange(slow_ys.shape[0]):
+        # stack buffers private to the thread running this row
+        lin_stack = np.zeros(traces.shape[1])
+        phase_stack = np.zeros(traces.shape[1])
+
         for j in range(slow_xs.shape[0]):
 
             sx = float(slow_xs[int(j)])
@@ -440,42 +1024,19 @@ def BF_XY_PWS(
             # get the slowness and backazimuth of the vector
             abs_slow, baz = get_slow_baz(sx, sy, "az")
 
-            point = int(int(i) + int(slow_xs.shape[0] * j))
+            point = int(int(i) + int(slow_ys.shape[0] * j))
 
-            # Call function to shift traces
-            shifted_traces_lin = shift_traces(
-                traces=traces,
-                geometry=geometry,
-                abs_slow=float(abs_slow),
-                baz=float(baz),
-                distance=float(distance),
-                centre_x=float(centre_x),
-                centre_y=float(centre_y),
-                sampling_rate=sampling_rate,
-                type=type,
-                elevation=elevation,
-                incidence=incidence
-            )
+            # only stack at the first grid point with these shifts,
+            # the others are copied from it after the loop
+            if first_index[i, j] != (i * nsx) + j:
+                results_arr[point] = np.array([sx, sy, 0.0, baz, abs_slow])
+                continue
 
-            shifted_phase_traces = shift_traces(
-                traces=phase_traces,
-                geometry=geometry,
-                abs_slow=abs_slow,
-                baz=baz,
-                distance=distance,
-                centre_x=centre_x,
-                centre_y=centre_y,
-                sampling_rate=sampling_rate,
-                type=type,
-                elevation=elevation,
-                incidence=incidence
+            # Call function to shift traces
+            lin_stack, phase_stack = shift_stack_phase_2D(
+                traces, phasors, pts_table[i, j], lin_stack, phase_stack
             )
 
-            lin_stack = np.sum(shifted_traces_lin, axis=0) / ntrace
-
-            phase_stack = (
-                np.absolute(np.sum(np.exp(shifted_phase_traces * 1j), axis=0)) / ntrace
-            )
             phase_weight_stack = lin_stack * (phase_stack**degree)
             power_pws = np.sum(phase_weight_stack**2)
 
@@ -483,27 +1044,320 @@ def BF_XY_PWS(
 
             results_arr[point] = np.array([sx, sy, power_pws, baz, abs_slow])
 
+    # copy the powers from the grid point each stack was calculated at
+    if memoize:
+        for i in range(nsy):
+            for j in range(nsx):
+                fi = first_index[i, j] // nsx
+                fj = first_index[i, j] % nsx
+                pws_tp[i, j] = pws_tp[fi, fj]
+
+                point = int(int(i) + int(slow_ys.shape[0] * j))
+                results_arr[point, 2] = pws_tp[i, j]
+
     # now find the peak in this:
     peaks = np.empty((1, 2))
     peaks[int(0)] = get_max_power_loc(
-        tp=pws_tp, sxmin=sxmin, symin=symin, s_space=s_space
+        tp=pws_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
     )
 
     results_arr[:, 2] /= results_arr[:, 2].max()
 
     return pws_tp, results_arr, peaks
 
+
+@jit(nopython=True, fastmath=True, parallel=True)
+def shifted_stack_powers(traces, pts_shifts, powers):
+    """
+    Calculates the power of the linear stack of the traces for each
+    set of point shifts in pts_shifts, spread over the available threads.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        Traces to shift and stack. Shape of [n,p] where n is the number
+        of traces and p is the points in each trace.
+
+    pts_shifts : 2D numpy array of floats
+        Point shifts for each trace, shape [m,n] for m stacks.
+
+    powers : 1D numpy array of floats
+        Array of length m the powers are stored in.
+
+    Returns
+    -------
+    Nothing
+    """
+
+    for b in prange(pts_shifts.shape[0]):
+        # stack buffer private to the thread running this stack
+        stack = np.zeros(traces.shape[1])
+        stack = shift_stack_2D(traces, pts_shifts[b], stack)
+        powers[b] = np.sum(stack**2)
+
+
+@jit(nopython=True, fastmath=True)
+def noise_scramble_powers(
+    traces, sampling_rate, n_scrambles=1000, tol=None, seed=None, batch=100
+):
+    """
+    Estimates the noise power of aligned traces by shifting each trace by a
+    random time of up to half the trace length and stacking them. The
+    scrambles are stacked in batches spread over the available threads.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        Traces aligned on the arrival of interest. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    n_scrambles : int
+        Maximum number of scrambles. Default is 1000.
+
+    tol : float
+        If given, stop once the median noise power changes by less than
+        this fraction of itself from one batch to the next. If None (default),
+        all n_scrambles are done.
+
+    seed : int
+        Seed for the random time shifts. The shifts are drawn in order
+        before each batch is stacked so the same seed gives the same
+        powers whatever the number of threads. Use worker_seed to get a
+        different stream for each MPI rank. If None (default), the
+        generator is not reseeded.
+
+    batch : int
+        Number of scrambles between convergence checks. Default is 100.
+
+    Returns
+    -------
+    noise_powers : 1D numpy array of floats
+        Power of each scrambled stack.
+    """
+
+    ntrace = traces.shape[0]
+    npts = traces.shape[1]
+
+    # T is the max time it can be shifted by
+    # the length of the trace/2
+    T = (npts / sampling_rate) / 2.0
+
+    if seed is not None:
+        np.random.seed(seed)
+
+    noise_powers = np.zeros(n_scrambles)
+    median = 0.0
+    n_done = 0
+
+    while n_done < n_scrambles:
+        n_batch = min(batch, n_scrambles - n_done)
+
+        # one r value per trace is the fraction of T to shift it by.
+        # these are drawn here, in order, so the stream does not depend
+        # on how the stacking is split over threads.
+        r_values = np.random.uniform(float(-1), float(1), (n_batch, ntrace))
+        pts_shift_noise = (T * r_values) * sampling_rate
+
+        shifted_stack_powers(
+            traces, pts_shift_noise, noise_powers[n_done : n_done + n_batch]
+        )
+
+        n_done += n_batch
+
+        # stop if the median has stopped changing
+        new_median = np.median(noise_powers[:n_done])
+        if tol is not None and n_done > n_batch:
+            if abs(new_median - median) <= tol * abs(new_median):
+                break
+        median = new_median
+
+    return noise_powers[:n_done]
+
+
+def worker_seed(seed, worker):
+    """
+    Makes an independent seed for each worker (e.g. MPI rank) from one
+    seed so runs are reproducible however the work is split up.
+
+    Parameters
+    ----------
+    seed : int
+        Seed for the whole run.
+
+    worker : int
+        Index of the worker, e.g. the MPI rank.
+
+    Returns
+    -------
+    worker_seed : int
+        Seed for this worker, can be given to noise_scramble_powers.
+    """
+
+    return int(np.random.SeedSequence([seed, worker]).generate_state(1)[0])
+
+
+def scramble_shift_spectrum(npts, sampling_rate):
+    """
+    Spectral terms shared by the closed form scrambled noise estimates
+    (noise_power_analytic and noise_power_analytic_weighted).
+
+    Parameters
+    ----------
+    npts : int
+        Number of points in each trace.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    Returns
+    -------
+    weights : 1D numpy array of floats
+        Weights to sum over the full spectrum using the one sided spectrum.
+
+    char_sq : 1D numpy array of floats
+        Expected value of the phase factor between two traces shifted
+        independently, at each frequency of the one sided spectrum.
+    """
+
+    # weights to sum over the full spectrum using the one sided spectrum
+    weights = np.full((npts // 2) + 1, 2.0)
+    weights[0] = 1.0
+    if npts % 2 == 0:
+        weights[-1] = 1.0
+
+    # probability of each whole point shift, int(H * r) with r uniform in
+    # [-1, 1] and H the maximum shift of half the trace in points
+    H = ((npts / sampling_rate) / 2.0) * sampling_rate
+    K = int(np.ceil(H))
+    shifts = np.arange(1, K + 1)
+    probs = np.clip(np.minimum(shifts + 1, H) - shifts, 0, None) / (2 * H)
+    shift_probs = np.zeros(npts)
+    shift_probs[0] = min(1.0, H) / H
+    np.add.at(shift_probs, shifts % npts, probs)
+    np.add.at(shift_probs, (-shifts) % npts, probs)
+
+    # the difference of two independent shifts has the squared
+    # characteristic function of one shift
+    char_sq = np.abs(np.fft.rfft(shift_probs)) ** 2
+
+    return weights, char_sq
+
+
+def noise_power_analytic(traces, sampling_rate):
+    """
+    Closed form version of the scrambled noise estimate in
+    noise_scramble_powers. Each trace is shifted by a random whole number
+    of points taken from a random time of up to half the trace length, so
+    the expected power of the stack can be found from the trace spectra
+    rather than by stacking many scrambles.
+
+    The mean uses the exact distribution of the point shifts. The variance
+    assumes the shifts spread evenly over all lags, which is very close
+    as the shifts span the whole trace.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        Traces aligned on the arrival of interest. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    Returns
+    -------
+    noise_mean : float
+        Expected power of a scrambled stack.
+
+    noise_var : float
+        Variance of the power of a scrambled stack.
+    """
+
+    ntrace = traces.shape[0]
+    npts = traces.shape[1]
+
+    spectra = np.fft.rfft(traces, axis=1)
+    power_spectra = np.abs(spectra) ** 2
+
+    weights, char_sq = scramble_shift_spectrum(npts, sampling_rate)
+
+    # energy of each trace is unchanged by the shifts
+    total_energy = np.sum(weights * power_spectra) / npts
+
+    # expected cross terms between different traces
+    cross_spectra = np.abs(np.sum(spectra, axis=0)) ** 2 - np.sum(power_spectra, axis=0)
+    cross_power = np.sum(weights * char_sq * cross_spectra) / npts
+
+    noise_mean = (total_energy + cross_power) / ntrace**2
+
+    # the cross terms are uncorrelated when the shifts cover all lags
+    sum_power = np.sum(power_spectra, axis=0)
+    sum_power_sq = np.sum(power_spectra**2, axis=0)
+    var_terms = (weights * (sum_power**2 - sum_power_sq))[1:]
+    noise_var = 2 * np.sum(var_terms) / (ntrace**4 * npts**2)
+
+    return float(noise_mean), float(noise_var)
+
+
+def noise_power_analytic_weighted(traces, sampling_rate, counts):
+    """
+    Expected power of a scrambled stack, as noise_power_analytic, for many
+    resamples of the same traces at once, e.g. bootstrap samples given as
+    the number of times each station is picked. Each pick of a trace is
+    shifted on its own, so the result for a row of counts is the same as
+    noise_power_analytic on the traces repeated that many times.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        Traces aligned on the arrival of interest. Shape of [n,p] where n
+        is the number of traces and p is the points in each trace.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    counts : 2D numpy array of floats
+        Number of times each trace is picked in each resample, shape [B,n].
+
+    Returns
+    -------
+    noise_means : 1D numpy array of floats
+        Expected power of a scrambled stack for each resample.
+    """
+
+    npts = traces.shape[1]
+    ntraces = np.sum(counts, axis=1)[:, np.newaxis]
+
+    spectra = np.fft.rfft(traces, axis=1)
+    power_spectra = np.abs(spectra) ** 2
+
+    weights, char_sq = scramble_shift_spectrum(npts, sampling_rate)
+
+    # energy of each pick is unchanged by the shifts
+    total_energy = np.dot(counts, power_spectra)
+
+    # expected cross terms between different picks
+    cross_spectra = np.abs(np.dot(counts, spectra)) ** 2 - total_energy
+
+    noise_means = np.sum(weights * (total_energy + (char_sq * cross_spectra)), axis=1) / npts
+
+    return noise_means / ntraces[:, 0] ** 2
+
 @jit(nopython=True, fastmath=True)
 def BF_Noise_Threshold_Relative_XY(
     traces, sampling_rate, geometry, distance, sxmin, sxmax, symin, symax, s_space, type='circ',
-    elevation=False, incidence=90
+    elevation=False, incidence=90, delay_table=None, memoize=False, n_scrambles=1000,
+    tol=None, seed=None, noise_method="scramble", interpolate=False
 ):
     """
     Function to calculate the TP plot or power grid given traces and a
     range of slowness vectors described in a Cartesian system (X/Y).
     Once the power grid has been calculated, a noise estimate is found by scambling
-    the traces 1000 times and, in each scamble, stack them then calculate a power
-    value.
+    the traces n_scrambles times and, in each scamble, stack them then calculate a power
+    value (see noise_scramble_powers).
 
     Parameters
     ----------
@@ -553,12 +1407,79 @@ def BF_Noise_Threshold_Relative_XY(
         at the centre of the array to calculate elevation corrections. Default is
         None.
 
+    delay_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_xy.
+        If None (default), the table is calculated here.
+
+    memoize : bool
+        If True, grid points where every station is shifted by the same whole
+        number of points share one stack instead of recalculating it.
+        shift_vector_stats gives how many stacks this saves for a delay table.
+        Default is False.
+
+    n_scrambles : int
+        Maximum number of scrambles used for the noise estimate. Default is 1000.
+
+    tol : float
+        If given, the scrambles stop early once the median noise power changes
+        by less than this fraction between batches. Default is None.
+
+    seed : int
+        Seed for the random scrambles. Default is None (not reseeded).
+
+    noise_method : string
+        Either "scramble" (default) to take the median power of the random
+        scrambles, or "analytic" to use the expected scrambled power from
+        noise_power_analytic without stacking any scrambles.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them, so coarser grids can
+        be used. Default is False.
+
     Returns
     -------
     lin_tp : 2D array of floats
         Power values for each slowness vector.
     noise_mean : float
-        Mean of noise power estimates.
+        Median of the scrambled noise powers, or their expected (mean) value
+        if noise_method is "analytic". The mean is a little higher than the
+        median as the scrambled powers are skewed.
+    peaks : 2D numpy array of floats
+        XY point of the peak power location in the grid.
+    """
+
+    lin_tp, noise_mean, noise_std, peaks = BF_Noise_Std_Relative_XY(
+        traces, sampling_rate, geometry, distance, sxmin, sxmax, symin, symax, s_space,
+        type, elevation, incidence, delay_table, memoize, n_scrambles, tol, seed,
+        noise_method, interpolate
+    )
+
+    return lin_tp, noise_mean, peaks
+
+
+@jit(nopython=True, fastmath=True, parallel=True)
+def BF_Noise_Std_Relative_XY(
+    traces, sampling_rate, geometry, distance, sxmin, sxmax, symin, symax, s_space, type='circ',
+    elevation=False, incidence=90, delay_table=None, memoize=False, n_scrambles=1000,
+    tol=None, seed=None, noise_method="scramble", interpolate=False
+):
+    """
+    Same as BF_Noise_Threshold_Relative_XY but also returns the standard
+    deviation of the noise power, so a threshold can be set a number of
+    standard deviations above the noise (see Parameters_Bootstrap).
+    The parameters are the same as BF_Noise_Threshold_Relative_XY.
+
+    Returns
+    -------
+    lin_tp : 2D array of floats
+        Power values for each slowness vector.
+    noise_mean : float
+        Median of the scrambled noise powers, or their expected (mean) value
+        if noise_method is "analytic".
+    noise_std : float
+        Standard deviation of the scrambled noise powers, or its expected
+        value from noise_power_analytic if noise_method is "analytic".
     peaks : 2D numpy array of floats
         XY point of the peak power location in the grid.
     """
@@ -579,47 +1500,73 @@ def BF_Noise_Threshold_Relative_XY(
 
     # make empty array for output.
     lin_tp = np.zeros((nsy, nsx))
-    noise_arr = np.zeros((nsy, nsx))
 
     # slowness grid points
     slow_xs = np.linspace(sxmin, sxmax + s_space, nsx)
     slow_ys = np.linspace(symin, symax + s_space, nsy)
 
+    # point shifts for each station at each slowness vector
+    if delay_table is None:
+        pts_table = delay_table_xy(
+            geometry=geometry,
+            distance=distance,
+            sxmin=sxmin,
+            sxmax=sxmax,
+            symin=symin,
+            symax=symax,
+            s_space=s_space,
+            sampling_rate=sampling_rate,
+            type=type,
+            elevation=elevation,
+            incidence=incidence
+        )
+    else:
+        pts_table = delay_table
+
+    # grid points with the same whole number shifts give the same stack
+    if memoize:
+        first_index = shift_vector_index(pts_table).reshape((nsy, nsx))
+    else:
+        first_index = np.arange(nsy * nsx).reshape((nsy, nsx))
+
     #  loop over slowness vectors
-    for i, sy in enumerate(slow_ys):
-        for j, sx in enumerate(slow_xs):
+    for i in prange(slow_ys.shape[0]):
+        # stack buffer private to the thread running this row
+        lin_stack = np.zeros(traces.shape[1])
+
+        for j in range(slow_xs.shape[0]):
+
+            sx = float(slow_xs[int(j)])
+            sy = float(slow_ys[int(i)])
 
             # get the slowness and backazimuth of the vector
             abs_slow, baz = get_slow_baz(sx, sy, "az")
 
-            # Call function to shift traces
-            shifted_traces_lin = shift_traces(
-                traces=traces,
-                geometry=geometry,
-                abs_slow=np.array(abs_slow),
-                baz=np.array(baz),
-                distance=distance,
-                centre_x=centre_x,
-                centre_y=centre_y,
-                sampling_rate=sampling_rate,
-                type=type,
-                elevation=elevation,
-                incidence=incidence
-            )
+            # only stack at the first grid point with these shifts,
+            # the others are copied from it after the loop
+            if first_index[i, j] != (i * nsx) + j:
+                continue
 
-            # stack, get power and store in array
-            lin_stack = np.sum(shifted_traces_lin, axis=0) / ntrace
+            # shift and stack the traces, get power and store in array
+            lin_stack = shift_stack_2D(traces, pts_table[i, j], lin_stack)
             power_lin = np.sum(lin_stack**2)
             lin_tp[i, j] = power_lin
 
-    # initialise peak array
-    peaks = np.zeros((1, 2))
+    # copy the powers from the grid point each stack was calculated at
+    if memoize:
+        for i in range(nsy):
+            for j in range(nsx):
+                fi = first_index[i, j] // nsx
+                fj = first_index[i, j] % nsx
+                lin_tp[i, j] = lin_tp[fi, fj]
 
     # find highest power value
-    iy_lin, ix_lin = np.where(lin_tp == np.amax(lin_tp))
+    peaks = get_max_power_loc(
+        tp=lin_tp, sxmin=sxmin, symin=symin, s_space=s_space, interpolate=interpolate
+    )
 
-    slow_x_max_lin = sxmin + (ix_lin[0] * s_space)
-    slow_y_max_lin = symin + (iy_lin[0] * s_space)
+    slow_x_max_lin = peaks[0, 0]
+    slow_y_max_lin = peaks[0, 1]
 
     # find the maximum location
     slow_x_max_lin_abs = slow_x_max_lin  # + rel_x
@@ -651,43 +1598,19 @@ def BF_Noise_Threshold_Relative_XY(
     #  Now need to get values for noise time shift
     # idea is to distort this best linear stack
     # by scrambling the traces randomly
-
-    # T is the max time is can be shifted by
-    #  I have made it the length of the trace/2
-    T = (traces[0].shape[0] / sampling_rate) / 2.0
-    # r values store the fraction of T used to scramble the trace.
-    # there is one r value per trace
-    # array initialised here
-    # r_values = np.zeros(shifted_traces_t0.shape[0])
-
-    # initialise array to store noise values.
-    noise_powers = np.zeros(1000)
-
-    # scamble 1000 times
-    for t in range(1000):
-        # get random r values
-        r_values = np.random.uniform(float(-1), float(1), shifted_traces_t0.shape[0])
-
-        # for r in range(r_values.shape[0]):
-        #     r_values[r] = r_val
-
-        # calculate times as a fraction of T
-        added_times = T * r_values
-
-        # now apply these random time shifts to the aligned traces
-        noise_traces = np.zeros(shifted_traces_t0.shape)
-
-        pts_shift_noise = added_times * sampling_rate
-
-        noise_traces = roll_2D(shifted_traces_t0, pts_shift_noise)
-
-        noise_stack = np.sum(noise_traces, axis=0) / ntrace
-
-        noise_p = np.sum(noise_stack**2)
-        noise_powers[int(t)] = noise_p
-
-    # take mean of all 1000 values
-    noise_mean = np.median(noise_powers)
-    noise_arr = np.full_like(lin_tp, noise_p)
-
-    return lin_tp, noise_mean, peaks
+    if noise_method == "analytic":
+        # numba has no FFT so this is done in python
+        with objmode(noise_mean="float64", noise_var="float64"):
+            noise_mean, noise_var = noise_power_analytic(shifted_traces_t0, sampling_rate)
+        noise_std = np.sqrt(noise_var)
+
+    else:
+        noise_powers = noise_scramble_powers(
+            shifted_traces_t0, sampling_rate, n_scrambles, tol, seed
+        )
+
+        # take median of all the values
+        noise_mean = np.median(noise_powers)
+        noise_std = np.std(noise_powers)
+
+    return lin_tp, noise_mean, noise_std, peaks
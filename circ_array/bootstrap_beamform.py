@@ -2,7 +2,12 @@
 import random 
 import numpy as np 
 import scipy 
-from beamforming_xy import BF_Noise_Threshold_Relative_XY
+from beamforming_xy import (
+    BF_Noise_Threshold_Relative_XY,
+    noise_power_analytic_weighted,
+)
+from delay_tables import delay_table_xy
+from shift_stack import roll_2D, shift_accumulate
 from extract_peaks import findpeaks_XY
 import numba as nb
 
@@ -85,3 +90,319 @@ def bootstrap_beamform_xy(traces, slow_min_x, slow_max_x, slow_min_y,
     # peakss = np.array(peakss)
 
     # return tps, noises, peakss
+
+
+@nb.jit(nopython=True, fastmath=True, parallel=True)
+def bootstrap_power_cube(traces, pts_table, weights):
+    """
+    Calculates the linear stack power at every grid point for many
+    bootstrap samples at once. A bootstrap sample of the stations is
+    described by how many times each station is picked, so at each grid
+    point all the sample beams are one matrix product of the weights with
+    the shifted traces.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        Traces of all the stations. Shape of [n,p] where n is the number
+        of traces and p is the points in each trace.
+
+    pts_table : 3D numpy array of floats
+        Point shifts for each station at each grid point from delay_table_xy.
+
+    weights : 2D numpy array of floats
+        Number of times each station is picked in each bootstrap sample,
+        shape [B,n].
+
+    Returns
+    -------
+    tps : 3D numpy array of floats
+        Linear stack power grid for each bootstrap sample, shape [B,nsy,nsx].
+    """
+
+    nboots = weights.shape[0]
+    nsy = pts_table.shape[0]
+    nsx = pts_table.shape[1]
+
+    # each sample is averaged over the stations it picked
+    norm_weights = np.empty_like(weights)
+    for b in range(nboots):
+        norm_weights[b] = weights[b] / np.sum(weights[b])
+
+    tps = np.zeros((nboots, nsy, nsx))
+
+    for i in nb.prange(nsy):
+        # shifted trace buffer private to the thread running this row
+        shifted = np.zeros(traces.shape)
+
+        for j in range(nsx):
+            shifted[:] = 0.0
+            for n in range(traces.shape[0]):
+                shift_accumulate(traces[n], int(pts_table[i, j, n]), shifted[n])
+
+            # beams of all the bootstrap samples
+            beams = np.dot(norm_weights, shifted)
+
+            for b in range(nboots):
+                tps[b, i, j] = np.sum(beams[b] ** 2)
+
+    return tps
+
+
+@nb.jit(nopython=True, fastmath=True, parallel=True)
+def bootstrap_scramble_powers(traces, weights, pts_shifts):
+    """
+    Calculates the power of scrambled stacks for many bootstrap samples at
+    once. In each scramble every trace is shifted by its own number of
+    points and all the sample stacks are one matrix product of the weights
+    with the shifted traces, the same as bootstrap_power_cube.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        Traces aligned on the arrival of interest, one for each pick of a
+        station (see pick_slots). Shape of [n,p] where n is the number
+        of traces and p is the points in each trace.
+
+    weights : 2D numpy array of floats
+        Weight of each trace in each bootstrap sample, shape [B,n].
+
+    pts_shifts : 2D numpy array of floats
+        Point shifts for each trace, shape [m,n] for m scrambles.
+
+    Returns
+    -------
+    powers : 2D numpy array of floats
+        Power of each scrambled stack, shape [B,m].
+    """
+
+    nboots = weights.shape[0]
+    nscrambles = pts_shifts.shape[0]
+
+    powers = np.zeros((nboots, nscrambles))
+
+    for s in nb.prange(nscrambles):
+        # shifted trace buffer private to the thread running this scramble
+        shifted = np.zeros(traces.shape)
+        for n in range(traces.shape[0]):
+            shift_accumulate(traces[n], int(pts_shifts[s, n]), shifted[n])
+
+        stacks = np.dot(weights, shifted)
+
+        for b in range(nboots):
+            powers[b, s] = np.sum(stacks[b] ** 2)
+
+    return powers
+
+
+def pick_slots(weights):
+    """
+    Gives each pick of a station its own trace, so a station picked more
+    than once can be scrambled independently for every pick like the
+    repeated traces of an explicit bootstrap sample.
+
+    Parameters
+    ----------
+    weights : 2D numpy array of floats
+        Number of times each station is picked in each sample, shape [B,n].
+
+    Returns
+    -------
+    slot_stations : 1D numpy array of ints
+        Station of each slot. There are as many slots for a station as the
+        most times it is picked in any sample.
+
+    slot_weights : 2D numpy array of floats
+        Weight of each slot in each sample, 1 / (number of picks) for the
+        slots a sample uses and 0 otherwise, shape [B,nslots].
+    """
+
+    max_picks = np.max(weights, axis=0).astype(int)
+    slot_stations = np.repeat(np.arange(weights.shape[1]), max_picks)
+
+    # which pick of its station each slot is, counting from 0
+    first_slot = np.cumsum(max_picks) - max_picks
+    slot_picks = np.arange(slot_stations.shape[0]) - first_slot[slot_stations]
+
+    slot_weights = (slot_picks < weights[:, slot_stations]) / np.sum(weights, axis=1)[:, np.newaxis]
+
+    return slot_stations, slot_weights
+
+
+def bootstrap_weights(ntrace, nboots, seed=None):
+    """
+    Draws bootstrap samples of the stations with replacement and returns
+    them as the number of times each station is picked.
+
+    Parameters
+    ----------
+    ntrace : int
+        Number of stations.
+
+    nboots : int
+        Number of bootstrap samples.
+
+    seed : int
+        Seed for the random samples. Default is None.
+
+    Returns
+    -------
+    weights : 2D numpy array of floats
+        Number of times each station is picked in each sample, shape [B,n].
+    """
+
+    rng = np.random.default_rng(seed)
+    rand_indices = rng.integers(0, ntrace, size=(nboots, ntrace))
+
+    weights = np.zeros((nboots, ntrace))
+    for b in range(nboots):
+        weights[b] = np.bincount(rand_indices[b], minlength=ntrace)
+
+    return weights
+
+
+def bootstrap_beamform_xy_batched(
+    traces, slow_min_x, slow_max_x, slow_min_y, slow_max_y, slow_space,
+    sampling_rate, geometry, distance, nboots, seed=None, weights=None,
+    noise_method="scramble", n_scrambles=1000, type='circ', elevation=False,
+    incidence=90
+):
+    """
+    Bootstrap beamforming over a cartesian slowness grid with all the
+    bootstrap samples evaluated together. Unlike resampling the traces and
+    geometry for each sample, the delay table is made once for the whole
+    array so every sample uses the same array centre and distance.
+
+    The noise is also found for all the samples together. The traces are
+    aligned once for each distinct peak and the noise of every sample with
+    that peak comes from the weights, either from the same scrambles
+    (bootstrap_scramble_powers) or in closed form
+    (noise_power_analytic_weighted). As for an explicit bootstrap sample,
+    each pick of a station is scrambled on its own.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        Traces of all the stations. Shape of [n,p] where n is the number
+        of traces and p is the points in each trace.
+
+    slow_min_x : float
+        Minimun magnitude of the slowness on x axis, used for creating the slowness grid.
+
+    slow_max_x : float
+        Maximum magnitude of slowness on x axis, used for creating the slowness grid.
+
+    slow_min_y : float
+        Minimun magnitude of the slowness on y axis, used for creating the slowness grid.
+
+    slow_max_y : float
+        Maximum magnitude of slowness on y axis, used for creating the slowness grid.
+
+    slow_space : float
+        The slowness interval for each step e.g. 0.1.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    nboots : int
+        Number of bootstrap samples.
+
+    seed : int
+        Seed for drawing the bootstrap samples and noise scrambles. Default is None.
+
+    weights : 2D numpy array of floats
+        Number of times each station is picked in each sample, shape [B,n].
+        If None (default), nboots samples are drawn with bootstrap_weights.
+
+    noise_method : string
+        "scramble" (default) or "analytic", see BF_Noise_Threshold_Relative_XY.
+
+    n_scrambles : int
+        Number of scrambles, shared by all the samples. Default is 1000.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    Returns
+    -------
+    tps : 3D numpy array of floats
+        Linear stack power grid for each bootstrap sample, shape [B,nsy,nsx].
+
+    noises : 1D numpy array of floats
+        Noise power estimate for each bootstrap sample.
+
+    peaks : 2D numpy array of floats
+        [slow_x, slow_y] of the maximum power for each bootstrap sample.
+    """
+
+    if weights is None:
+        weights = bootstrap_weights(traces.shape[0], nboots, seed)
+    weights = np.ascontiguousarray(weights, dtype=float)
+
+    pts_table = delay_table_xy(
+        geometry=geometry,
+        distance=distance,
+        sxmin=slow_min_x,
+        sxmax=slow_max_x,
+        symin=slow_min_y,
+        symax=slow_max_y,
+        s_space=slow_space,
+        sampling_rate=sampling_rate,
+        type=type,
+        elevation=elevation,
+        incidence=incidence
+    )
+
+    tps = bootstrap_power_cube(traces, pts_table, weights)
+
+    nboots = weights.shape[0]
+
+    # peak of each sample
+    peak_index = np.argmax(tps.reshape(nboots, -1), axis=1)
+    iy, ix = np.unravel_index(peak_index, tps.shape[1:])
+    peaks = np.column_stack((slow_min_x + (ix * slow_space), slow_min_y + (iy * slow_space)))
+
+    # one set of random shifts of up to half the trace length, like
+    # noise_scramble_powers, for each pick of each station
+    if noise_method != "analytic":
+        slot_stations, slot_weights = pick_slots(weights)
+        T = (traces.shape[1] / sampling_rate) / 2.0
+        # a child of the seed so the shifts do not repeat the station picks
+        rng = np.random.default_rng(np.random.SeedSequence(seed).spawn(1)[0])
+        r_values = rng.uniform(-1, 1, (n_scrambles, slot_stations.shape[0]))
+        pts_shift_noise = (T * r_values) * sampling_rate
+
+    # the traces only need aligning once for all the samples with the same
+    # peak, then the noise of those samples is found together
+    noises = np.zeros(nboots)
+    for index in np.unique(peak_index):
+        samples = peak_index == index
+        aligned = roll_2D(traces, pts_table[iy[samples][0], ix[samples][0]])
+
+        if noise_method == "analytic":
+            noises[samples] = noise_power_analytic_weighted(
+                aligned, sampling_rate, weights[samples]
+            )
+        else:
+            noises[samples] = np.median(
+                bootstrap_scramble_powers(
+                    aligned[slot_stations], slot_weights[samples], pts_shift_noise
+                ),
+                axis=1,
+            )
+
+    return tps, noises, peaks
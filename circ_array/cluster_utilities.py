@@ -1,15 +1,15 @@
 import numpy as np
-from scipy.stats import circmean, circstd, circvar
 import obspy
-from slow_vec_calcs import get_slow_baz
+from slow_vec_calcs import get_slow_baz_array
 from array_info import array
 from utilities import myround
 from geo_sphere_calcs import relocate_event_baz_slow
-from shift_stack import linear_stack_baz_slow, shift_traces
+from shift_stack import linear_stack_peaks, shift_traces
+from delay_tables import delay_table_baz_slow
 import obspy.signal.filter as o
 from sklearn.neighbors import KDTree
 import os
-from obspy.taup import TauPyModel
+from travel_time_tables import get_model
 
 
 
@@ -42,6 +42,150 @@ class cluster_utilities:
         # assert(labels.shape == points.shape[0])
         self.labels = labels
         self.points = points
+        self._sorted = None
+
+    def sort_points_clusters(self):
+        """
+        Sorts the points by their cluster label so the statistics of every
+        cluster can be found in one pass over the points rather than one
+        pass per cluster. Points labelled as noise (-1) are dropped. The
+        result is kept and only recalculated if the labels or points are
+        replaced.
+
+        Parameters
+        ----------
+
+        None
+
+        Returns
+        -------
+            sorted_labels : 1D array of ints
+                Cluster label of each sorted point.
+
+            sorted_points : 2D array of floats
+                Points in the clusters sorted by label, points in
+                the same cluster keep their original order.
+
+            counts : 1D array of ints
+                Number of points in each cluster.
+
+            starts : 1D array of ints
+                Index of the first point of each cluster in sorted_points.
+        """
+
+        if (
+            self._sorted is None
+            or self._sorted[0] is not self.labels
+            or self._sorted[1] is not self.points
+        ):
+            labels = np.asarray(self.labels)
+            points = np.asarray(self.points)
+            no_clusters = np.amax(labels) + 1
+
+            in_cluster = labels >= 0
+            order = np.argsort(labels[in_cluster], kind="stable")
+            sorted_labels = labels[in_cluster][order]
+            sorted_points = points[in_cluster][order]
+
+            counts = np.bincount(sorted_labels, minlength=no_clusters)
+            starts = np.cumsum(counts) - counts
+
+            self._sorted = (
+                self.labels,
+                self.points,
+                (sorted_labels, sorted_points, counts, starts),
+            )
+
+        return self._sorted[2]
+
+    def cluster_sums(self, values):
+        """
+        Sums values given for each sorted point over each cluster.
+
+        Parameters
+        ----------
+        values : 1D numpy array of floats
+            One value for each point in the order of sort_points_clusters.
+
+        Returns
+        -------
+            sums : 1D array of floats
+                Sum of the values in each cluster.
+        """
+
+        sorted_labels, sorted_points, counts, starts = self.sort_points_clusters()
+
+        return np.bincount(sorted_labels, weights=values, minlength=counts.shape[0])
+
+    def cluster_percentiles(self, values, q):
+        """
+        Finds the q-th percentile of values given for each sorted point in
+        each cluster. Uses the same linear interpolation as np.percentile.
+
+        Parameters
+        ----------
+        values : 1D numpy array of floats
+            One value for each point in the order of sort_points_clusters.
+
+        q : float
+            Percentile to find, between 0 and 100.
+
+        Returns
+        -------
+            percentiles : 1D array of floats
+                The percentile of the values in each cluster, nan for
+                clusters with no points.
+        """
+
+        sorted_labels, sorted_points, counts, starts = self.sort_points_clusters()
+
+        # sort the values within each cluster
+        sorted_values = values[np.lexsort((values, sorted_labels))]
+
+        percentiles = np.full(counts.shape[0], np.nan)
+        filled = counts > 0
+
+        position = (q / 100.0) * (counts[filled] - 1)
+        lower = np.floor(position).astype(int)
+        fraction = position - lower
+
+        first = starts[filled] + lower
+        second = np.minimum(first + 1, starts[filled] + counts[filled] - 1)
+
+        percentiles[filled] = sorted_values[first] + fraction * (
+            sorted_values[second] - sorted_values[first]
+        )
+
+        return percentiles
+
+    def cluster_circ_std(self, angles):
+        """
+        Finds the circular standard deviation of angles given for each
+        sorted point in each cluster. Gives the same values as scipy's
+        circstd for each cluster.
+
+        Parameters
+        ----------
+        angles : 1D numpy array of floats
+            One angle in degrees for each point in the order of
+            sort_points_clusters.
+
+        Returns
+        -------
+            circ_stds : 1D array of floats
+                Circular standard deviation in degrees of the angles in
+                each cluster.
+        """
+
+        sorted_labels, sorted_points, counts, starts = self.sort_points_clusters()
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_sin = self.cluster_sums(np.sin(np.radians(angles))) / counts
+            mean_cos = self.cluster_sums(np.cos(np.radians(angles))) / counts
+
+            R = np.minimum(np.hypot(mean_sin, mean_cos), 1)
+
+            return np.degrees(np.sqrt(-2 * np.log(R)))
 
     def group_points_clusters(self):
         """
@@ -61,23 +205,19 @@ class cluster_utilities:
                 particular cluster.
         """
 
-        points_clusters = []
+        sorted_labels, sorted_points, counts, starts = self.sort_points_clusters()
 
-        for p in range(np.amax(self.labels) + 1):
+        if counts.shape[0] == 0:
+            return []
 
-            points_x, points_y = (
-                self.points[np.where(self.labels == p)][:, 0],
-                self.points[np.where(self.labels == p)][:, 1],
-            )
-
-            points_cluster = np.array([points_x, points_y]).T
-            points_clusters.append(points_cluster)
+        points_clusters = np.split(sorted_points[:, :2], starts[1:])
 
         return points_clusters
 
     def eigsorted(self, cov):
         """
         Given a covariance matrix, calculate the eigenvalues and eigenvectors.
+        A stack of covariance matrices with shape [n,2,2] can also be given.
 
 
         Parameters
@@ -94,10 +234,37 @@ class cluster_utilities:
                 Eigenvectors in decending order.
         """
 
+        # eigh gives them in ascending order
         vals, vecs = np.linalg.eigh(cov)
-        order = vals.argsort()[::-1]  # create decending order
         # return eigenvalues and eigenvectors in decending order
-        return vals[order], vecs[:, order]
+        return vals[..., ::-1], vecs[..., ::-1]
+
+    def cluster_means_xy(self):
+        """
+        Returns the unrounded mean slow_x and slow_y of each cluster.
+
+        Parameters
+        ----------
+
+        None
+
+        Returns
+        -------
+            means_xy : 2D array of floats
+                Mean slow_x and slow_y for each cluster.
+        """
+
+        sorted_labels, sorted_points, counts, starts = self.sort_points_clusters()
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means_xy = np.array(
+                [
+                    self.cluster_sums(sorted_points[:, 0]) / counts,
+                    self.cluster_sums(sorted_points[:, 1]) / counts,
+                ]
+            ).T
+
+        return means_xy
 
     def cluster_means(self):
         """
@@ -106,17 +273,8 @@ class cluster_utilities:
 
         Parameters
         ----------
-        points : 2D numpy array of floats.
-            Array of points used to find clusters.
-
-        labels : 1D numpy array of integers.
-            Labels of each point for which cluster it is in.
 
-        rel_x : float
-            x component of slowness vector used to align traces for relative beamforming.
-
-        rel_y : float
-            y component of slowness vector used to align traces for relative beamforming.
+        None
 
         Returns
         -------
@@ -128,23 +286,16 @@ class cluster_utilities:
                     for each cluster.
         """
 
-        means_xy = []
-        means_baz_slow = []
-
-        for p in range(np.amax(self.labels) + 1):
-
-            p_x, p_y = (
-                np.mean(self.points[np.where(self.labels == p)][:, 0]),
-                np.mean(self.points[np.where(self.labels == p)][:, 1]),
-            )
+        means_xy = self.cluster_means_xy()
 
-            mean_abs_slow, mean_baz = get_slow_baz(p_x, p_y, dir_type="az")
+        mean_abs_slows, mean_bazs = get_slow_baz_array(
+            means_xy[:, 0], means_xy[:, 1], dir_type="az"
+        )
 
-            mean_abs_slow = np.around(mean_abs_slow, 2)
-            mean_baz = np.around(mean_baz, 1)
+        mean_abs_slows = np.around(mean_abs_slows, 2)
+        mean_bazs = np.around(mean_bazs, 1)
 
-            means_xy.append(np.array([p_x, p_y]))
-            means_baz_slow.append(np.array([mean_baz, mean_abs_slow]))
+        means_baz_slow = np.array([mean_bazs, mean_abs_slows]).T
 
         return np.around(means_xy, 2), np.around(means_baz_slow, 2)
 
@@ -170,59 +321,49 @@ class cluster_utilities:
                 slows_std : 1D array of floats
                     The standard deviation for horizontal slowness values
                     in each cluster.
-        """
-
-        bazs_std = []
-        slows_std = []
-        slow_x_std = []
-        slow_y_std = []
-        azs_std = []
-        mags_std = []
 
-        for p in range(np.amax(self.labels) + 1):
+                slow_x_std : 1D array of floats
+                    The standard deviation of slow_x in each cluster.
 
-            points_x, points_y = (
-                self.points[np.where(self.labels == p)][:, 0],
-                self.points[np.where(self.labels == p)][:, 1],
-            )
-
-            rel_xs = points_x - pred_x
-            rel_ys = points_y - pred_y
-
-            azs = np.degrees(np.arctan2(rel_ys,rel_xs))
-            mags = np.sqrt(rel_xs**2 + rel_ys**2)
+                slow_y_std : 1D array of floats
+                    The standard deviation of slow_y in each cluster.
 
-            azs = np.where(azs<0, azs + 360, azs)
+                azs_std : 1D array of floats
+                    The circular standard deviation of the direction of the
+                    points from the predicted slowness vector.
 
-            az_std = np.around(np.degrees(circstd(np.radians(azs))), 1)
-            mag_std = np.std(mags)
+                mags_std : 1D array of floats
+                    The standard deviation of the distance of the points
+                    from the predicted slowness vector.
+        """
 
-            x_std = np.std([points_x])
-            y_std = np.std([points_y])
+        sorted_labels, sorted_points, counts, starts = self.sort_points_clusters()
+        points_x = sorted_points[:, 0]
+        points_y = sorted_points[:, 1]
 
-            points_cluster = np.array([points_x, points_y]).T
+        def std(values):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                means = self.cluster_sums(values) / counts
+                devs = values - means[sorted_labels]
+                return np.sqrt(self.cluster_sums(devs ** 2) / counts)
 
-            abs_slows = np.zeros(points_x.shape)
-            bazs = np.zeros(points_x.shape)
+        rel_xs = points_x - pred_x
+        rel_ys = points_y - pred_y
 
-            for i,point_x in enumerate(points_x):
+        azs = np.degrees(np.arctan2(rel_ys, rel_xs))
+        mags = np.sqrt(rel_xs ** 2 + rel_ys ** 2)
 
-                point_y = points_y[i]
+        azs_std = np.around(self.cluster_circ_std(azs), 1)
+        mags_std = std(mags)
 
-                abs_slow, baz = get_slow_baz(point_x, point_y, dir_type="az")
-                abs_slows[i] = abs_slow
-                bazs[i] = baz
+        slow_x_std = std(points_x)
+        slow_y_std = std(points_y)
 
-            abs_slow_std_dev = np.around(np.std(abs_slows), 2)
-            # stdev - use scipy's circstd
-            baz_std_dev = np.around(np.degrees(circstd(np.radians(bazs))), 1)
+        abs_slows, bazs = get_slow_baz_array(points_x, points_y, dir_type="az")
 
-            bazs_std.append(baz_std_dev)
-            slows_std.append(abs_slow_std_dev)
-            slow_x_std.append(x_std)
-            slow_y_std.append(y_std)
-            azs_std.append(az_std)
-            mags_std.append(mag_std)
+        slows_std = np.around(std(abs_slows), 2)
+        # stdev - same as scipy's circstd
+        bazs_std = np.around(self.cluster_circ_std(bazs), 1)
 
         return np.around(bazs_std, 2), np.around(slows_std, 2), np.around(slow_x_std, 2), np.around(slow_y_std, 2), np.around(azs_std, 2), np.around(mags_std, 2)
 
@@ -233,35 +374,29 @@ class cluster_utilities:
 
         Parameters
         ----------
-        rel_x : float
-               x component of slowness vector used to align traces for relative beamforming.
 
-        rel_y : float
-               y component of slowness vector used to align traces for relative beamforming.
+        None
 
         Returns
         -------
-            covariance_matrices : 1D array of floats
-                Covariance matrices.
+            covariance_matrices : 3D array of floats
+                Covariance matrices with shape [n,2,2] for n clusters.
         """
 
-        covariance_matrices = []
+        sorted_labels, sorted_points, counts, starts = self.sort_points_clusters()
 
-        for p in range(np.amax(self.labels) + 1):
+        means_xy = self.cluster_means_xy()
+        devs = sorted_points[:, :2] - means_xy[sorted_labels]
 
-            points_x, points_y = (
-                self.points[np.where(self.labels == p)][:, 0],
-                self.points[np.where(self.labels == p)][:, 1],
-            )
-            #
-            # points_x += rel_x
-            # points_y += rel_y
-
-            co_mat = np.cov(np.array([points_x, points_y]).T, rowvar=False)
+        covariance_matrices = np.zeros((counts.shape[0], 2, 2))
 
-            covariance_matrices.append(co_mat)
-
-        covariance_matrices = np.array(covariance_matrices)
+        # same normalisation as np.cov
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in range(2):
+                for j in range(i, 2):
+                    co_var = self.cluster_sums(devs[:, i] * devs[:, j]) / (counts - 1)
+                    covariance_matrices[:, i, j] = co_var
+                    covariance_matrices[:, j, i] = co_var
 
         return covariance_matrices
 
@@ -282,31 +417,20 @@ class cluster_utilities:
 
         """
 
-        ellipse_properties = []
+        co_mats = self.covariance_matrices()
 
-        for p in range(np.amax(self.labels) + 1):
+        # calculate the area of the ellipse
+        vals, vecs = self.eigsorted(co_mats)
 
-            points_x, points_y = (
-                self.points[np.where(self.labels == p)][:, 0],
-                self.points[np.where(self.labels == p)][:, 1],
-            )
+        # calculate the width and height of the ellipse
+        widths = 2 * std_dev * np.sqrt(vals[:, 0])
+        heights = 2 * std_dev * np.sqrt(vals[:, 1])
 
-            # points_x += rel_x
-            # points_y += rel_y
+        thetas = np.degrees(np.arctan2(vecs[:, 1, 0], vecs[:, 0, 0]))
 
-            points_cluster = np.array([points_x, points_y]).T
-
-            co_mat = np.cov(np.array([points_x, points_y]).T, rowvar=False)
-
-            # calculate the area of the ellipse
-            vals, vecs = self.eigsorted(co_mat)
-
-            # calculate the width and height of the ellipse
-            width, height = 2 * std_dev * np.sqrt(vals)
-
-            theta = np.degrees(np.arctan2(*vecs[:, 0][::-1]))
-
-            ellipse_properties.append([p, width, height, theta])
+        ellipse_properties = np.array(
+            [np.arange(co_mats.shape[0]), widths, heights, thetas]
+        ).T
 
         return np.around(ellipse_properties, 2)
 
@@ -320,68 +444,37 @@ class cluster_utilities:
         std_dev : int.
                  Standard deviation of error ellipse (typically 1,2, or 3).
 
-        rel_x : float
-               x component of slowness vector used to align traces for relative beamforming.
-
-        rel_y : float
-               y component of slowness vector used to align traces for relative beamforming.
-
         Returns
         -------
                 ellipse_areas 1D array of the area for the error ellipse of the points in each cluster.
 
         """
 
-        ellipse_areas = []
+        co_mats = self.covariance_matrices()
 
-        for p in range(np.amax(self.labels) + 1):
+        # calculate the area of the ellipse
+        vals, vecs = self.eigsorted(co_mats)
 
-            points_x, points_y = (
-                self.points[np.where(self.labels == p)][:, 0],
-                self.points[np.where(self.labels == p)][:, 1],
-            )
+        # calculate the width and height of the ellipse
+        widths = 2 * std_dev * np.sqrt(vals[:, 0])
+        heights = 2 * std_dev * np.sqrt(vals[:, 1])
 
-            # points_x += rel_x
-            # points_y += rel_y
-
-            points_cluster = np.array([points_x, points_y]).T
-
-            co_mat = np.cov(np.array([points_x, points_y]).T, rowvar=False)
-
-            # calculate the area of the ellipse
-            vals, vecs = self.eigsorted(co_mat)
-
-            # calculate the width and height of the ellipse
-            width, height = 2 * std_dev * np.sqrt(vals)
-
-            Area_error_ellipse = np.pi * (width / 2) * (height / 2)
-
-            ellipse_areas.append(Area_error_ellipse)
+        ellipse_areas = np.pi * (widths / 2) * (heights / 2)
 
         return np.around(ellipse_areas, 2)
 
     def cluster_baz_slow_95_conf(self, std_dev):
         """
         Given data points and cluster labels, return the 95% confidence range for baz and
-        horizontal slowness in the cluster.
+        horizontal slowness in the cluster. The backazimuth range is found from the
+        differences to the backazimuth of the mean slowness vector so it is not
+        affected by clusters crossing 0/360.
 
         Parameters
         ----------
-        points : 2D numpy array of floats.
-                Array of points used to find clusters.
-
-        labels : 1D numpy array of integers.
-                Labels of each point for which cluster it is in.
-
         std_dev : int
                  Standard deviation of error ellipse (typically 1,2, or 3).
 
-        rel_x : float
-               x component of slowness vector used to align traces for relative beamforming.
-
-        rel_y : float
-               y component of slowness vector used to align traces for relative beamforming.
-
         Returns
         -------
                 bazs_95_confidence 2D array of floats. Each row contains the upper and lower
@@ -394,56 +487,42 @@ class cluster_utilities:
 
         """
 
-        bazs_95_confidence = []
-        slows_95_confidence = []
-
-        for p in range(np.amax(self.labels) + 1):
-
-            points_x, points_y = (
-                self.points[np.where(self.labels == p)][:, 0],
-                self.points[np.where(self.labels == p)][:, 1],
-            )
-
-            # points_x += rel_x
-            # points_y += rel_y
-
-            points_cluster = np.array([points_x, points_y]).T
+        sorted_labels, sorted_points, counts, starts = self.sort_points_clusters()
 
-            abs_slows, bazs = get_slow_baz_array(points_x, points_y, dir_type="az")
+        abs_slows, bazs = get_slow_baz_array(
+            sorted_points[:, 0], sorted_points[:, 1], dir_type="az"
+        )
 
-            mean_abs_slow = np.around(mean_abs_slow, 2)
-            mean_baz = np.around(mean_baz, 1)
+        means_xy, means_baz_slow = self.cluster_means()
+        mean_bazs = means_baz_slow[:, 0]
 
-            abs_slows_sorted = np.sort(abs_slows)
-            lower_abs_slow = np.around(np.percentile(abs_slows_sorted, 2.5), 2)
-            upper_abs_slow = np.around(np.percentile(abs_slows_sorted, 97.5), 2)
+        lower_abs_slows = np.around(self.cluster_percentiles(abs_slows, 2.5), 2)
+        upper_abs_slows = np.around(self.cluster_percentiles(abs_slows, 97.5), 2)
 
-            baz_diff = 360.0 - mean_baz
+        baz_diffs = 360.0 - mean_bazs[sorted_labels]
 
-            # now rotate all angles by this so the mean baz is at 0/360
-            rotated_bazs = (bazs + baz_diff) % 360
+        # now rotate all angles by this so the mean baz is at 0/360
+        rotated_bazs = (bazs + baz_diffs) % 360
 
-            # Now, using arctan2(), can find the angle difference frmo -pi to +pi
-            diffs = np.degrees(
-                np.arctan2(
-                    np.sin(np.radians(rotated_bazs)), np.cos(np.radians(rotated_bazs))
-                )
+        # Now, using arctan2(), can find the angle difference frmo -pi to +pi
+        diffs = np.degrees(
+            np.arctan2(
+                np.sin(np.radians(rotated_bazs)), np.cos(np.radians(rotated_bazs))
             )
+        )
 
-            # order the diffs and get the percentiles
-            diffs_sorted = np.sort(diffs)
-            diffs_lower = np.percentile(diffs_sorted, 2.5)
-            diffs_upper = np.percentile(diffs_sorted, 97.5)
-
-            # convert this to values relative to baz mean (?)
-            baz_lower = np.around(mean_baz + diffs_lower, 1)
-            baz_upper = np.around(mean_baz + diffs_upper, 1)
+        # get the percentiles of the differences
+        diffs_lower = self.cluster_percentiles(diffs, 2.5)
+        diffs_upper = self.cluster_percentiles(diffs, 97.5)
 
-            bazs_95_confidence.append([baz_lower, baz_upper])
-            slows_95_confidence.append([lower_abs_slow, upper_abs_slow])
+        # convert this to values relative to baz mean (?)
+        baz_lowers = np.around(mean_bazs + diffs_lower, 1)
+        baz_uppers = np.around(mean_bazs + diffs_upper, 1)
 
-        return np.array(bazs_95_confidence), np.array(slows_95_confidence)
+        bazs_95_confidence = np.array([baz_lowers, baz_uppers]).T
+        slows_95_confidence = np.array([lower_abs_slows, upper_abs_slows]).T
 
+        return bazs_95_confidence, slows_95_confidence
 
     def remove_noisy_arrivals(self, st, phase, slow_vec_error=3):
         """
@@ -520,69 +599,81 @@ class cluster_utilities:
                               geometry,
                               distance,
                               pred_x,
-                              pred_y):
+                              pred_y,
+                              interpolate=False):
         """
         Given cluster information, estimate the arrival times of each
         point in the cluster. Note this assumes the traces have been shifted relative
         to a predicted arrival and the cluster points are relative to this
         predicted arrival.
 
+        The delays for every point are put in one delay table and all the beams
+        are stacked in a single compiled call. Bootstrap peaks often land on the
+        same slowness vector so each distinct vector is only stacked once.
 
+        Parameters
+        ----------
+        traces : 2D numpy array of floats
+            Traces shifted relative to the predicted arrival.
 
-        """
-
-        times_arrivals = []
-
-        # for each cluster
-        for p in range(np.amax(self.labels) + 1):
-            times = []
-            points_x, points_y = (
-                self.points[np.where(self.labels == p)][:, 0],
-                self.points[np.where(self.labels == p)][:, 1],
-            )
+        tmin : float
+            Time of the first point of the traces.
 
+        sampling_rate : float
+            Sampling rate of the data points in s^-1.
 
-            points_x -= pred_x
-            points_y -= pred_y
+        geometry : 2D array of floats
+            2D array describing the lon lat and elevation of the stations [lon,lat,depth]
 
-            abs_slows = np.zeros(points_x.shape)
-            bazs = np.zeros(points_x.shape)
+        distance : float
+            Epicentral distance from the event to the centre of the array.
 
-            for i,point_x in enumerate(points_x):
+        pred_x : float
+            x component of the predicted slowness vector.
 
-                point_y = points_y[i]
+        pred_y : float
+            y component of the predicted slowness vector.
 
-                abs_slow, baz = get_slow_baz(point_x, point_y, dir_type="az")
-                abs_slows[i] = abs_slow
-                bazs[i] = baz
+        interpolate : bool
+            If True, the envelope peak of each beam is refined between
+            samples with a parabola. Default is False.
 
+        Returns
+        -------
+        times_arrivals : list of 1D numpy arrays of floats
+            Arrival time estimated from each point in each cluster.
+        """
 
-            for i,baz in enumerate(bazs):
-                slow = abs_slows[i]
+        sorted_labels, sorted_points, counts, starts = self.sort_points_clusters()
 
-                # shift and stack the traces linearly along the
-                # backazimuth and slowness
+        if counts.shape[0] == 0:
+            return []
 
-                lin_stack = linear_stack_baz_slow(traces, sampling_rate, geometry, distance, slow, baz)
+        points_rel = sorted_points[:, :2] - np.array([pred_x, pred_y])
+        points_unique, inverse = np.unique(points_rel, axis=0, return_inverse=True)
 
-                # calculate the envelope of this stack and recover the maximum
+        abs_slows, bazs = get_slow_baz_array(
+            points_unique[:, 0], points_unique[:, 1], dir_type="az"
+        )
 
-                data_envelope = abs(lin_stack)
+        delay_table = delay_table_baz_slow(
+            geometry=geometry,
+            distance=float(distance),
+            abs_slows=abs_slows,
+            bazs=bazs,
+            sampling_rate=float(sampling_rate),
+        )
 
-                # get the index of the max value
-                imax = np.where(data_envelope == np.amax(data_envelope))[0][0]
+        # point of the envelope peak of the beam for each distinct vector
+        peak_points = linear_stack_peaks(
+            np.ascontiguousarray(traces, dtype=float), delay_table, interpolate
+        )
 
-                # get this index in seconds and add to the start of the window
-                time = (imax / sampling_rate) + tmin
+        # get these points in seconds and add to the start of the window
+        times = (peak_points[inverse.reshape(-1)] / sampling_rate) + tmin
 
-                times.append(time)
-                # import matplotlib.pyplot as plt
-                # plt.plot(lin_stack)
-                # plt.title(imax)
-                # plt.show()
+        times_arrivals = np.split(times, starts[1:])
 
-            times = np.array(times)
-            times_arrivals.append(times)
         return times_arrivals
 
     def create_newlines(
@@ -635,7 +726,7 @@ class cluster_utilities:
 
         """
 
-        model = TauPyModel(model='prem')
+        model = get_model("prem")
 
         newlines = []
         header = ("Name evla evlo evdp reloc_evla reloc_evlo "
@@ -804,6 +895,17 @@ class cluster_utilities:
         usable_arrivals = 0
 
         if no_clusters != 0:
+            # relocate the event for every cluster at once
+            reloc_evlas, reloc_evlos = relocate_event_baz_slow(evla=evla,
+                                                               evlo=evlo,
+                                                               evdp=evdp,
+                                                               stla=stla_mean,
+                                                               stlo=stlo_mean,
+                                                               baz=means_baz_slow[:, 0],
+                                                               slow=means_baz_slow[:, 1],
+                                                               phase=phase,
+                                                               mod='prem')
+
             for i in range(no_clusters):
 
                 # create label for the arrival
@@ -847,15 +949,8 @@ class cluster_utilities:
 
 
                 # relocated event location
-                reloc_evla, reloc_evlo = relocate_event_baz_slow(evla=evla,
-                                                                evlo=evlo,
-                                                                evdp=evdp,
-                                                                stla=stla_mean,
-                                                                stlo=stlo_mean,
-                                                                baz=baz_obs,
-                                                                slow=slow_obs,
-                                                                phase=phase,
-                                                                mod='prem')
+                reloc_evla = reloc_evlas[i]
+                reloc_evlo = reloc_evlos[i]
 
 
                 times = arrival_times[i]
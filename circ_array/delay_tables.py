@@ -0,0 +1,603 @@
+from numba import jit, prange
+import numpy as np
+from shift_stack import (
+    calculate_point_shifts,
+    calculate_relative_distances,
+    calculate_elevation_times,
+)
+from slow_vec_calcs import get_slow_baz
+
+
+@jit(nopython=True, fastmath=True, parallel=True)
+def delay_table_xy(
+    geometry,
+    distance,
+    sxmin,
+    sxmax,
+    symin,
+    symax,
+    s_space,
+    sampling_rate,
+    type='circ',
+    elevation=False,
+    incidence=90,
+):
+    """
+    Calculates the point shifts for every station at every slowness vector
+    in a cartesian slowness grid. The grid is the same as the one searched
+    over by the BF_XY_* functions so the table can be built once and passed
+    to each of them.
+
+    Parameters
+    ----------
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    sxmax : float
+        Maximum magnitude of slowness on x axis, used for creating the slowness grid.
+
+    sxmin : float
+        Minimun magnitude of the slowness on x axis, used for creating the slowness grid.
+
+    symax : float
+        Maximum magnitude of slowness on y axis, used for creating the slowness grid.
+
+    symin : float
+        Minimun magnitude of the slowness on y axis, used for creating the slowness grid.
+
+    s_space : float
+        The slowness interval for each step e.g. 0.1.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    Returns
+    -------
+    delay_table : 3D numpy array of floats
+        Point shifts of shape [nsy, nsx, n] where n is the number of stations.
+    """
+
+    centre_x = np.mean(geometry[:, 0])
+    centre_y = np.mean(geometry[:, 1])
+
+    # get number of points.
+    nsx = int(np.round(((sxmax - sxmin) / s_space), 0) + 1)
+    nsy = int(np.round(((symax - symin) / s_space), 0) + 1)
+
+    slow_xs = np.linspace(sxmin, sxmax + s_space, nsx)
+    slow_ys = np.linspace(symin, symax + s_space, nsy)
+
+    delay_table = np.zeros((nsy, nsx, geometry.shape[0]))
+
+    for i in prange(slow_ys.shape[0]):
+        for j in range(slow_xs.shape[0]):
+
+            sx = float(slow_xs[int(j)])
+            sy = float(slow_ys[int(i)])
+
+            # get the slowness and backazimuth of the vector
+            abs_slow, baz = get_slow_baz(sx, sy, "az")
+
+            delay_table[i, j] = calculate_point_shifts(
+                geometry=geometry,
+                abs_slow=float(abs_slow),
+                baz=float(baz),
+                distance=float(distance),
+                centre_x=float(centre_x),
+                centre_y=float(centre_y),
+                sampling_rate=sampling_rate,
+                elevation=elevation,
+                incidence=incidence,
+                type=type,
+            )
+
+    return delay_table
+
+
+@jit(nopython=True, fastmath=True, parallel=True)
+def delay_table_pol(
+    geometry,
+    distance,
+    smin,
+    smax,
+    bazmin,
+    bazmax,
+    s_space,
+    baz_space,
+    sampling_rate,
+    type='circ',
+    elevation=False,
+    incidence=90,
+):
+    """
+    Calculates the point shifts for every station at every slowness vector
+    in a polar slowness grid. The grid is the same as the one searched
+    over by the BF_Pol_* functions.
+
+    Parameters
+    ----------
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    smax : float
+        Maximum magnitude of slowness.
+
+    smin : float
+        Minimun magnitude of the slowness.
+
+    bazmin : float
+        Minimum backazimuth value to search over.
+
+    bazmax : float
+        Maximum backazimuth value to search over.
+
+    s_space : float
+        The slowness interval for each step e.g. 0.05.
+
+    baz_space : float
+        The backazimuth interval for each step e.g. 0.1.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    Returns
+    -------
+    delay_table : 3D numpy array of floats
+        Point shifts of shape [nslow, nbaz, n] where n is the number of stations.
+    """
+
+    centre_x = np.mean(geometry[:, 0])
+    centre_y = np.mean(geometry[:, 1])
+
+    # get number of points.
+    nslow = int(np.round(((smax - smin) / s_space) + 1))
+    nbaz = int(np.round(((bazmax - bazmin) / baz_space) + 1))
+
+    slows = np.linspace(smin, smax + s_space, nslow)
+    bazs = np.linspace(bazmin, bazmax + baz_space, nbaz)
+
+    delay_table = np.zeros((nslow, nbaz, geometry.shape[0]))
+
+    elevation_times = station_elevation_times(geometry, elevation, incidence)
+
+    for j in prange(bazs.shape[0]):
+
+        # the station distances only depend on the backazimuth,
+        # the slowness scales them to times.
+        dists_rel = calculate_relative_distances(
+            geometry=geometry,
+            baz=float(bazs[int(j)]),
+            distance=float(distance),
+            centre_x=float(centre_x),
+            centre_y=float(centre_y),
+            type=type,
+        )
+
+        for i in range(slows.shape[0]):
+            times = (dists_rel * slows[int(i)]) + elevation_times
+            delay_table[i, j] = (times * -1) * sampling_rate
+
+    return delay_table
+
+
+@jit(nopython=True, fastmath=True, parallel=True)
+def delay_table_slow(
+    geometry,
+    distance,
+    baz,
+    smin,
+    smax,
+    s_space,
+    sampling_rate,
+    type='circ',
+    elevation=False,
+    incidence=90,
+):
+    """
+    Calculates the point shifts for every station at each slowness
+    along a constant backazimuth. The slownesses are the same as the
+    ones used by the Vespagram_* functions.
+
+    Parameters
+    ----------
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    baz : float
+        Constant backazimuth value to use.
+
+    smax : float
+        Maximum magnitude of slowness.
+
+    smin : float
+        Minimun magnitude of the slowness.
+
+    s_space : float
+        The slowness interval for each step e.g. 0.05.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    Returns
+    -------
+    delay_table : 2D numpy array of floats
+        Point shifts of shape [nslow, n] where n is the number of stations.
+    """
+
+    centre_x = np.mean(geometry[:, 0])
+    centre_y = np.mean(geometry[:, 1])
+
+    nslow = int(((smax - smin) / s_space) + 1)
+    slows = np.linspace(smin, smax + s_space, nslow)
+
+    delay_table = np.zeros((nslow, geometry.shape[0]))
+
+    elevation_times = station_elevation_times(geometry, elevation, incidence)
+
+    # the station distances only depend on the backazimuth
+    # so are the same for every slowness.
+    dists_rel = calculate_relative_distances(
+        geometry=geometry,
+        baz=float(baz),
+        distance=float(distance),
+        centre_x=float(centre_x),
+        centre_y=float(centre_y),
+        type=type,
+    )
+
+    for i in prange(slows.shape[0]):
+        times = (dists_rel * slows[int(i)]) + elevation_times
+        delay_table[i] = (times * -1) * sampling_rate
+
+    return delay_table
+
+
+@jit(nopython=True, fastmath=True, parallel=True)
+def delay_table_baz(
+    geometry,
+    distance,
+    slow,
+    bmin,
+    bmax,
+    b_space,
+    sampling_rate,
+    type='circ',
+    elevation=False,
+    incidence=90,
+):
+    """
+    Calculates the point shifts for every station at each backazimuth
+    with a constant slowness. The backazimuths are the same as the
+    ones used by the Baz_vespagram_* functions.
+
+    Parameters
+    ----------
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    slow : float
+        Constant slowness value to use.
+
+    bmax : float
+        Maximum backazimuth.
+
+    bmin : float
+        Minimum backazimuth.
+
+    b_space : float
+        The backazimuth interval for each step e.g. 0.05.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    Returns
+    -------
+    delay_table : 2D numpy array of floats
+        Point shifts of shape [nbaz, n] where n is the number of stations.
+    """
+
+    centre_x = np.mean(geometry[:, 0])
+    centre_y = np.mean(geometry[:, 1])
+
+    nbaz = int(((bmax - bmin) / b_space) + 1)
+    bazs = np.linspace(bmin, bmax + b_space, nbaz)
+
+    delay_table = np.zeros((nbaz, geometry.shape[0]))
+
+    elevation_times = station_elevation_times(geometry, elevation, incidence)
+
+    for i in prange(bazs.shape[0]):
+
+        # station distances for this backazimuth scaled by the slowness
+        dists_rel = calculate_relative_distances(
+            geometry=geometry,
+            baz=float(bazs[int(i)]),
+            distance=float(distance),
+            centre_x=float(centre_x),
+            centre_y=float(centre_y),
+            type=type,
+        )
+
+        times = (dists_rel * slow) + elevation_times
+        delay_table[i] = (times * -1) * sampling_rate
+
+    return delay_table
+
+
+@jit(nopython=True, fastmath=True, parallel=True)
+def delay_table_baz_slow(
+    geometry,
+    distance,
+    abs_slows,
+    bazs,
+    sampling_rate,
+    type='circ',
+    elevation=False,
+    incidence=90,
+):
+    """
+    Calculates the point shifts for every station at each of a list of
+    slowness vectors, e.g. the points in a cluster, rather than a regular grid.
+
+    Parameters
+    ----------
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    abs_slows : 1D array of floats
+        Horizontal slowness of each slowness vector.
+
+    bazs : 1D array of floats
+        Backazimuth of each slowness vector.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    Returns
+    -------
+    delay_table : 2D numpy array of floats
+        Point shifts of shape [m, n] where m is the number of slowness
+        vectors and n is the number of stations.
+    """
+
+    centre_x = np.mean(geometry[:, 0])
+    centre_y = np.mean(geometry[:, 1])
+
+    delay_table = np.zeros((abs_slows.shape[0], geometry.shape[0]))
+
+    for i in prange(abs_slows.shape[0]):
+        delay_table[i] = calculate_point_shifts(
+            geometry=geometry,
+            abs_slow=float(abs_slows[int(i)]),
+            baz=float(bazs[int(i)]),
+            distance=float(distance),
+            centre_x=float(centre_x),
+            centre_y=float(centre_y),
+            sampling_rate=sampling_rate,
+            elevation=elevation,
+            incidence=incidence,
+            type=type,
+        )
+
+    return delay_table
+
+
+@jit(nopython=True, fastmath=True)
+def station_elevation_times(geometry, elevation=False, incidence=90):
+    """
+    Returns the relative arrival times due to station elevation, or
+    zeros if elevation corrections are not being used.
+
+    Parameters
+    ----------
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections. Default is 90.
+
+    Returns
+    -------
+    elevation_times : 1D numpy array of floats
+        Relative arrival time at each station from its elevation.
+    """
+
+    if elevation:
+        elevation_times = calculate_elevation_times(geometry, incidence)
+    else:
+        elevation_times = np.zeros(geometry.shape[0])
+
+    return elevation_times
+
+
+@jit(nopython=True)
+def split_delay_table(delay_table):
+    """
+    Splits a table of point shifts into the whole number of points
+    applied by roll_2D and the fraction of a point left over.
+
+    Parameters
+    ----------
+    delay_table : numpy array of floats
+        Point shifts from one of the delay_table_* functions.
+
+    Returns
+    -------
+    int_shifts : numpy array of ints
+        Whole point shifts (truncated towards zero as in roll_2D).
+    frac_shifts : numpy array of floats
+        The remaining fraction of a point, between -1 and 1.
+    """
+
+    int_shifts = np.trunc(delay_table).astype(np.int64)
+    frac_shifts = delay_table - int_shifts
+
+    return int_shifts, frac_shifts
+
+
+@jit(nopython=True)
+def shift_vector_index(delay_table):
+    """
+    Finds grid points whose stations are shifted by exactly the same whole
+    number of points, as these give identical stacks. Each grid point is
+    labelled with the flat (row major) index of the first grid point with
+    the same shift vector so only that one needs stacking.
+
+    Parameters
+    ----------
+    delay_table : numpy array of floats
+        Point shifts from one of the delay_table_* functions. The last
+        axis is the stations.
+
+    Returns
+    -------
+    first_index : 1D numpy array of ints
+        For each grid point (flattened), the flat index of the first grid
+        point with the same whole number shifts. Equal to its own index
+        if the shift vector has not been seen before.
+    """
+
+    nsta = delay_table.shape[-1]
+    shifts = np.trunc(delay_table.copy().reshape((-1, nsta))).astype(np.int64)
+    npoint = shifts.shape[0]
+
+    first_index = np.empty(npoint, dtype=np.int64)
+
+    # open addressing hash table of point indices, -1 is empty
+    size = 1
+    while size < 2 * npoint:
+        size *= 2
+    table = np.full(size, -1, dtype=np.int64)
+
+    for p in range(npoint):
+
+        h = np.int64(1469598103934665603)
+        for k in range(nsta):
+            h = (h ^ shifts[p, k]) * np.int64(1099511628211)
+        slot = h & (size - 1)
+
+        while True:
+            q = table[slot]
+            if q == -1:
+                table[slot] = p
+                first_index[p] = p
+                break
+
+            same = True
+            for k in range(nsta):
+                if shifts[q, k] != shifts[p, k]:
+                    same = False
+                    break
+            if same:
+                first_index[p] = q
+                break
+
+            slot = (slot + 1) & (size - 1)
+
+    return first_index
+
+
+def shift_vector_stats(delay_table):
+    """
+    Reports how many stacks can be reused when the grid points with
+    the same whole number shifts are only stacked once.
+
+    Parameters
+    ----------
+    delay_table : numpy array of floats
+        Point shifts from one of the delay_table_* functions.
+
+    Returns
+    -------
+    n_points : int
+        Number of grid points.
+
+    n_unique : int
+        Number of distinct shift vectors i.e. stacks that are calculated.
+
+    hit_rate : float
+        Fraction of grid points which reuse a stack.
+    """
+
+    first_index = shift_vector_index(delay_table)
+
+    n_points = first_index.shape[0]
+    n_unique = int(np.sum(first_index == np.arange(n_points)))
+    hit_rate = 1 - (n_unique / n_points)
+
+    return n_points, n_unique, hit_rate
@@ -1,9 +1,268 @@
 
 import numpy as np
-from scipy.ndimage.filters import maximum_filter
-from scipy.ndimage.morphology import generate_binary_structure, binary_erosion
+from numba import jit, prange
+from slow_vec_calcs import quadratic_peak_offset
 
-def findpeaks_XY(Array, xmin, xmax, ymin, ymax, xstep, ystep, N=10):
+
+@jit(nopython=True, fastmath=True, parallel=True)
+def peak_indices_3D(Arrays, N):
+    """
+    Finds the N highest local maxima in each 2D array of a stack. A point
+    is a local maximum if no point in its 3x3 neighbourhood is higher,
+    unless it and all its neighbours are 0 (the background). This is the
+    same test findpeaks_XY made with scipy's maximum_filter and
+    binary_erosion. Only the best N points are kept as the array is
+    scanned so the candidates are never fully sorted.
+
+    Parameters
+    ----------
+    Arrays : 3D numpy array of floats
+        Stack of 2D arrays, shape [B,ny,nx].
+
+    N : int
+        Number of peaks to find in each array.
+
+    Returns
+    -------
+    rows : 2D numpy array of ints
+        Row index of the peaks in each array in descending power,
+        shape [B,N]. -1 where fewer than N peaks were found.
+
+    cols : 2D numpy array of ints
+        Column index of the peaks, shape [B,N].
+
+    powers : 2D numpy array of floats
+        Value of the array at each peak, shape [B,N].
+
+    n_found : 1D numpy array of ints
+        Number of peaks found in each array.
+    """
+
+    nb = Arrays.shape[0]
+    ny = Arrays.shape[1]
+    nx = Arrays.shape[2]
+
+    rows = np.full((nb, N), -1, dtype=np.int64)
+    cols = np.full((nb, N), -1, dtype=np.int64)
+    powers = np.zeros((nb, N))
+    n_found = np.zeros(nb, dtype=np.int64)
+
+    for b in prange(nb):
+        # best N values so far in descending order
+        best_vals = np.zeros(N)
+        best_idx = np.zeros(N, dtype=np.int64)
+        count = 0
+
+        for i in range(ny):
+            for j in range(nx):
+                v = Arrays[b, i, j]
+
+                # cannot make the top N, equal values are taken
+                # in favour of the later point
+                if count == N and v < best_vals[N - 1]:
+                    continue
+
+                is_max = True
+                all_zero = v == 0
+                for ii in range(max(i - 1, 0), min(i + 2, ny)):
+                    for jj in range(max(j - 1, 0), min(j + 2, nx)):
+                        w = Arrays[b, ii, jj]
+                        if w > v:
+                            is_max = False
+                        if w != 0:
+                            all_zero = False
+
+                if not is_max or all_zero:
+                    continue
+
+                # insert into the sorted buffer, dropping the lowest if full
+                if count < N:
+                    pos = count
+                    count += 1
+                else:
+                    pos = N - 1
+                while pos > 0 and best_vals[pos - 1] <= v:
+                    best_vals[pos] = best_vals[pos - 1]
+                    best_idx[pos] = best_idx[pos - 1]
+                    pos -= 1
+                best_vals[pos] = v
+                best_idx[pos] = (i * nx) + j
+
+        n_found[b] = count
+        for k in range(count):
+            rows[b, k] = best_idx[k] // nx
+            cols[b, k] = best_idx[k] % nx
+            powers[b, k] = best_vals[k]
+
+    return rows, cols, powers, n_found
+
+
+
+@jit(nopython=True, fastmath=True, parallel=True)
+def peak_offsets_3D(Arrays, rows, cols):
+    """
+    Sub-grid offsets of the peaks from peak_indices_3D found by fitting
+    a quadratic to the 3x3 points around each one.
+
+    Parameters
+    ----------
+    Arrays : 3D numpy array of floats
+        Stack of 2D arrays, shape [B,ny,nx].
+
+    rows : 2D numpy array of ints
+        Row index of the peaks, -1 where there is no peak.
+
+    cols : 2D numpy array of ints
+        Column index of the peaks.
+
+    Returns
+    -------
+    row_offsets : 2D numpy array of floats
+        Offset of each peak along the rows in grid steps.
+
+    col_offsets : 2D numpy array of floats
+        Offset of each peak along the columns in grid steps.
+    """
+
+    row_offsets = np.zeros(rows.shape)
+    col_offsets = np.zeros(rows.shape)
+
+    for b in prange(rows.shape[0]):
+        for k in range(rows.shape[1]):
+            if rows[b, k] >= 0:
+                dy, dx = quadratic_peak_offset(Arrays[b], rows[b, k], cols[b, k])
+                row_offsets[b, k] = dy
+                col_offsets[b, k] = dx
+
+    return row_offsets, col_offsets
+
+def findpeaks_XY_batch(Arrays, xmin, xmax, ymin, ymax, xstep, ystep, N=10, interpolate=False):
+    """
+    Finds the top N peaks in each of a stack of cartesian slowness grids,
+    e.g. the power grids of every bootstrap sample, in one compiled call.
+
+    Parameters
+    ----------
+    Arrays : 3D numpy array of floats
+        Stack of power grids, shape [B,ny,nx].
+
+    xmin : float
+        Minumum x point of the grids.
+
+    xmax : float
+        Maximum x point of the grids.
+
+    ymin : float
+        Minumum y point of the grids.
+
+    ymax : float
+        Maximum y point of the grids.
+
+    xstep : float
+        Increments of points in the x axis.
+
+    ystep : float
+        Increments of points in the y axis.
+
+    N : int
+        The top N peaks will be returned.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them. Default is False.
+
+    Returns
+    -------
+    peaks : 3D numpy array of floats
+        The top N peaks of each grid in the format [[[x,y]]], shape [B,N,2].
+        Padded with nan where a grid has fewer than N peaks.
+
+    power_vals : 2D numpy array of floats
+        The power of the respective peaks, shape [B,N], padded with nan.
+    """
+
+    Arrays = np.asarray(Arrays)
+    rows, cols, powers, n_found = peak_indices_3D(Arrays, int(N))
+
+    if interpolate:
+        row_offsets, col_offsets = peak_offsets_3D(Arrays, rows, cols)
+    else:
+        row_offsets, col_offsets = 0, 0
+
+    found = rows >= 0
+
+    peaks = np.full((rows.shape[0], rows.shape[1], 2), np.nan)
+    peaks[:, :, 0] = np.where(found, xmin + ((cols + col_offsets) * xstep), np.nan)
+    peaks[:, :, 1] = np.where(found, ymin + ((rows + row_offsets) * ystep), np.nan)
+    power_vals = np.where(found, powers, np.nan)
+
+    return peaks, power_vals
+
+
+def findpeaks_Pol_batch(Arrays, smin, smax, bmin, bmax, sstep, bstep, N=10, interpolate=False):
+    """
+    Finds the top N peaks in each of a stack of polar slowness grids in
+    one compiled call.
+
+    Parameters
+    ----------
+    Arrays : 3D numpy array of floats
+        Stack of power grids, shape [B,ns,nb].
+
+    smin : float
+        Minumum horizontal slowness.
+
+    smax : float
+        Maximum horizontal slowness.
+
+    bmin : float
+        Minumum backazimuth.
+
+    bmax : float
+        Maximum backazimuth.
+
+    sstep : float
+        Increments of slowness values.
+
+    bstep : float
+        Increments of backazimuth values.
+
+    N : int
+        The top N peaks will be returned.
+
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them. Default is False.
+
+    Returns
+    -------
+    peaks : 3D numpy array of floats
+        The top N peaks of each grid in the form of [baz,slow], shape
+        [B,N,2]. Padded with nan where a grid has fewer than N peaks.
+
+    power_vals : 2D numpy array of floats
+        The power of the respective peaks, shape [B,N], padded with nan.
+    """
+
+    Arrays = np.asarray(Arrays)
+    rows, cols, powers, n_found = peak_indices_3D(Arrays, int(N))
+
+    if interpolate:
+        row_offsets, col_offsets = peak_offsets_3D(Arrays, rows, cols)
+    else:
+        row_offsets, col_offsets = 0, 0
+
+    found = rows >= 0
+
+    peaks = np.full((rows.shape[0], rows.shape[1], 2), np.nan)
+    peaks[:, :, 0] = np.where(found, bmin + ((cols + col_offsets) * bstep), np.nan)
+    peaks[:, :, 1] = np.where(found, smin + ((rows + row_offsets) * sstep), np.nan)
+    power_vals = np.where(found, powers, np.nan)
+
+    return peaks, power_vals
+
+
+def findpeaks_XY(Array, xmin, xmax, ymin, ymax, xstep, ystep, N=10, interpolate=False):
     """
     Peak finding algorith for a 2D array of values. The peaks will be searched for
     within a range of points from a predicted arrival. Edited from stack overflow
@@ -32,6 +291,10 @@ def findpeaks_XY(Array, xmin, xmax, ymin, ymax, xstep, ystep, N=10):
     N : int
         The top N peaks will be returned.
 
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them. Default is False.
+
     Returns
     -------
     peaks : 2D array of floats
@@ -42,63 +305,20 @@ def findpeaks_XY(Array, xmin, xmax, ymin, ymax, xstep, ystep, N=10):
         The power of the respective peak in the peaks arrays.
     """
 
-    # define space
-    steps_x = int(np.round((xmax - xmin) / xstep, decimals=0)) + 1
-    steps_y = int(np.round((ymax - ymin) / ystep, decimals=0)) + 1
-    xpoints = np.linspace(xmin, xmax, steps_x, endpoint=True)
-    ypoints = np.linspace(ymin, ymax, steps_y, endpoint=True)
-
-    neighborhood = generate_binary_structure(2, 3)
-
-    # maximum filter will take the array 'Array'
-    # For each point it will take the adjacent grid points and find the highest ones
-    # In other words, it will find the local maxima.
-    # local_max = maximum_filter(Array, 3)
-    local_max = maximum_filter(Array, footprint=neighborhood, mode='nearest') == Array
-    # local_min = minimum_filter(Array_New, 3)
-
-    background = Array == 0
-
-    eroded_background = binary_erosion(
-        background, structure=neighborhood, border_value=1
+    # local maxima test and top N selection are done
+    # in the compiled batch peak finder
+    peaks, powers = findpeaks_XY_batch(
+        Array[np.newaxis], xmin, xmax, ymin, ymax, xstep, ystep, N=N, interpolate=interpolate
     )
-    # OK I'll try and find the gradient at each point then take the lowest values.
-
-    detected_peaks = local_max ^ eroded_background
-
-    y_peak, x_peak = np.where(detected_peaks == 1)
-
-    # get top N values
-    val_points = np.array([Array[y_peak, x_peak], y_peak, x_peak]).T
+    found = ~np.isnan(powers[0])
 
-    val_points_sorted = np.copy(val_points)
-
-    # sort arguments based on the first column
-    # Just like Python, in that [::-1] reverses the array returned by argsort()
-    #  [:N] gives the first N elements of the reversed list
-    val_points_sorted = val_points_sorted[val_points_sorted[:, 0].argsort()][::-1][:N]
-
-    # get x and y locations of top N points
-    val_x_points_sorted = val_points_sorted[:, 2]
-    val_y_points_sorted = val_points_sorted[:, 1]
-
-    # get power values of top N points
-    val_points_power = val_points_sorted[:, 0]
-
-    # find this location in slowness space
-    x_peaks_space = xmin + (x_peak * xstep)
-    y_peaks_space = ymin + (y_peak * ystep)
-
-    x_vals_peaks_space = xmin + (val_x_points_sorted * xstep)
-    y_vals_peaks_space = ymin + (val_y_points_sorted * ystep)
-
-    peaks_combined = np.array((x_peaks_space, y_peaks_space)).T
-    peaks_combined_vals = np.array((x_vals_peaks_space, y_vals_peaks_space)).T
+    peaks_combined_vals = peaks[0][found]
+    val_points_power = powers[0][found]
 
     return peaks_combined_vals, val_points_power
 
 
-def findpeaks_Pol(Array, smin, smax, bmin, bmax, sstep, bstep, N=10):
+def findpeaks_Pol(Array, smin, smax, bmin, bmax, sstep, bstep, N=10, interpolate=False):
     """
     Peak finding algorith for a 2D array of values. The peaks will be searched for
     within a range of points from a predicted arrival. This is edited for the polar
@@ -130,66 +350,24 @@ def findpeaks_Pol(Array, smin, smax, bmin, bmax, sstep, bstep, N=10):
     N : int
         The top N peaks will be returned.
 
+    interpolate : bool
+        If True, the peaks are refined between the grid points by fitting
+        a quadratic to the 3x3 points around them. Default is False.
+
     Returns
     -------
     peaks : 2D array of floats
         The top N peaks of the array in the form of [baz,slow].
     """
 
-    # define space
-    steps_s = int(np.round((smax - smin) / sstep, decimals=0)) + 1
-    steps_b = int(np.round((bmax - bmin) / bstep, decimals=0)) + 1
-
-    spoints = np.linspace(smin, smax, steps_s, endpoint=True)
-    bpoints = np.linspace(bmin, bmax, steps_b, endpoint=True)
-
-    spoints = spoints
-    bpoints = bpoints
-
-    neighborhood = generate_binary_structure(2, 3)
-
-    # maximum filter will take the array 'Array'
-    # For each point it will take the adjacent grid points and find the highest ones
-    # In other words, it will find the local maxima.
-    local_max = maximum_filter(Array, footprint=neighborhood, mode='nearest') == Array
-
-    background = Array == 0
-
-    eroded_background = binary_erosion(
-        background, structure=neighborhood, border_value=1
+    # local maxima test and top N selection are done
+    # in the compiled batch peak finder
+    peaks, powers = findpeaks_Pol_batch(
+        Array[np.newaxis], smin, smax, bmin, bmax, sstep, bstep, N=N, interpolate=interpolate
     )
-    # OK I'll try and find the gradient at each point then take the lowest values.
-
-    detected_peaks = local_max ^ eroded_background
-
-    s_peak, b_peak = np.where(detected_peaks == 1)
-
-    # get top N values
-    val_points = np.array([Array[s_peak, b_peak], s_peak, b_peak]).T
-
-    val_points_sorted = np.copy(val_points)
-
-    # sort arguments based on the first column
-    # Just like Python, in that [::-1] reverses the array returned by argsort()
-    #  [:N] gives the first N elements of the reversed list
-    val_points_sorted = val_points_sorted[val_points_sorted[:, 0].argsort()][::-1][:N]
-    val_b_points_sorted = val_points_sorted[:, 2]
-    val_s_points_sorted = val_points_sorted[:, 1]
-
-    # get power values of top N points
-    val_points_power = val_points_sorted[:, 0]
-
-    # this gives all the peaks in the array.
-    b_peaks_space = bmin + (b_peak * bstep)
-    s_peaks_space = smin + (s_peak * sstep)
-
-    # get locations in the array
-    b_vals_peaks_space = bmin + (val_b_points_sorted * bstep)
-    s_vals_peaks_space = smin + (val_s_points_sorted * sstep)
-
-    b_peaks_baz_vals = b_vals_peaks_space
-    s_peaks_baz_vals = s_vals_peaks_space
+    found = ~np.isnan(powers[0])
 
-    peaks_combined_vals = np.array((b_peaks_baz_vals, s_peaks_baz_vals)).T
+    peaks_combined_vals = peaks[0][found]
+    val_points_power = powers[0][found]
 
     return peaks_combined_vals, val_points_power
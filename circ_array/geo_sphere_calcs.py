@@ -1,7 +1,7 @@
 from numba import jit
 import numpy as np
-from obspy.taup import TauPyModel
-import os
+from travel_time_tables import get_model, get_travel_time_table
+from functools import lru_cache
 
 @jit(nopython=True, fastmath=True)
 def coords_lonlat_rad_bearing(lat1, lon1, dist_deg, brng):
@@ -151,100 +151,415 @@ def deg_km_az_baz(lat1, lon1, lat2, lon2):
     return dist_deg, dist_km, az, baz
 
 
-def relocate_event_baz_slow(evla, evlo, evdp, stla, stlo, baz, slow, phase, mod='prem'):
+def deg_km_az_baz_array(lat1, lon1, lat2, lon2):
+    """
+    Array version of deg_km_az_baz. The inputs broadcast against each other
+    so e.g. every event in a catalogue can be given against every station
+    with lat1[:, np.newaxis] and lat2[np.newaxis, :].
+
+    Parameters
+    ----------
+    lat(1/2) : float or array of floats
+        Latitudes of points (1/2)
+
+    lon(1/2) : float or array of floats
+        Longitudes of points (1/2)
+
+    Returns
+    -------
+    dist_deg : numpy array of floats
+        Distances between points in degrees.
+    dist_km : numpy array of floats
+        Distances between points in km.
+    az : numpy array of floats
+        Azimuths at location 1 pointing to point 2.
+    baz : numpy array of floats
+        Backzimuths at location 2 pointing to point 1.
+    """
+
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2)]
+
+    # haversine formula for the distance in degrees and km
+    R = 6371
+    a = (np.sin((lat2 - lat1) / 2)) ** 2 + np.cos(lat1) * np.cos(lat2) * (
+        np.sin((lon2 - lon1) / 2)
+    ) ** 2
+    dist_deg = np.degrees(2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
+    dist_km = np.radians(dist_deg) * R
+
+    az = np.degrees(
+        np.arctan2(
+            np.sin(lon2 - lon1) * np.cos(lat2),
+            np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1),
+        )
+    )
+
+    baz = np.degrees(
+        np.arctan2(
+            np.sin(lon1 - lon2) * np.cos(lat1),
+            np.cos(lat2) * np.sin(lat1) - np.sin(lat2) * np.cos(lat1) * np.cos(lon1 - lon2),
+        )
+    )
+    baz = np.where(baz < 0, (baz + 360) % 360, baz)
+
+    return dist_deg, dist_km, az, baz
+
+
+def coords_lonlat_rad_bearing_array(lat1, lon1, dist_deg, brng):
+    """
+    Array version of coords_lonlat_rad_bearing. The inputs broadcast against
+    each other so e.g. the points along many bearings at many distances from
+    one location can be found with brng[:, np.newaxis] and
+    dist_deg[np.newaxis, :].
+
+    Parameters
+    ----------
+    lat1 : float or array of floats
+        Starting point latitiudes.
+
+    lon1 : float or array of floats
+        Starting point longitudes.
+
+    dist_deg : float or array of floats
+        Distances from starting points in degrees.
+
+    brng : float or array of floats
+        Angles from north describing the direction where the new coordinates are located.
+
+    Returns
+    -------
+    lat2 : numpy array of floats
+        Latitudes of the new cordinates.
+    lon2 : numpy array of floats
+        Longitudes of the new cordinates.
+    """
+
+    brng = np.radians(np.asarray(brng, dtype=float))
+    d = np.radians(np.asarray(dist_deg, dtype=float))
+    lat1 = np.radians(np.asarray(lat1, dtype=float))
+    lon1 = np.radians(np.asarray(lon1, dtype=float))
+
+    lat2 = np.arcsin(
+        (np.sin(lat1) * np.cos(d)) + (np.cos(lat1) * np.sin(d) * np.cos(brng))
+    )
+    lon2 = lon1 + np.arctan2(
+        np.sin(brng) * np.sin(d) * np.cos(lat1), np.cos(d) - np.sin(lat1) * np.sin(lat2)
+    )
+
+    lat2 = np.degrees(lat2)
+    lon2 = np.degrees(lon2)
+
+    lon2 = np.where(lon2 > 180, lon2 - 360, lon2)
+    lon2 = np.where(lon2 < -180, lon2 + 360, lon2)
+
+    return lat2, lon2
+
+
+def geo_km_array(orig_lon, orig_lat, lon, lat):
+    """
+    Projects points to x (east) and y (north) distances in km from an origin
+    with an azimuthal equidistant projection on a spherical Earth, so the
+    distance from the origin and the azimuth are the same as from
+    deg_km_az_baz_array. The inputs broadcast against each other.
+
+    Parameters
+    ----------
+    orig_lon : float or array of floats
+        Longitudes of the origins.
+
+    orig_lat : float or array of floats
+        Latitudes of the origins.
+
+    lon : float or array of floats
+        Longitudes of the points.
+
+    lat : float or array of floats
+        Latitudes of the points.
+
+    Returns
+    -------
+    x : numpy array of floats
+        Distance east of the origin in km.
+    y : numpy array of floats
+        Distance north of the origin in km.
+    """
+
+    dist_deg, dist_km, az, baz = deg_km_az_baz_array(orig_lat, orig_lon, lat, lon)
+
+    x = dist_km * np.sin(np.radians(az))
+    y = dist_km * np.cos(np.radians(az))
+
+    return x, y
+
+
+def relocate_event_baz_slow(
+    evla, evlo, evdp, stla, stlo, baz, slow, phase, mod='prem', search_range=30
+):
     """
     Given event location, mean station location and slowness vector
     (baz and slow), relocate the event so the ray arrives with the
     slowness and backazimuth.
 
+    The distance is found by inverting the ray parameter against distance
+    curve of the phase from its travel time table (see travel_time_tables).
+    Each branch of the phase is followed along distance on its own, as the
+    ray parameter only changes smoothly along a branch, and searched for
+    distances where it crosses the observed slowness. The crossing closest
+    to the catalogue distance is used. Major arc branches are not used. If
+    no branch reaches the observed slowness within the search range, the
+    distance where one comes closest is used instead.
+
+    Any of the inputs can be arrays to relocate many observations at once,
+    e.g. every cluster of an event.
+
     Paramters
     ---------
-    evla : float
+    evla : float or array of floats
         Event latitude.
-    evlo : float
+    evlo : float or array of floats
         Event longitude.
-    evdp : float
+    evdp : float or array of floats
         Event depth.
-    stla : float
+    stla : float or array of floats
         Station latitude.
-    stlo : float
+    stlo : float or array of floats
         Station longitude.
-    baz : float
+    baz : float or array of floats
         Backazimuth of slowness vector.
-    slow : float
+    slow : float or array of floats
         Horizontal slowness of slowness vector.
     phase : string
         Target phase (e.g. SKS).
     mod : string
         1D velocity model to use (default is PREM).
+    search_range : float
+        Only distances within this many degrees of the catalogue distance
+        are searched. Default is 30.
 
     Returns
     -------
-    new_evla : float
+    new_evla : float or array of floats
         Relocated event latitude.
-    new_evlo : float
+    new_evlo : float or array of floats
         Relocated event longitude.
     """
 
-    model = TauPyModel(model=mod)
+    evla, evlo, evdp, stla, stlo, baz, slow = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in (evla, evlo, evdp, stla, stlo, baz, slow)]
+    )
+    shape = evla.shape
+    evla, evlo, evdp, stla, stlo, baz, slow = [
+        x.ravel() for x in (evla, evlo, evdp, stla, stlo, baz, slow)
+    ]
+
+    table = get_travel_time_table(phase, mod)
+    distances = table.distances
+
+    dist_deg, dist_km, az, baz_event = deg_km_az_baz_array(lat1=evla, lon1=evlo, lat2=stla, lon2=stlo)
+
+    # ray parameter of each branch along the distances of the table, only
+    # needs interpolating once for each event depth. The branches are kept
+    # in their own columns so a crossing is never found between two of them.
+    depths, depth_index = np.unique(evdp, return_inverse=True)
+    ray_params = np.zeros((depths.shape[0], distances.shape[0], table.table.shape[-1]))
+    minor_arc = np.zeros(ray_params.shape, dtype=bool)
+    for i, depth in enumerate(depths):
+        times, ray_params[i], major = table.arrivals(
+            np.full(distances.shape, depth), distances, by_branch=True
+        )
+        minor_arc[i] = ~major
+
+    # [observation, distance, branch]
+    diff_slows = ray_params[depth_index.reshape(-1)] - slow[:, np.newaxis, np.newaxis]
+    usable = (
+        minor_arc[depth_index.reshape(-1)]
+        & ~np.isnan(diff_slows)
+        & (np.abs(distances - dist_deg[:, np.newaxis]) <= search_range)[:, :, np.newaxis]
+    )
+
+    # bracket the crossings of the observed slowness between distances
+    # then find where the straight line between them crosses
+    before = diff_slows[:, :-1]
+    after = diff_slows[:, 1:]
+    brackets = (
+        usable[:, :-1]
+        & usable[:, 1:]
+        & (np.sign(before) != np.sign(after))
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(before == after, 0, before / (before - after))
+    step = np.diff(distances)[np.newaxis, :, np.newaxis]
+    roots = np.where(brackets, distances[np.newaxis, :-1, np.newaxis] + (fraction * step), np.nan)
+    roots = roots.reshape(roots.shape[0], -1)
+
+    found = ~np.all(np.isnan(roots), axis=1)
+    closest = np.argmin(
+        np.where(np.isnan(roots), np.inf, np.abs(roots - dist_deg[:, np.newaxis])),
+        axis=1,
+    )
+    distance_at_slowness = roots[np.arange(roots.shape[0]), closest]
+
+    # no crossing, use the distance with the smallest slowness difference
+    residuals = np.where(usable, np.abs(diff_slows), np.inf)
+    residuals = residuals.reshape(residuals.shape[0], -1)
+    nearest = distances[np.argmin(residuals, axis=1) // diff_slows.shape[-1]]
+    nearest = np.where(np.any(usable, axis=(1, 2)), nearest, np.nan)
+    distance_at_slowness = np.where(found, distance_at_slowness, nearest)
 
-    dist_deg = haversine_deg(lat1=evla, lon1=evlo, lat2=stla, lon2=stlo)
+    new_evla, new_evlo = coords_lonlat_rad_bearing_array(lat1 = stla,
+                                                         lon1 = stlo,
+                                                         dist_deg = distance_at_slowness,
+                                                         brng = baz)
 
-    # define distances to search over
-    dist_min=dist_deg-30
-    dist_max=dist_deg+30
-    dist_search = np.linspace(dist_min, dist_max, 1000)
+    if len(shape) == 0:
+        return new_evla[0], new_evlo[0]
 
-    # set count so it know if it has found a suitable distance
-    count=0
-    diff_slows = np.ones(dist_search.shape)
-    # if the difference just keeps increasing
-    # stop after 20 increases
-    early_stop_count = 0
-    for i,test_distance in enumerate(dist_search):
+    return new_evla.reshape(shape), new_evlo.reshape(shape)
 
-        try:
-             ## work out slowness and compare to the observed slowness
-            tap_out_test = model.get_travel_times(source_depth_in_km=float(evdp),
-                                                  distance_in_degree=float(test_distance),
-                                                  receiver_depth_in_km=0.0,
-                                                  phase_list=[phase])
 
-            abs_slow_test = tap_out_test[0].ray_param_sec_degree
-            diff_slow = abs(abs_slow_test - slow)
+@lru_cache(maxsize=4096)
+def pierce_distances(evdp, dist_deg, phase, target_depths, mod='prem'):
+    """
+    Distances from the event where the first arrival of a phase crosses each
+    target depth, on the way down (source side) and on the way up (receiver
+    side). The ray paths are calculated in this process with the cached model
+    and the results are kept so repeated event/array pairs are only traced once.
+
+    Parameters
+    ----------
+    evdp : float
+        Event depth.
+    dist_deg : float
+        Epicentral distance in degrees.
+    phase : string
+        Target phase.
+    target_depths : tuple of floats
+        Depths to calculate pierce points at.
+    mod : string
+        1D velocity model to use (default is PREM).
+
+    Returns
+    -------
+    distances : 2D numpy array of floats
+        Shape [ndepth, 2] of the source and receiver side pierce distances
+        in degrees. If the ray only crosses a depth once, both are that
+        crossing. Nan if the phase does not arrive or never reaches the depth.
+    """
 
-            ## work out slowness and compare to the observed slowness
-            diff_slows[i] = diff_slow
+    model = get_model(mod)
 
-            if diff_slow > diff_slows[i-1]:
-                early_stop_count +=1
-            else:
-                early_stop_count = 0
+    distances = np.full((len(target_depths), 2), np.nan)
 
-            if early_stop_count > 20:
-                print('increasing risidual for more than 20 iterations, breaking loop')
-                break
+    arrivals = model.get_pierce_points(
+        source_depth_in_km=float(evdp),
+        distance_in_degree=float(dist_deg),
+        phase_list=[phase],
+        add_depth=list(target_depths),
+    )
 
+    if len(arrivals) != 0:
+        pierce = arrivals[0].pierce
+        for i, target_depth in enumerate(target_depths):
+            crossings = np.degrees(pierce['dist'][np.isclose(pierce['depth'], target_depth)])
+            if crossings.shape[0] != 0:
+                distances[i] = crossings[0], crossings[-1]
 
-        except:
-            pass
+    distances.setflags(write=False)
 
-    min = np.amin(np.array(diff_slows))
-    loc = np.where(np.array(diff_slows) == min)[0][0]
-    distance_at_slowness = dist_search[loc]
+    return distances
 
-    new_evla, new_evlo = coords_lonlat_rad_bearing(lat1 = stla,
-                                                   lon1 = stlo,
-                                                   dist_deg = distance_at_slowness,
-                                                   brng = baz)
 
-    return new_evla, new_evlo
+def pierce_points(evla, evlo, evdp, stla, stlo, phase, target_depths, mod='prem'):
+    """
+    Given station and event locations, return the source and receiver side
+    pierce points of the first arrival of a phase at one or more depths.
+
+    Everything is calculated in this process and nothing is written to
+    disk, so it can be called from several worker processes at once.
+    The inputs can be arrays to get the pierce points of many
+    event/station pairs in one call.
+
+    Parameters
+    ----------
+    evla : float or array of floats
+        Event latitude.
+    evlo : float or array of floats
+        Event longitude.
+    evdp : float or array of floats
+        Event depth.
+    stla : float or array of floats
+        Station latitude.
+    stlo : float or array of floats
+        Station longitude.
+    phase : string
+        Target phase
+    target_depths : float or list of floats
+        Depths to calculate pierce points.
+    mod : string
+        1D velocity model to use (default is PREM).
+
+    Returns
+    -------
+    s_pierce_la : numpy array of floats
+        Source pierce point latitudes.
+    s_pierce_lo : numpy array of floats
+        Source pierce point longitudes.
+    r_pierce_la : numpy array of floats
+        Receiver pierce point latitudes.
+    r_pierce_lo : numpy array of floats
+        Receiver pierce point longitudes.
+
+    The arrays have the broadcast shape of the event/station inputs, with an
+    extra last axis for the depths if a list of depths is given. They are nan
+    where the phase does not arrive or does not reach the depth.
+    """
+
+    evla, evlo, evdp, stla, stlo = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in (evla, evlo, evdp, stla, stlo)]
+    )
+    shape = evla.shape
+    evla, evlo, evdp, stla, stlo = [x.ravel() for x in (evla, evlo, evdp, stla, stlo)]
+
+    depths = tuple(float(d) for d in np.atleast_1d(target_depths))
+
+    dist_deg, dist_km, az, baz = deg_km_az_baz_array(lat1=evla, lon1=evlo, lat2=stla, lon2=stlo)
+
+    # [pair, depth, source/receiver side]
+    distances = np.array(
+        [
+            pierce_distances(float(evdp[i]), float(dist_deg[i]), phase, depths, mod)
+            for i in range(evla.shape[0])
+        ]
+    ).reshape(evla.shape[0], len(depths), 2)
+
+    pierce_la, pierce_lo = coords_lonlat_rad_bearing_array(
+        lat1=evla[:, np.newaxis, np.newaxis],
+        lon1=evlo[:, np.newaxis, np.newaxis],
+        dist_deg=distances,
+        brng=az[:, np.newaxis, np.newaxis],
+    )
+
+    pierces = np.array(
+        [pierce_la[:, :, 0], pierce_lo[:, :, 0], pierce_la[:, :, 1], pierce_lo[:, :, 1]]
+    )
+
+    if np.ndim(target_depths) == 0:
+        pierces = pierces[:, :, 0].reshape((4,) + shape)
+    else:
+        pierces = pierces.reshape((4,) + shape + (len(depths),))
+
+    s_pierce_la, s_pierce_lo, r_pierce_la, r_pierce_lo = pierces
+
+    return s_pierce_la, s_pierce_lo, r_pierce_la, r_pierce_lo
 
 
 def predict_pierce_points(evla, evlo, evdp, stla, stlo, phase, target_depth, mod='prem'):
     """
     Given station and event locations, return the pierce points at a particular
-    depth for source or receiver side locations.
+    depth for source or receiver side locations. The values are strings with
+    two decimal places ready to be written to the plotting files, use
+    pierce_points for many pairs at once or to get the numbers.
 
     Parameters
     ----------
@@ -267,59 +582,24 @@ def predict_pierce_points(evla, evlo, evdp, stla, stlo, phase, target_depth, mod
 
     Returns
     -------
-    r_pierce_la : float
-        Receiver pierce point latitude.
-    r_pierce_lo : float
-        Receiver pierce point longitude.
-
-    s_pierce_la : float
+    s_pierce_la : string
         Source pierce point latitude.
-    s_pierce_lo : float
+    s_pierce_lo : string
         Source pierce point longitude.
-    """
-
-    # I dont like the obspy taup pierce thing so will use
-    # the java script through python.
-    # This will assume you have taup installed:
-    # https://github.com/crotwell/TauP/
-
-    # print(f"taup_pierce -mod {mod} -h {evdp} -sta {stla} {stlo} -evt {evla} {evlo} -ph {phase} --pierce {target_depth} --nodiscon > ./temp.txt")
-    os.system(f"taup_pierce -mod {mod} -h {evdp} -sta {stla} {stlo} -evt {evla} {evlo} -ph {phase} --pierce {target_depth} --nodiscon > ./temp.txt")
 
-    # check number of lines
-    with open("./temp.txt", 'r') as temp_file:
-        lines_test = temp_file.readlines()
-        number_of_lines_test = len(lines_test)
-
-    with open("./temp.txt", 'r') as temp_file:
-        lines = temp_file.readlines()
-        number_of_lines = len(lines)
-
-        if number_of_lines == 2:
-            print(f"Only pierces depth {target_depth} once.")
-            print(f"Writing this one line to the file.")
-            source_line = lines[-1]
-            receiver_line = lines[-1]
+    r_pierce_la : string
+        Receiver pierce point latitude.
+    r_pierce_lo : string
+        Receiver pierce point longitude.
+    """
 
-        elif number_of_lines == 3:
-            source_line = lines[1]
-            receiver_line = lines[-1]
+    pierces = pierce_points(evla, evlo, evdp, stla, stlo, phase, target_depth, mod)
 
-        elif number_of_lines > 3:
-            print(f"Phase {phase} pierces depth {target_depth} more than twice.")
-            print(f"Writing pierce point closest to source/receiver")
-            source_line = lines[1]
-            receiver_line = lines[-1]
+    if np.isnan(pierces[0]):
+        print('Neither the phase nor ScS can predict this arrival, not continuing')
 
+    s_pierce_la, s_pierce_lo, r_pierce_la, r_pierce_lo = [
+        "nan" if np.isnan(x) else "%.2f" % x for x in pierces
+    ]
 
-    if number_of_lines != 0:
-        s_dist, s_pierce_depth, s_time, s_pierce_la, s_pierce_lo = source_line.split()
-        r_dist, r_pierce_depth, r_time, r_pierce_la, r_pierce_lo = receiver_line.split()
-    else:
-        print('Neither the phase nor ScS can predict this arrival, not continuing')
-        s_pierce_la = 'nan'
-        s_pierce_lo = 'nan'
-        r_pierce_la = 'nan'
-        r_pierce_lo = 'nan'
-    # os.remove("./temp.txt")
     return s_pierce_la, s_pierce_lo, r_pierce_la, r_pierce_lo
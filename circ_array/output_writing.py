@@ -3,7 +3,7 @@ from array_info import array
 import pandas as pd
 import numpy as np
 from slow_vec_calcs import calculate_locus
-from geo_sphere_calcs import predict_pierce_points
+from geo_sphere_calcs import pierce_points
 
 def write_to_file_check_lines(filepath, header, newlines, strings):
     """
@@ -208,6 +208,50 @@ def create_plotting_file(filepath,
 
     newlines.append(header)
     locus_newlines.append(locus_header)
+
+    # pierce points of the catalogue and relocated events for every line,
+    # one call for each phase
+    results_df = results_df.reset_index(drop=True)
+    pierces = np.full((len(results_df), 8), np.nan)
+    pierce_phases = results_df['phase'].astype(str).values.copy()
+
+    for phase in np.unique(pierce_phases):
+        rows = pierce_phases == phase
+        phase_df = results_df[rows]
+
+        pierces[rows, :4] = np.array(pierce_points(evla=phase_df['evla'].values,
+                                                   evlo=phase_df['evlo'].values,
+                                                   evdp=phase_df['evdp'].values,
+                                                   stla=phase_df['stla_mean'].values,
+                                                   stlo=phase_df['stlo_mean'].values,
+                                                   phase=phase,
+                                                   target_depths=depth,
+                                                   mod=mod)).T
+
+        pierces[rows, 4:] = np.array(pierce_points(evla=phase_df['reloc_evla'].values,
+                                                   evlo=phase_df['reloc_evlo'].values,
+                                                   evdp=phase_df['evdp'].values,
+                                                   stla=phase_df['stla_mean'].values,
+                                                   stlo=phase_df['stlo_mean'].values,
+                                                   phase=phase,
+                                                   target_depths=depth,
+                                                   mod=mod)).T
+
+    # if the phase doesnt have a predicted arrival for the relocated
+    # event, use ScS instead
+    no_arrival = np.isnan(pierces[:, 4])
+    if np.any(no_arrival):
+        scs_df = results_df[no_arrival]
+        pierces[no_arrival, 4:] = np.array(pierce_points(evla=scs_df['reloc_evla'].values,
+                                                         evlo=scs_df['reloc_evlo'].values,
+                                                         evdp=scs_df['evdp'].values,
+                                                         stla=scs_df['stla_mean'].values,
+                                                         stlo=scs_df['stlo_mean'].values,
+                                                         phase="ScS",
+                                                         target_depths=depth,
+                                                         mod=mod)).T
+        pierce_phases[no_arrival] = "ScS"
+
     for index, row in results_df.iterrows():
         print(row)
         try:
@@ -232,74 +276,26 @@ def create_plotting_file(filepath,
         multi = row['multi']
 
 
-        s_pierce_la, s_pierce_lo, r_pierce_la, r_pierce_lo = predict_pierce_points(evla=evla,
-                                                                                   evlo=evlo,
-                                                                                   evdp=evdp,
-                                                                                   stla=stla_mean,
-                                                                                   stlo=stlo_mean,
-                                                                                   phase=phase,
-                                                                                   target_depth=depth,
-                                                                                   mod=mod)
-
-
-        # relocate event to match baz and slow
-        # reloc_evla, reloc_evlo = relocate_event_baz_slow(evla=evla,
-        #                                                 evlo=evlo,
-        #                                                 evdp=evdp,
-        #                                                 stla=stla_mean,
-        #                                                 stlo=stlo_mean,
-        #                                                 baz=baz,
-        #                                                 slow=slow,
-        #                                                 phase=phase,
-        #                                                 mod=mod)
-
-
-        try:
-            s_reloc_pierce_la, s_reloc_pierce_lo, r_reloc_pierce_la, r_reloc_pierce_lo = predict_pierce_points(evla=reloc_evla,
-                                                                                                               evlo=reloc_evlo,
-                                                                                                               evdp=evdp,
-                                                                                                               stla=stla_mean,
-                                                                                                               stlo=stlo_mean,
-                                                                                                               phase=phase,
-                                                                                                               target_depth=depth,
-                                                                                                               mod=mod)
-
-            # newline = list(row[["Name", "evla", "evlo", "evdp", "stla_mean", "stlo_mean", "slow_pred", "slow_diff", "slow_std_dev",
-            #                "baz_pred", "baz_diff", "baz_std_dev", "del_x_slow", "del_y_slow", "mag", "az", "error_ellipse_area", "multi",
-            #                "phase"]].astype(str))
-
-            newline = list(row[["Name", "evla", "evlo", "evdp", "stla_mean", "stlo_mean", "slow_pred", "slow_diff",
-                           "baz_pred", "baz_diff", "del_x_slow", "del_y_slow", "mag", "az", "multi",
-                           "phase"]].astype(str))
-
-
-            for new_item in [s_pierce_la, s_pierce_lo, r_pierce_la, r_pierce_lo, s_reloc_pierce_la, s_reloc_pierce_lo, r_reloc_pierce_la, r_reloc_pierce_lo]:
-                newline.append(new_item)
-
-            newlines.append(' '.join(newline) + "\n")
-
-        except:
-            # print(f"{phase} doesnt have a predicted arrival, using ScS instead")
-            s_reloc_pierce_la, s_reloc_pierce_lo, r_reloc_pierce_la, r_reloc_pierce_lo = predict_pierce_points(evla=reloc_evla,
-                                                                                                               evlo=reloc_evlo,
-                                                                                                               evdp=evdp,
-                                                                                                               stla=stla_mean,
-                                                                                                               stlo=stlo_mean,
-                                                                                                               phase="ScS",
-                                                                                                               target_depth=depth,
-                                                                                                               mod=mod)
-
-            # newline = list(row[["Name", "evla", "evlo", "evdp", "stla_mean", "stlo_mean", "slow_pred", "slow_diff", "slow_std_dev",
-            #                "baz_pred", "baz_diff", "baz_std_dev", "del_x_slow", "del_y_slow", "mag", "az", "error_ellipse_area", "multi"]].astype(str))
+        newline = list(row[["Name", "evla", "evlo", "evdp", "stla_mean", "stlo_mean", "slow_pred", "slow_diff",
+                       "baz_pred", "baz_diff", "del_x_slow", "del_y_slow", "mag", "az", "multi"]].astype(str))
 
-            newline = list(row[["Name", "evla", "evlo", "evdp", "stla_mean", "stlo_mean", "slow_pred", "slow_diff",
-                           "baz_pred", "baz_diff", "del_x_slow", "del_y_slow", "mag", "az", "multi"]].astype(str))
+        newline.append(pierce_phases[index])
 
+        pierce_strings = ["nan" if np.isnan(x) else "%.2f" % x for x in pierces[index]]
+        (
+            s_pierce_la,
+            s_pierce_lo,
+            r_pierce_la,
+            r_pierce_lo,
+            s_reloc_pierce_la,
+            s_reloc_pierce_lo,
+            r_reloc_pierce_la,
+            r_reloc_pierce_lo,
+        ) = pierce_strings
 
-            for new_item in ['ScS', s_pierce_la, s_pierce_lo, r_pierce_la, r_pierce_lo, s_reloc_pierce_la, s_reloc_pierce_lo, r_reloc_pierce_la, r_reloc_pierce_lo]:
-                newline.append(new_item)
+        newline.extend(pierce_strings)
 
-            newlines.append(' '.join(newline) + "\n")
+        newlines.append(' '.join(newline) + "\n")
 
         if locus == True:
             if dir and name not in locus_newlines:
@@ -0,0 +1,51 @@
+import numba
+
+
+def set_threads(threads=None):
+    """
+    Sets the number of threads the beamforming, vespagram and array
+    response functions spread their grid points over. The grid loops
+    are compiled with numba's parallel mode so this can be changed
+    between calls without recompiling.
+
+    Parameters
+    ----------
+    threads : int
+        Number of threads to use. If None (default), all the threads numba
+        was started with are used (see the NUMBA_NUM_THREADS environment
+        variable). Use 1 to run the grid searches serially.
+
+    Returns
+    -------
+    previous : int
+        The number of threads that were being used before this call so it
+        can be restored afterwards.
+    """
+
+    previous = numba.get_num_threads()
+
+    if threads is None:
+        threads = numba.config.NUMBA_NUM_THREADS
+
+    threads = int(threads)
+    if threads < 1 or threads > numba.config.NUMBA_NUM_THREADS:
+        raise ValueError(
+            "threads must be between 1 and %s" % numba.config.NUMBA_NUM_THREADS
+        )
+
+    numba.set_num_threads(threads)
+
+    return previous
+
+
+def get_threads():
+    """
+    Returns the number of threads the grid searches will currently use.
+
+    Returns
+    -------
+    threads : int
+        Number of threads.
+    """
+
+    return numba.get_num_threads()
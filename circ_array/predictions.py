@@ -0,0 +1,137 @@
+import numpy as np
+from geo_sphere_calcs import deg_km_az_baz_array
+from travel_time_tables import get_travel_time_table
+
+# one row for each arrival of each phase at each event/array pair
+prediction_dtype = np.dtype(
+    [
+        ("event", np.int64),
+        ("phase", "U16"),
+        ("branch", np.int64),
+        ("ray_param", np.float64),
+        ("baz", np.float64),
+        ("slow_x_baz", np.float64),
+        ("slow_y_baz", np.float64),
+        ("slow_x_az", np.float64),
+        ("slow_y_az", np.float64),
+        ("distance", np.float64),
+        ("time", np.float64),
+        ("major", np.bool_),
+    ]
+)
+
+
+def round_slow(x, prec=2, base=0.05):
+    """
+    Rounds an array of slownesses to the nearest 'base' with precision 'prec',
+    the same as utilities.myround does for one number.
+    """
+
+    return np.round(base * np.round(np.asarray(x, dtype=float) / base), prec)
+
+
+def predict_baz_slow(evla, evlo, evdp, stla, stlo, phases, one_eighty=True, mod="prem"):
+    """
+    Predicts the baz and horizontal slownesses of the given phases for many
+    event and array centre locations at once. The travel times and ray
+    parameters are interpolated from the travel time tables (see
+    travel_time_tables) rather than calling TauP for each event.
+
+    Parameters
+    ----------
+    evla : float or array of floats
+        Event latitudes.
+
+    evlo : float or array of floats
+        Event longitudes.
+
+    evdp : float or array of floats
+        Event depths.
+
+    stla : float or array of floats
+        Latitudes of the array centres.
+
+    stlo : float or array of floats
+        Longitudes of the array centres.
+
+    phases : list of strings
+        Phases for which the baz and horizontal slowness will be calculated.
+
+    one_eighty : bool
+        If True (default), arrivals travelling along the major arc are named
+        "phase_Major" and given the backazimuth 180 degrees away. If False
+        they are given the same backazimuth as the other arrivals.
+
+    mod : string
+        1D velocity model to use (default is PREM).
+
+    Returns
+    -------
+    preds : structured numpy array
+        One row for each arrival with the fields of prediction_dtype:
+        the index of the event/array pair (event), the phase name, the
+        arrival number in order of travel time (branch), ray parameter
+        (s/deg), backazimuth, the rounded x and y slownesses along the
+        backazimuth and azimuth, the distance, travel time and whether
+        it travels along the major arc. Rows are ordered by event, then
+        phase in the order given, then travel time. Phases that do not
+        arrive at an event have no rows.
+    """
+
+    evla, evlo, evdp, stla, stlo = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in (evla, evlo, evdp, stla, stlo)]
+    )
+    evla, evlo, evdp, stla, stlo = [x.ravel() for x in (evla, evlo, evdp, stla, stlo)]
+
+    dists, dists_km, azs, bazs = deg_km_az_baz_array(lat1=evla, lon1=evlo, lat2=stla, lon2=stlo)
+
+    # The orientation of the wavefront at the stations is just
+    # 180 + baz:
+    azs_pred = bazs + 180
+
+    # baz for major arc phases will arrive with the opposite backazimuth.
+    other_bazs = np.where(bazs < 180, bazs + 180, bazs - 180)
+
+    phase_preds = []
+
+    for phase_number, phase in enumerate(phases):
+        table = get_travel_time_table(phase, mod)
+        times, ray_params, major = table.arrivals(evdp, dists)
+
+        events, branches = np.nonzero(~np.isnan(times))
+        arrival_major = major[events, branches]
+
+        preds = np.zeros(events.shape[0], dtype=prediction_dtype)
+        preds["event"] = events
+        preds["phase"] = phase
+        preds["branch"] = branches
+        preds["ray_param"] = ray_params[events, branches]
+        preds["distance"] = dists[events]
+        preds["time"] = times[events, branches]
+        preds["major"] = arrival_major
+
+        arrival_bazs = bazs[events]
+        arrival_azs = azs_pred[events]
+
+        if one_eighty:
+            # the azimuth should now be 180 from the predicted azimuth
+            # since we defined the azimith as 180 + baz, the 'other azimuth'
+            # is just the backazimuth.
+            arrival_azs = np.where(arrival_major, arrival_bazs, arrival_azs)
+            arrival_bazs = np.where(arrival_major, other_bazs[events], arrival_bazs)
+            preds["phase"] = np.where(arrival_major, "%s_Major" % phase, phase)
+
+        preds["baz"] = arrival_bazs
+        preds["slow_x_baz"] = round_slow(preds["ray_param"] * np.sin(np.radians(arrival_bazs)))
+        preds["slow_y_baz"] = round_slow(preds["ray_param"] * np.cos(np.radians(arrival_bazs)))
+        preds["slow_x_az"] = round_slow(preds["ray_param"] * np.sin(np.radians(arrival_azs)))
+        preds["slow_y_az"] = round_slow(preds["ray_param"] * np.cos(np.radians(arrival_azs)))
+
+        phase_preds.append((phase_number, preds))
+
+    preds = np.concatenate([p for n, p in phase_preds])
+    phase_numbers = np.concatenate([np.full(p.shape[0], n) for n, p in phase_preds])
+
+    order = np.lexsort((preds["branch"], phase_numbers, preds["event"]))
+
+    return preds[order]
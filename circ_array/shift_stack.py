@@ -1,6 +1,6 @@
 # /usr/bin/env python
 
-from numba import jit
+from numba import jit, prange
 import numpy as np
 from geo_sphere_calcs import coords_lonlat_rad_bearing, haversine_deg
 
@@ -54,14 +54,162 @@ def roll_2D(array, shifts):
     """
 
     n = array.shape[0]
-    array_new = np.copy(array)
+    array_new = np.zeros_like(array)
     for i in range(n):
-        array_new[int(i)] = roll_1D(array_new[int(i)],int(shifts[int(i)]))
+        shift_accumulate(array[int(i)], int(shifts[int(i)]), array_new[int(i)])
         # array_new[i] = np.roll(array[i],int(shifts[i]))
 
 
     return array_new
 
+
+@jit(nopython=True)
+def shift_accumulate(x, p, out):
+    """
+    Adds the time series x shifted by p points onto out without making a
+    shifted copy of x. The shift wraps around the end of the trace in the
+    same way as roll_1D, including leaving x unshifted when the shift is
+    longer than the trace.
+
+    Parameters
+    ----------
+    x : 1D array of floats
+        Time series to be shifted.
+
+    p : int
+        Points to shift the time series by.
+
+    out : 1D array of floats
+        Array the shifted time series is added to. Updated in place.
+
+    Returns
+    -------
+    Nothing
+    """
+
+    npts = x.shape[0]
+
+    # roll_1D does not shift at all if the shift is longer than the trace
+    if p >= npts or p <= -npts:
+        p = 0
+
+    if p >= 0:
+        for t in range(npts - p):
+            out[t + p] += x[t]
+        for t in range(p):
+            out[t] += x[npts - p + t]
+    else:
+        p = -p
+        for t in range(npts - p):
+            out[t] += x[t + p]
+        for t in range(p):
+            out[npts - p + t] += x[t]
+
+
+@jit(nopython=True)
+def shift_stack_2D(array, shifts, out):
+    """
+    Shifts the traces stored in a 2D array by the number of points in shifts
+    and takes the mean of them. The result is the same as stacking the output
+    of roll_2D, but the shifted traces are added directly onto out so no
+    shifted copy of the traces is made.
+
+    Parameters
+    ----------
+    array : 2D array of floats
+        Traces/time series to be shifted.
+
+    shifts : 1D array of floats
+        points to shift the respective time series by.
+
+    out : 1D array of floats
+        Array to store the stack in. Overwritten.
+
+    Returns
+    -------
+    out : 1D array of floats
+        The stacked/averaged time series.
+    """
+
+    n = array.shape[0]
+    out[:] = 0.0
+    for i in range(n):
+        shift_accumulate(array[int(i)], int(shifts[int(i)]), out)
+
+    out /= n
+
+    return out
+
+
+@jit(nopython=True)
+def shift_stack_phase_2D(array, phasors, shifts, lin_out, phase_out):
+    """
+    Shifts the traces and their unit phasors by the number of points in
+    shifts and stacks both in one pass over the samples. This gives the
+    linear stack and the phase coherence needed for a phase weighted
+    stack without making shifted copies of either array or calling exp
+    for every shift.
+
+    Parameters
+    ----------
+    array : 2D array of floats
+        Traces/time series to be shifted.
+
+    phasors : 2D array of complex
+        Unit phasors of the instantaneous phase of the traces
+        i.e. np.exp(phase_traces * 1j). Calculate these once and
+        reuse them for every set of shifts.
+
+    shifts : 1D array of floats
+        points to shift the respective time series by.
+
+    lin_out : 1D array of floats
+        Array to store the linear stack in. Overwritten.
+
+    phase_out : 1D array of floats
+        Array to store the phase coherence (absolute value of the mean
+        phasor) in. Overwritten.
+
+    Returns
+    -------
+    lin_out : 1D array of floats
+        The stacked/averaged time series.
+
+    phase_out : 1D array of floats
+        The phase coherence at each time point, between 0 and 1.
+    """
+
+    n = array.shape[0]
+    npts = array.shape[1]
+
+    lin_out[:] = 0.0
+    re_sum = np.zeros(npts)
+    im_sum = np.zeros(npts)
+
+    for i in range(n):
+        p = int(shifts[int(i)])
+
+        # roll_1D does not shift at all if the shift is longer than the trace
+        if p >= npts or p <= -npts:
+            p = 0
+        if p < 0:
+            p += npts
+
+        # sample t of the shifted trace is sample (t - p) mod npts
+        for t in range(npts):
+            k = t - p
+            if k < 0:
+                k += npts
+            lin_out[t] += array[i, k]
+            re_sum[t] += phasors[i, k].real
+            im_sum[t] += phasors[i, k].imag
+
+    for t in range(npts):
+        lin_out[t] /= n
+        phase_out[t] = np.sqrt(re_sum[t] ** 2 + im_sum[t] ** 2) / n
+
+    return lin_out, phase_out
+
 @jit(nopython=True)
 def my_sum(array):
     """
@@ -267,9 +415,7 @@ def calculate_time_shifts_elevation(
         print("not plane or circ")
 
     # Now need to add the effect of station elevation on times and shifts
-    # multiply the relative elevations by the cosine of the incidence
-    # of the phase and the 1-D velocity of PREM (approx 4.5).
-    elevation_times = (geometry[:,2] - np.mean(geometry[:,2])) * (np.cos(np.radians(incidence)) * 8)
+    elevation_times = calculate_elevation_times(geometry, incidence)
 
     times = times + elevation_times
     shifts = shifts + (elevation_times * -1)
@@ -277,12 +423,100 @@ def calculate_time_shifts_elevation(
     return shifts, times
 
 
+@jit(nopython=True, fastmath=True)
+def calculate_elevation_times(geometry, incidence):
+    """
+    Calculates the arrival time of a phase at each station relative to
+    the centre of the array due to the elevation differences of the stations.
 
+    Parameters
+    ----------
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    incidence : float
+        The incidence angle of the phase at the centre of the array.
+
+    Returns
+    -------
+    elevation_times : 1D numpy array of floats
+        The relative arrival time at each station from its elevation.
+    """
+
+    # multiply the relative elevations by the cosine of the incidence
+    # of the phase and the 1-D velocity of PREM (approx 4.5).
+    elevation_times = (geometry[:,2] - np.mean(geometry[:,2])) * (np.cos(np.radians(incidence)) * 8)
+
+    return elevation_times
 
 
 @jit(nopython=True, fastmath=True)
-def shift_traces(
-    traces,
+def calculate_relative_distances(
+    geometry, baz, distance, centre_x, centre_y, type="circ"
+):
+    """
+    Calculates the distance of each station relative to the centre of the
+    array along the direction of a wavefront arriving from a backazimuth.
+    The arrival time at each station relative to the centre is this distance
+    multiplied by the horizontal slowness, so for a fixed backazimuth it only
+    needs calculating once for all slownesses.
+
+    Parameters
+    ----------
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    baz : float
+        Backazimuth of the wavefront.
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    centre_x : float
+        Mean longitude.
+
+    centre_y : float
+        Mean latitude.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    Returns
+    -------
+    dists_rel : 1D numpy array of floats
+        The relative distance in degrees for each station. Multiply by the
+        slowness to get the times from calculate_time_shifts.
+    """
+
+    if type == "circ":
+
+        lat_new, lon_new = coords_lonlat_rad_bearing(
+            lat1=centre_y, lon1=centre_x, dist_deg=distance, brng=baz
+        )
+
+        dists = haversine_deg(lat1=lat_new, lon1=lon_new, lat2=geometry[:,1], lon2=geometry[:,0])
+
+        # get the relative distance
+        dists_rel = dists - distance
+
+    elif type == "plane":
+
+        dists_rel = -1 * (
+            ((geometry[:,0] - centre_x) * np.sin(np.radians(baz)))
+            + ((geometry[:,1] - centre_y) * np.cos(np.radians(baz)))
+        )
+
+    else:
+        print("not plane or circ")
+
+    return dists_rel
+
+
+
+
+
+@jit(nopython=True, fastmath=True)
+def calculate_point_shifts(
     geometry,
     abs_slow,
     baz,
@@ -295,25 +529,24 @@ def shift_traces(
     type="circ",
 ):
     """
-    Shifts the traces using the predicted arrival times for a given backazimuth and slowness.
+    Calculates the shift in data points needed to align each station
+    on a given backazimuth and slowness. These are the shifts applied
+    by shift_traces.
 
     Parameters
     ----------
-    traces : 2D numpy array of floats
-        A 2D numpy array containing the traces that the user wants to stack.
-
     geometry : 2D array of floats
         2D array describing the lon lat and elevation of the stations [lon,lat,depth]
 
-    distance : float
-        Epicentral distance from the event to the centre of the array.
-
     abs_slow : float
         Horizontal slowness you want to align traces over.
 
     baz : float
         Backazimuth you want to align traces over.
 
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
     centre_x : float
         Mean longitude.
 
@@ -337,10 +570,8 @@ def shift_traces(
 
     Returns
     -------
-        shifted_traces : 2D numpy array of floats
-            The input traces shifted by the predicted arrival time
-            of a curved wavefront arriving from a backazimuth and
-            slowness.
+    pts_shifts : 1D numpy array of floats
+        The number of points to shift each trace by.
     """
 
     if elevation == False:
@@ -367,6 +598,85 @@ def shift_traces(
 
     pts_shifts = shifts * sampling_rate
 
+    return pts_shifts
+
+
+@jit(nopython=True, fastmath=True)
+def shift_traces(
+    traces,
+    geometry,
+    abs_slow,
+    baz,
+    distance,
+    centre_x,
+    centre_y,
+    sampling_rate,
+    elevation=False,
+    incidence=90,
+    type="circ",
+):
+    """
+    Shifts the traces using the predicted arrival times for a given backazimuth and slowness.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        A 2D numpy array containing the traces that the user wants to stack.
+
+    geometry : 2D array of floats
+        2D array describing the lon lat and elevation of the stations [lon,lat,depth]
+
+    distance : float
+        Epicentral distance from the event to the centre of the array.
+
+    abs_slow : float
+        Horizontal slowness you want to align traces over.
+
+    baz : float
+        Backazimuth you want to align traces over.
+
+    centre_x : float
+        Mean longitude.
+
+    centre_y : float
+        Mean latitude.
+
+    sampling_rate : float
+        Sampling rate of the data points in s^-1.
+
+    elevation : bool
+        If True, elevation corrections will be added. If False, no elevation
+        corrections will be accounted for. Default is False.
+
+    incidence : float
+        Not used unless elevation is True. Give incidence angle from vertical
+        at the centre of the array to calculate elevation corrections.
+        Default is 90.
+
+    type : string
+        Will calculate either using a curved (circ) or plane (plane) wavefront.
+
+    Returns
+    -------
+        shifted_traces : 2D numpy array of floats
+            The input traces shifted by the predicted arrival time
+            of a curved wavefront arriving from a backazimuth and
+            slowness.
+    """
+
+    pts_shifts = calculate_point_shifts(
+        geometry=geometry,
+        abs_slow=abs_slow,
+        baz=baz,
+        distance=distance,
+        centre_x=centre_x,
+        centre_y=centre_y,
+        sampling_rate=sampling_rate,
+        elevation=elevation,
+        incidence=incidence,
+        type=type,
+    )
+
     shifted_traces = roll_2D(traces, pts_shifts)
 
 
@@ -417,13 +727,11 @@ def linear_stack_baz_slow(traces, sampling_rate, geometry, distance, slow, baz,
         and horizontal slowness before stacking
     """
 
-    ntrace = traces.shape[0]
     centre_x = np.mean(geometry[:, 0])
     centre_y = np.mean(geometry[:, 1])
 
-    # shift the traces according to the baz and slow
-    shifted_traces_lin = shift_traces(
-        traces=traces,
+    # get the point shifts for the baz and slow
+    pts_shifts = calculate_point_shifts(
         geometry=geometry,
         abs_slow=float(slow),
         baz=float(baz),
@@ -431,17 +739,71 @@ def linear_stack_baz_slow(traces, sampling_rate, geometry, distance, slow, baz,
         centre_x=float(centre_x),
         centre_y=float(centre_y),
         sampling_rate=sampling_rate,
-        type=type,
         elevation=elevation,
-        incidence=incidence
+        incidence=incidence,
+        type=type,
     )
 
-    # Stack the traces (i.e. take mean)
-    lin_stack = np.sum(shifted_traces_lin, axis=0) / ntrace
+    # Shift and stack the traces (i.e. take mean)
+    lin_stack = shift_stack_2D(traces, pts_shifts, np.zeros(traces.shape[1]))
 
     return lin_stack
 
 
+@jit(nopython=True, fastmath=True, parallel=True)
+def linear_stack_peaks(traces, delay_table, interpolate=False):
+    """
+    Linearly stacks the traces along each row of a delay table and finds
+    the point where the envelope (absolute value) of each stack peaks.
+    The stacks are spread over the available threads and only one stack
+    per thread is held in memory.
+
+    Parameters
+    ----------
+    traces : 2D numpy array of floats
+        A 2D numpy array containing the traces that the user wants to stack.
+
+    delay_table : 2D numpy array of floats
+        Point shifts for each station with shape [m, n] for m stacks,
+        e.g. from delay_table_baz_slow.
+
+    interpolate : bool
+        If True, the peak is refined between samples by fitting a parabola
+        to the envelope around the maximum. Default is False.
+
+    Returns
+    -------
+    peak_points : 1D numpy array of floats
+        The point of the envelope peak of each stack. Whole numbers unless
+        interpolate is True.
+    """
+
+    npts = traces.shape[1]
+    peak_points = np.zeros(delay_table.shape[0])
+
+    for k in prange(delay_table.shape[0]):
+        # stack buffer private to the thread running this stack
+        lin_stack = np.zeros(npts)
+        lin_stack = shift_stack_2D(traces, delay_table[k], lin_stack)
+
+        data_envelope = np.abs(lin_stack)
+        imax = np.argmax(data_envelope)
+        peak_point = float(imax)
+
+        if interpolate and imax > 0 and imax < npts - 1:
+            before = data_envelope[imax - 1]
+            peak = data_envelope[imax]
+            after = data_envelope[imax + 1]
+
+            curvature = before - (2 * peak) + after
+            if curvature < 0:
+                peak_point += 0.5 * (before - after) / curvature
+
+        peak_points[k] = peak_point
+
+    return peak_points
+
+
 @jit(nopython=True, fastmath=True)
 def pws_stack_baz_slow(
     traces, phase_traces, sampling_rate, geometry, distance, slow, baz, degree, type='circ',
@@ -491,14 +853,11 @@ def pws_stack_baz_slow(
         The phase-weighted stacked waveform. The traces are shifted
         using the backazimuth and horizontal slowness before stacking.
     """
-    ntrace = traces.shape[0]
-
     centre_x = np.mean(geometry[:, 0])
     centre_y = np.mean(geometry[:, 1])
 
-    # shift the traces according to the baz and slow
-    shifted_traces_lin = shift_traces(
-        traces=traces,
+    # get the point shifts for the baz and slow
+    pts_shifts = calculate_point_shifts(
         geometry=geometry,
         abs_slow=float(slow),
         baz=float(baz),
@@ -506,30 +865,18 @@ def pws_stack_baz_slow(
         centre_x=float(centre_x),
         centre_y=float(centre_y),
         sampling_rate=sampling_rate,
-        type=type,
         elevation=elevation,
-        incidence=incidence
-    )
-
-    # shift the phase traces
-    shifted_phase_traces = shift_traces(
-        traces=phase_traces,
-        geometry=geometry,
-        abs_slow=float(slow),
-        baz=float(baz),
-        distance=float(distance),
-        centre_x=float(centre_x),
-        centre_y=float(centre_y),
-        sampling_rate=sampling_rate,
+        incidence=incidence,
         type=type,
-        elevation=elevation,
-        incidence=incidence
     )
 
     # get linear and phase stacks
-    lin_stack = np.sum(shifted_traces_lin, axis=0) / ntrace
-    phase_stack = (
-        np.absolute(np.sum(np.exp(shifted_phase_traces * 1j), axis=0)) / ntrace
+    lin_stack, phase_stack = shift_stack_phase_2D(
+        traces,
+        np.exp(phase_traces * 1j),
+        pts_shifts,
+        np.zeros(traces.shape[1]),
+        np.zeros(traces.shape[1]),
     )
 
     # calculate phase weighted stack
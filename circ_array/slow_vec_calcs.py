@@ -112,9 +112,131 @@ def get_slow_baz(slow_x, slow_y, dir_type):
         pass
 
 
+def get_slow_baz_array(slow_x, slow_y, dir_type):
+    """
+    Returns the backazimuths and slowness magnitudes of many slowness vectors
+    at once. Gives the same values as get_slow_baz for each vector.
+
+    Parameters
+    ----------
+    slow_x : numpy array of floats
+        X components of the slowness vectors.
+
+    slow_y : numpy array of floats
+        Y components of the slowness vectors, same shape as slow_x.
+
+    dir_type : string
+        How do you want the direction to be measured, backazimuth (baz) or azimuth (az).
+
+    Returns
+    -------
+    slow_mags : numpy array of floats
+        Magnitudes of the slowness vectors.
+    bazs : numpy array of floats
+        Backazimuths of the slowness vectors.
+    azimuths : numpy array of floats
+        Azimuths of the slowness vectors.
+    """
+
+    slow_x = np.asarray(slow_x, dtype=float)
+    slow_y = np.asarray(slow_y, dtype=float)
+
+    slow_mags = np.sqrt(slow_x ** 2 + slow_y ** 2)
+    azimuths = np.degrees(np.arctan2(slow_x, slow_y))
+
+    bazs = azimuths % -360 + 180
+
+    bazs = np.where(bazs < 0, bazs + 360, bazs)
+    azimuths = np.where(azimuths < 0, azimuths + 360, azimuths)
+
+    if dir_type == "baz":
+        return slow_mags, bazs
+    elif dir_type == "az":
+        return slow_mags, azimuths
+    else:
+        pass
+
 
 @jit(nopython=True, fastmath=True)
-def get_max_power_loc(tp, sxmin, symin, s_space):
+def quadratic_peak_offset(tp, iy, ix):
+    """
+    Finds the sub-grid location of a peak by fitting a 2D quadratic to
+    the 3x3 neighbourhood around it. If the fit is not a maximum, or the
+    peak is on the edge of the grid, a parabola is fitted along each axis
+    that has a neighbour on both sides instead.
+
+    Parameters
+    ----------
+    tp : 2D array of floats
+        2D array of values the peak is in.
+
+    iy : int
+        Row index of the peak.
+
+    ix : int
+        Column index of the peak.
+
+    Returns
+    -------
+    dy : float
+        Offset of the peak along the rows in grid steps, between -0.5 and 0.5.
+
+    dx : float
+        Offset of the peak along the columns in grid steps, between -0.5 and 0.5.
+    """
+
+    ny = tp.shape[0]
+    nx = tp.shape[1]
+
+    has_x = ix > 0 and ix < nx - 1
+    has_y = iy > 0 and iy < ny - 1
+
+    f0 = tp[iy, ix]
+    gx = 0.0
+    gy = 0.0
+    hxx = 0.0
+    hyy = 0.0
+    dx = 0.0
+    dy = 0.0
+
+    # first and second derivatives from central differences
+    if has_x:
+        gx = (tp[iy, ix + 1] - tp[iy, ix - 1]) / 2
+        hxx = tp[iy, ix + 1] - (2 * f0) + tp[iy, ix - 1]
+    if has_y:
+        gy = (tp[iy + 1, ix] - tp[iy - 1, ix]) / 2
+        hyy = tp[iy + 1, ix] - (2 * f0) + tp[iy - 1, ix]
+
+    fitted = False
+    if has_x and has_y:
+        hxy = (
+            tp[iy + 1, ix + 1]
+            - tp[iy + 1, ix - 1]
+            - tp[iy - 1, ix + 1]
+            + tp[iy - 1, ix - 1]
+        ) / 4
+        det = (hxx * hyy) - (hxy ** 2)
+
+        # the quadratic only has a maximum if the hessian is negative definite
+        if hxx < 0 and det > 0:
+            dx = -((hyy * gx) - (hxy * gy)) / det
+            dy = -((hxx * gy) - (hxy * gx)) / det
+            fitted = True
+
+    if not fitted:
+        if hxx < 0:
+            dx = -gx / hxx
+        if hyy < 0:
+            dy = -gy / hyy
+
+    dx = min(max(dx, -0.5), 0.5)
+    dy = min(max(dy, -0.5), 0.5)
+
+    return dy, dx
+
+
+@jit(nopython=True, fastmath=True)
+def get_max_power_loc(tp, sxmin, symin, s_space, interpolate=False):
     """
     Finds the location of the maximum power value within a given
     slowness space.
@@ -133,6 +255,10 @@ def get_max_power_loc(tp, sxmin, symin, s_space):
     s_space : float
         Step interval. Assumes x and y axis spacing is the same.
 
+    interpolate : bool
+        If True, the location is refined between the grid points with
+        quadratic_peak_offset. Default is False.
+
     Returns
     -------
     peaks : 2D numpy array of floats
@@ -143,9 +269,65 @@ def get_max_power_loc(tp, sxmin, symin, s_space):
 
     iy, ix = np.where(tp == np.amax(tp))
 
-    slow_x_max = sxmin + (ix[0] * s_space)
-    slow_y_max = symin + (iy[0] * s_space)
+    dy = 0.0
+    dx = 0.0
+    if interpolate:
+        dy, dx = quadratic_peak_offset(tp, iy[0], ix[0])
+
+    slow_x_max = sxmin + ((ix[0] + dx) * s_space)
+    slow_y_max = symin + ((iy[0] + dy) * s_space)
 
     peaks[int(0)] = np.array([slow_x_max, slow_y_max])
 
     return peaks
+
+
+@jit(nopython=True, fastmath=True)
+def get_max_power_loc_pol(tp, slows, bazs, interpolate=False):
+    """
+    Finds the location of the maximum power value within a polar
+    (slowness and backazimuth) grid.
+
+    Parameters
+    ----------
+    tp : 2D array of floats
+        2D array of values to find the maxima in, rows are slowness and
+        columns are backazimuth.
+
+    slows : 1D array of floats
+        Slowness of each row.
+
+    bazs : 1D array of floats
+        Backazimuth of each column.
+
+    interpolate : bool
+        If True, the location is refined between the grid points with
+        quadratic_peak_offset. Default is False.
+
+    Returns
+    -------
+    peaks : 2D numpy array of floats
+        2D array of: [[baz,slow]]
+    """
+
+    peaks = np.empty((1, 2))
+
+    iy, ix = np.where(tp == np.amax(tp))
+
+    dy = 0.0
+    dx = 0.0
+    if interpolate:
+        dy, dx = quadratic_peak_offset(tp, iy[0], ix[0])
+
+    s_space = 0.0
+    b_space = 0.0
+    if slows.shape[0] > 1:
+        s_space = slows[1] - slows[0]
+    if bazs.shape[0] > 1:
+        b_space = bazs[1] - bazs[0]
+
+    peaks[int(0)] = np.array(
+        [bazs[ix[0]] + (dx * b_space), slows[iy[0]] + (dy * s_space)]
+    )
+
+    return peaks
@@ -0,0 +1,448 @@
+import os
+import numpy as np
+from obspy.taup import TauPyModel
+from obspy.taup.taup_time import TauPTime
+
+# one model and one set of tables per process, shared by every caller
+_models = {}
+_tables = {}
+
+# part of the table file names, changed whenever the layout of the tables
+# changes so old tables on disk are not used
+table_version = 2
+
+
+def get_model(model="prem"):
+    """
+    Returns a TauPyModel for the given model name. The model is only loaded
+    the first time it is asked for, after that the same instance is returned.
+
+    Parameters
+    ----------
+    model : string
+        1D velocity model to use (default is PREM).
+
+    Returns
+    -------
+    taup_model : obspy.taup.TauPyModel
+        The loaded model.
+    """
+
+    if model not in _models:
+        _models[model] = TauPyModel(model=model)
+
+    return _models[model]
+
+
+def table_directory(table_dir=None):
+    """
+    Returns the directory the travel time tables are saved in.
+
+    Parameters
+    ----------
+    table_dir : string
+        Directory to use. If None (default), the CIRC_ARRAY_TABLES environment
+        variable is used if set, otherwise ~/.circ_array/tables.
+
+    Returns
+    -------
+    table_dir : string
+        Path to the directory.
+    """
+
+    if table_dir is None:
+        table_dir = os.environ.get(
+            "CIRC_ARRAY_TABLES",
+            os.path.join(os.path.expanduser("~"), ".circ_array", "tables"),
+        )
+
+    return table_dir
+
+
+def grid_points(grid):
+    """
+    Returns the points of a regular grid given as (min, max, step).
+    """
+
+    grid_min, grid_max, step = grid
+    n = int(np.round((grid_max - grid_min) / step)) + 1
+
+    return np.linspace(grid_min, grid_min + ((n - 1) * step), n)
+
+
+def branch_turns(seismic_phase):
+    """
+    Returns the indices of the ray parameters of a phase where the distance
+    stops increasing and starts decreasing or the other way round
+    (caustics). The distance changes smoothly with ray parameter between
+    them, so each part of the curve is one branch of the phase.
+    """
+
+    direction = np.sign(np.diff(seismic_phase.dist))
+
+    return np.nonzero(direction[1:] * direction[:-1] < 0)[0] + 1
+
+
+def arrival_branches(arrival, turns):
+    """
+    Returns the keys of the branches an arrival is on. Branches are counted
+    from the smallest ray parameter, which does not change with source depth,
+    so the same key is the same branch at every depth. Minor and major arc
+    arrivals are on different branches as well. An arrival exactly at
+    0 or 180 degrees is on both branches either side of it.
+
+    Parameters
+    ----------
+    arrival : obspy.taup.helper_classes.Arrival
+        Arrival from TauPTime.
+
+    turns : 1D numpy array of ints
+        Output of branch_turns for the phase of the arrival.
+
+    Returns
+    -------
+    keys : list of tuples
+        Keys of (times the ray has passed 0 or 180 degrees, branch). The
+        arrival travels along the major arc if the first is odd.
+    """
+
+    branch = turns.shape[0] - np.count_nonzero(turns <= arrival.ray_param_index)
+
+    half_turns = arrival.purist_distance / 180.0
+    if np.isclose(half_turns, np.round(half_turns)):
+        half_turns = int(np.round(half_turns))
+        arcs = [arc for arc in (half_turns - 1, half_turns) if arc >= 0]
+    else:
+        arcs = [int(np.floor(half_turns))]
+
+    return [(arc, branch) for arc in arcs]
+
+
+def build_travel_time_table(phase, model="prem", depths=(0, 700, 10), distances=(0, 180, 0.5)):
+    """
+    Calculates the travel time and ray parameter of every arrival of a phase
+    over a grid of source depths and epicentral distances. The arrivals at
+    each point are the same as from TauPyModel.get_travel_times with a
+    receiver at the surface.
+
+    Each column of the table holds one branch of the phase (see
+    arrival_branches) so the values change smoothly along it and can be
+    interpolated. Where the phase triplicates, the branches cross in time so
+    the first arrival does not stay on one column.
+
+    The depth correction of the model is only done once per depth and then
+    reused for every distance.
+
+    Parameters
+    ----------
+    phase : string
+        Target phase (e.g. SKS).
+
+    model : string
+        1D velocity model to use (default is PREM).
+
+    depths : tuple of floats
+        Minimum, maximum and step of the source depths in km.
+        Default is (0, 700, 10).
+
+    distances : tuple of floats
+        Minimum, maximum and step of the epicentral distances in degrees.
+        Default is (0, 180, 0.5).
+
+    Returns
+    -------
+    table : 4D numpy array of floats
+        Array of shape [3, ndepth, ndist, nbranch]. The first axis holds the
+        travel times (s), ray parameters (s/deg) and whether the arrival
+        travels along the major arc (1) or not (0). nbranch is the number
+        of branches of the phase, points a branch does not reach are nan.
+    """
+
+    taup_model = get_model(model)
+    depth_points = grid_points(depths)
+    distance_points = grid_points(distances)
+
+    arrivals = []
+    keys = set()
+
+    for evdp in depth_points:
+        taup_time = TauPTime(
+            taup_model.model, [phase], float(evdp), float(distance_points[0]), 0.0
+        )
+        taup_time.run()
+        turns = {
+            id(seismic_phase): (phase_number, branch_turns(seismic_phase))
+            for phase_number, seismic_phase in enumerate(taup_time.phases)
+        }
+
+        depth_arrivals = []
+        for dist in distance_points:
+            taup_time.calc_time(float(dist))
+
+            dist_arrivals = {}
+            for arr in taup_time.arrivals:
+                phase_number, phase_turns = turns[id(arr.phase)]
+                for arc, branch in arrival_branches(arr, phase_turns):
+                    key = (arc, phase_number, branch)
+                    # keep the first arrival if a branch is found twice
+                    if key not in dist_arrivals:
+                        dist_arrivals[key] = (
+                            arr.time,
+                            arr.ray_param_sec_degree,
+                            arc % 2 == 1,
+                        )
+
+            keys.update(dist_arrivals)
+            depth_arrivals.append(dist_arrivals)
+
+        arrivals.append(depth_arrivals)
+
+    columns = {key: k for k, key in enumerate(sorted(keys))}
+    table = np.full(
+        (3, depth_points.shape[0], distance_points.shape[0], max(len(columns), 1)), np.nan
+    )
+
+    for i, depth_arrivals in enumerate(arrivals):
+        for j, dist_arrivals in enumerate(depth_arrivals):
+            for key, arrival in dist_arrivals.items():
+                table[:, i, j, columns[key]] = arrival
+
+    return table
+
+
+class travel_time_table:
+
+    description = """
+    Travel times and ray parameters of a phase on a grid of source depths and
+    epicentral distances, with interpolated lookups between the grid points.
+
+    Attributes
+    ----------
+    phase : string
+        Phase the table is for.
+
+    model : string
+        1D velocity model the table was calculated with.
+
+    depths : 1D numpy array of floats
+        Source depths of the grid in km.
+
+    distances : 1D numpy array of floats
+        Epicentral distances of the grid in degrees.
+
+    table : 4D numpy array of floats
+        Output of build_travel_time_table, usually memory mapped from disk.
+    """
+
+    def __init__(self, phase, model, depths, distances, table):
+        self.phase = phase
+        self.model = model
+        self.depths = grid_points(depths)
+        self.distances = grid_points(distances)
+        self.table = table
+
+    def interpolate(self, values, evdps, dists):
+        """
+        Bilinearly interpolates a [ndepth, ndist, nbranch] array to the given
+        source depths and distances along each branch. Points outside the
+        grid, or next to a grid point the branch does not exist at, are nan.
+
+        Parameters
+        ----------
+        values : 3D numpy array of floats
+            Values at the grid points.
+
+        evdps : numpy array of floats
+            Source depths in km.
+
+        dists : numpy array of floats
+            Epicentral distances in degrees, same shape as evdps.
+
+        Returns
+        -------
+        interpolated : numpy array of floats
+            Array of shape evdps.shape + (nbranch,).
+        """
+
+        evdps = np.asarray(evdps, dtype=float)
+        dists = np.asarray(dists, dtype=float)
+
+        def weights(points, grid):
+            # index of the grid point below and fraction of the way to the next
+            if grid.shape[0] == 1:
+                inside = np.isclose(points, grid[0])
+                return np.zeros(points.shape, dtype=int), np.zeros(points.shape), inside
+
+            step = grid[1] - grid[0]
+            position = (points - grid[0]) / step
+            inside = (position >= -1e-9) & (position <= grid.shape[0] - 1 + 1e-9)
+            below = np.clip(np.floor(position), 0, grid.shape[0] - 2).astype(int)
+            fraction = np.clip(position - below, 0, 1)
+
+            return below, fraction, inside
+
+        i, wi, inside_depth = weights(evdps, self.depths)
+        j, wj, inside_dist = weights(dists, self.distances)
+
+        i1 = np.minimum(i + 1, self.depths.shape[0] - 1)
+        j1 = np.minimum(j + 1, self.distances.shape[0] - 1)
+
+        wi = wi[..., np.newaxis]
+        wj = wj[..., np.newaxis]
+
+        interpolated = np.zeros(evdps.shape + (values.shape[-1],))
+        corners = [
+            ((1 - wi) * (1 - wj), i, j),
+            ((1 - wi) * wj, i, j1),
+            (wi * (1 - wj), i1, j),
+            (wi * wj, i1, j1),
+        ]
+        # corners with no weight are skipped so a missing branch next to
+        # a grid point does not stop it being looked up exactly
+        for weight, corner_i, corner_j in corners:
+            interpolated += np.where(weight > 0, weight * values[corner_i, corner_j], 0)
+
+        interpolated[~(inside_depth & inside_dist)] = np.nan
+
+        return interpolated
+
+    def arrivals(self, evdps, dists, by_branch=False):
+        """
+        Returns every arrival of the phase at the given source depths and
+        distances in order of travel time.
+
+        Parameters
+        ----------
+        evdps : numpy array of floats
+            Source depths in km.
+
+        dists : numpy array of floats
+            Epicentral distances in degrees, same shape as evdps.
+
+        by_branch : bool
+            If True, the arrivals are left in the columns of the table so
+            each column is one branch of the phase, e.g. to follow a branch
+            along distance. Default is False.
+
+        Returns
+        -------
+        times : numpy array of floats
+            Travel times in s with shape evdps.shape + (nbranch,), nan where
+            there are fewer arrivals.
+
+        ray_params : numpy array of floats
+            Ray parameters in s/deg, same shape as times.
+
+        major : numpy array of bools
+            True for arrivals travelling along the major arc.
+        """
+
+        times = self.interpolate(self.table[0], evdps, dists)
+        ray_params = self.interpolate(self.table[1], evdps, dists)
+        major = self.interpolate(self.table[2], evdps, dists) > 0.5
+
+        if not by_branch:
+            order = np.argsort(np.where(np.isnan(times), np.inf, times), axis=-1, kind="stable")
+            times, ray_params, major = [
+                np.take_along_axis(x, order, axis=-1) for x in (times, ray_params, major)
+            ]
+
+        return times, ray_params, major
+
+    def lookup(self, evdps, dists, branch=0):
+        """
+        Returns the travel time and ray parameter of one arrival of the phase
+        at the given source depths and distances. By default the first arrival.
+
+        Parameters
+        ----------
+        evdps : numpy array of floats
+            Source depths in km.
+
+        dists : numpy array of floats
+            Epicentral distances in degrees, same shape as evdps.
+
+        branch : int
+            Which arrival to return counting in order of travel time from 0.
+            Default is 0.
+
+        Returns
+        -------
+        times : numpy array of floats
+            Travel times in s, nan where the phase does not arrive.
+
+        ray_params : numpy array of floats
+            Ray parameters in s/deg, nan where the phase does not arrive.
+        """
+
+        times, ray_params, major = self.arrivals(evdps, dists)
+
+        if branch >= times.shape[-1]:
+            return np.full(times.shape[:-1], np.nan), np.full(times.shape[:-1], np.nan)
+
+        return times[..., branch], ray_params[..., branch]
+
+
+def get_travel_time_table(
+    phase, model="prem", depths=(0, 700, 10), distances=(0, 180, 0.5), table_dir=None
+):
+    """
+    Returns the travel time table of a phase. The table is built with
+    build_travel_time_table the first time it is needed and saved to disk,
+    after that it is memory mapped from the file so every process using it
+    shares the one copy. Within a process the table is only opened once.
+
+    Parameters
+    ----------
+    phase : string
+        Target phase (e.g. SKS).
+
+    model : string
+        1D velocity model to use (default is PREM).
+
+    depths : tuple of floats
+        Minimum, maximum and step of the source depths in km.
+        Default is (0, 700, 10).
+
+    distances : tuple of floats
+        Minimum, maximum and step of the epicentral distances in degrees.
+        Default is (0, 180, 0.5).
+
+    table_dir : string
+        Directory the tables are saved in, see table_directory.
+
+    Returns
+    -------
+    table : travel_time_table
+        Table with interpolated lookups.
+    """
+
+    depths = tuple(float(d) for d in depths)
+    distances = tuple(float(d) for d in distances)
+    table_dir = table_directory(table_dir)
+
+    key = (phase, model, depths, distances, table_dir)
+    if key not in _tables:
+        model_name = os.path.splitext(os.path.basename(model))[0]
+        filename = os.path.join(
+            table_dir,
+            "%s_%s_depth_%g_%g_%g_dist_%g_%g_%g_v%d.npy"
+            % ((model_name, phase) + depths + distances + (table_version,)),
+        )
+
+        if not os.path.exists(filename):
+            table = build_travel_time_table(phase, model, depths, distances)
+
+            # write to a temporary file first so other processes never
+            # open a partly written table
+            os.makedirs(table_dir, exist_ok=True)
+            tmp_filename = "%s.%s.tmp" % (filename, os.getpid())
+            with open(tmp_filename, "wb") as tmp_file:
+                np.save(tmp_file, table)
+            os.replace(tmp_filename, filename)
+
+        _tables[key] = travel_time_table(
+            phase, model, depths, distances, np.load(filename, mmap_mode="r")
+        )
+
+    return _tables[key]
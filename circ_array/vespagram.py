@@ -1,11 +1,12 @@
 
 import numpy as np
-from numba import jit
-from shift_stack import linear_stack_baz_slow, pws_stack_baz_slow
+from numba import jit, prange
+from shift_stack import shift_stack_2D, shift_stack_phase_2D
+from delay_tables import delay_table_slow, delay_table_baz
 
-@jit(nopython=True, fastmath=True)
+@jit(nopython=True, fastmath=True, parallel=True)
 def Vespagram_Lin(traces, sampling_rate, geometry, distance, baz, smin, smax, s_space, type='circ',
-                  elevation=False, incidence=90):
+                  elevation=False, incidence=90, delay_table=None):
     """
     Function to calculate the slowness vespagram of given traces using linear stacking.
 
@@ -47,6 +48,10 @@ def Vespagram_Lin(traces, sampling_rate, geometry, distance, baz, smin, smax, s_
         Not used unless elevation is True. Give incidence angle from vertical
         at the centre of the array to calculate elevation corrections. Default is 90.
 
+    delay_table : 2D numpy array of floats
+        Point shifts for each station at each slowness from delay_table_slow.
+        If None (default), the table is calculated here.
+
     Returns
     -------
     ves_lin : 2D numpy array of floats
@@ -59,28 +64,31 @@ def Vespagram_Lin(traces, sampling_rate, geometry, distance, baz, smin, smax, s_
 
     ves_lin = np.empty((nslow, traces.shape[1]))
 
-    for i in range(slows.shape[0]):
-
-        slow = float(slows[int(i)])
-
-        lin_stack = linear_stack_baz_slow(
-            traces=traces,
-            sampling_rate=sampling_rate,
+    # point shifts for each station at each slowness
+    if delay_table is None:
+        pts_table = delay_table_slow(
             geometry=geometry,
             distance=distance,
-            slow=slow,
             baz=baz,
+            smin=smin,
+            smax=smax,
+            s_space=s_space,
+            sampling_rate=sampling_rate,
             type=type,
             elevation=elevation,
             incidence=incidence
         )
+    else:
+        pts_table = delay_table
 
-        ves_lin[i] = lin_stack
+    for i in prange(slows.shape[0]):
+
+        shift_stack_2D(traces, pts_table[i], ves_lin[i])
 
     return ves_lin
 
 
-@jit(nopython=True, fastmath=True)
+@jit(nopython=True, fastmath=True, parallel=True)
 def Vespagram_PWS(
     traces,
     phase_traces,
@@ -94,7 +102,8 @@ def Vespagram_PWS(
     degree,
     type='circ',
     elevation=False,
-    incidence=90
+    incidence=90,
+    delay_table=None
 ):
     """
     Function to calculate the slowness vespagram of given traces using phase weighted stacking.
@@ -145,6 +154,10 @@ def Vespagram_PWS(
         Not used unless elevation is True. Give incidence angle from vertical
         at the centre of the array to calculate elevation corrections. Default is 90.
 
+    delay_table : 2D numpy array of floats
+        Point shifts for each station at each slowness from delay_table_slow.
+        If None (default), the table is calculated here.
+
     Returns
     -------
     ves_pws : 2D numpy array of floats
@@ -158,33 +171,45 @@ def Vespagram_PWS(
 
     ves_pws = np.empty((nslow, traces.shape[1]))
 
-    for i in range(slows.shape[0]):
+    # unit phasors are shift invariant so only need calculating once
+    phasors = np.exp(phase_traces * 1j)
 
-        slow = float(slows[int(i)])
-
-        pws_stack = pws_stack_baz_slow(
-            traces=traces,
-            phase_traces=phase_traces,
-            sampling_rate=sampling_rate,
+    # point shifts for each station at each slowness
+    if delay_table is None:
+        pts_table = delay_table_slow(
             geometry=geometry,
             distance=distance,
-            slow=slow,
             baz=baz,
-            degree=degree,
+            smin=smin,
+            smax=smax,
+            s_space=s_space,
+            sampling_rate=sampling_rate,
             type=type,
             elevation=elevation,
             incidence=incidence
         )
+    else:
+        pts_table = delay_table
+
+    for i in prange(slows.shape[0]):
+        # stack buffers private to the thread running this slowness
+        lin_stack = np.zeros(traces.shape[1])
+        phase_stack = np.zeros(traces.shape[1])
+
+        # get linear and phase stacks
+        lin_stack, phase_stack = shift_stack_phase_2D(
+            traces, phasors, pts_table[i], lin_stack, phase_stack
+        )
 
-        ves_pws[i] = pws_stack
+        ves_pws[i] = lin_stack * (phase_stack**degree)
 
     return ves_pws
 
 
-@jit(nopython=True, fastmath=True)
+@jit(nopython=True, fastmath=True, parallel=True)
 def Baz_vespagram_Lin(
     traces, sampling_rate, geometry, distance, slow, bmin, bmax, b_space, type='circ',
-    elevation=False, incidence=90
+    elevation=False, incidence=90, delay_table=None
 ):
     """
     Function to calculate the backazimuth vespagram of given traces using linear stacking.
@@ -227,6 +252,10 @@ def Baz_vespagram_Lin(
         Not used unless elevation is True. Give incidence angle from vertical
         at the centre of the array to calculate elevation corrections. Default is 90.
 
+    delay_table : 2D numpy array of floats
+        Point shifts for each station at each backazimuth from delay_table_baz.
+        If None (default), the table is calculated here.
+
     Returns
     -------
     ves_lin : 2D numpy array of floats
@@ -239,28 +268,31 @@ def Baz_vespagram_Lin(
 
     ves_lin = np.empty((nbaz, traces.shape[1]))
 
-    for i in range(bazs.shape[0]):
-
-        baz = float(bazs[int(i)])
-
-        lin_stack = linear_stack_baz_slow(
-            traces=traces,
-            sampling_rate=sampling_rate,
+    # point shifts for each station at each backazimuth
+    if delay_table is None:
+        pts_table = delay_table_baz(
             geometry=geometry,
             distance=distance,
             slow=slow,
-            baz=baz,
+            bmin=bmin,
+            bmax=bmax,
+            b_space=b_space,
+            sampling_rate=sampling_rate,
             type=type,
             elevation=elevation,
             incidence=incidence
         )
+    else:
+        pts_table = delay_table
 
-        ves_lin[i] = lin_stack
+    for i in prange(bazs.shape[0]):
+
+        shift_stack_2D(traces, pts_table[i], ves_lin[i])
 
     return ves_lin
 
 
-@jit(nopython=True, fastmath=True)
+@jit(nopython=True, fastmath=True, parallel=True)
 def Baz_vespagram_PWS(
     traces,
     phase_traces,
@@ -274,7 +306,8 @@ def Baz_vespagram_PWS(
     degree,
     type='circ',
     elevation=False,
-    incidence=90
+    incidence=90,
+    delay_table=None
 ):
     """
     Function to calculate the backazimuth vespagram of given traces using phase weighted stacking.
@@ -325,6 +358,10 @@ def Baz_vespagram_PWS(
         Not used unless elevation is True. Give incidence angle from vertical
         at the centre of the array to calculate elevation corrections. Default is 90.
 
+    delay_table : 2D numpy array of floats
+        Point shifts for each station at each backazimuth from delay_table_baz.
+        If None (default), the table is calculated here.
+
     Returns
     -------
     ves_pws : 2D numpy array of floats
@@ -338,24 +375,36 @@ def Baz_vespagram_PWS(
 
     ves_pws = np.empty((nbaz, traces.shape[1]))
 
-    for i in range(bazs.shape[0]):
+    # unit phasors are shift invariant so only need calculating once
+    phasors = np.exp(phase_traces * 1j)
 
-        baz = float(bazs[int(i)])
-
-        pws_stack = pws_stack_baz_slow(
-            traces=traces,
-            phase_traces=phase_traces,
-            sampling_rate=sampling_rate,
+    # point shifts for each station at each backazimuth
+    if delay_table is None:
+        pts_table = delay_table_baz(
             geometry=geometry,
             distance=distance,
             slow=slow,
-            baz=baz,
-            degree=degree,
+            bmin=bmin,
+            bmax=bmax,
+            b_space=b_space,
+            sampling_rate=sampling_rate,
             type=type,
             elevation=elevation,
             incidence=incidence
         )
+    else:
+        pts_table = delay_table
+
+    for i in prange(bazs.shape[0]):
+        # stack buffers private to the thread running this backazimuth
+        lin_stack = np.zeros(traces.shape[1])
+        phase_stack = np.zeros(traces.shape[1])
+
+        # get linear and phase stacks
+        lin_stack, phase_stack = shift_stack_phase_2D(
+            traces, phasors, pts_table[i], lin_stack, phase_stack
+        )
 
-        ves_pws[i] = pws_stack
+        ves_pws[i] = lin_stack * (phase_stack**degree)
 
     return ves_pws
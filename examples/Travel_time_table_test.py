@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+Description = """
+This python script will test:
+    - Travel times and ray parameters from the travel time tables match
+      TauP between the grid points, including where P triplicates.
+    - Arrivals along the major arc are flagged.
+    - Events are relocated to the distance of the observed slowness where
+      P triplicates.
+    - Predictions from the tables match array.pred_baz_slow for major arc
+      phases.
+"""
+
+import obspy
+import numpy as np
+from obspy.core.util import AttribDict
+from array_info import array
+from travel_time_tables import get_model, get_travel_time_table
+from geo_sphere_calcs import relocate_event_baz_slow, deg_km_az_baz_array
+
+model = get_model("prem")
+
+
+def taup_arrivals(phase, evdp, dist):
+    arrivals = model.get_travel_times(
+        source_depth_in_km=evdp, distance_in_degree=dist, phase_list=[phase]
+    )
+    return (
+        np.array([arr.time for arr in arrivals]),
+        np.array([arr.ray_param_sec_degree for arr in arrivals]),
+        np.array([(arr.purist_distance % 360) > 180 for arr in arrivals]),
+    )
+
+
+# P triplicates between about 15 and 25 degrees for a shallow source, the
+# arrivals from the table should match TauP off the grid points. Branches
+# that end between two grid points are not in the table near their ends.
+table = get_travel_time_table("P")
+evdp = 33
+for dist in np.arange(15.1, 25, 0.35):
+    times, ray_params, major = table.arrivals(np.array(evdp), np.array(dist))
+    found = ~np.isnan(times)
+
+    taup_times, taup_ray_params, taup_major = taup_arrivals("P", evdp, dist)
+
+    print("P %.2f deg: %s" % (dist, np.round(ray_params[found], 3)))
+    print("      TauP: %s" % np.round(taup_ray_params, 3))
+    for time, ray_param in zip(times[found], ray_params[found]):
+        assert np.any(
+            (np.abs(taup_times - time) < 0.1) & (np.abs(taup_ray_params - ray_param) < 0.02)
+        )
+    assert np.isclose(ray_params[0], taup_ray_params[0], atol=0.02)
+
+
+# PP and SKKS past the antipode travel along the major arc.
+for phase, evdp, dist in [("PP", 100, 170), ("PP", 100, 179.9), ("SKKS", 100, 140.3)]:
+    table = get_travel_time_table(phase)
+    times, ray_params, major = table.arrivals(np.array(evdp), np.array(dist))
+    found = ~np.isnan(times)
+
+    taup_times, taup_ray_params, taup_major = taup_arrivals(phase, evdp, dist)
+
+    print("%s %.2f deg major arc: %s TauP: %s" % (phase, dist, major[found], taup_major))
+    assert np.allclose(times[found], taup_times, atol=0.1)
+    assert np.array_equal(major[found], taup_major)
+    assert np.any(major[found])
+
+
+# An event 20 degrees north of the array relocated with the ray parameter
+# of each P arrival at the true distance should move to the true distance,
+# whichever branch of the triplication the arrival is on.
+for true_dist in [16.0, 18.3, 20.0, 22.3]:
+    taup_times, taup_ray_params, taup_major = taup_arrivals("P", 33, true_dist)
+
+    new_evlas, new_evlos = relocate_event_baz_slow(
+        evla=20, evlo=0, evdp=33, stla=0, stlo=0, baz=0, slow=taup_ray_params, phase="P"
+    )
+    new_dists = deg_km_az_baz_array(new_evlas, new_evlos, 0, 0)[0]
+
+    print("P relocated to %s deg, true %.2f deg" % (np.round(new_dists, 2), true_dist))
+    assert np.allclose(new_dists, true_dist, atol=0.15)
+
+
+# The predictions from the tables should name and orient the major arc
+# arrivals the same as pred_baz_slow, which calls TauP directly.
+def make_stream(evla, evlo, evdp):
+    st = obspy.Stream()
+    for i, (stla, stlo) in enumerate([(0, 0), (0.5, 0.2), (-0.3, 0.4), (0.2, -0.5)]):
+        tr = obspy.Trace(np.zeros(100))
+        tr.stats.station = "ST%s" % i
+        tr.stats.sac = AttribDict(
+            {"evla": evla, "evlo": evlo, "evdp": evdp, "stla": stla, "stlo": stlo, "stel": 0.0}
+        )
+        st.append(tr)
+    return st
+
+
+for evla, evlo, evdp, phases in [(0, 170.1, 100, ["PP"]), (10, 150, 100, ["SKKS", "PP"])]:
+    a = array(make_stream(evla, evlo, evdp))
+    preds = a.pred_baz_slow(phases=phases, one_eighty=True)
+    table_preds = a.pred_baz_slow_table(phases=phases, one_eighty=True)
+
+    assert len(preds) == len(table_preds)
+    for pred, table_pred in zip(preds, table_preds):
+        print(pred[0], pred[2], table_pred["phase"], table_pred["baz"])
+        assert pred[0] == table_pred["phase"]
+        assert np.isclose(float(pred[2]), table_pred["baz"])
+        assert np.allclose(
+            [float(x) for x in pred[3:7]],
+            [table_pred[x] for x in ("slow_x_baz", "slow_y_baz", "slow_x_az", "slow_y_az")],
+        )
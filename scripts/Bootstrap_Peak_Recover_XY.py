@@ -1,171 +1,117 @@
 #!/usr/bin/env python
 
-from beamforming_xy import BF_Noise_Threshold_Relative_XY
+from beamforming_xy import BF_Noise_Std_Relative_XY, worker_seed
 from shift_stack import shift_traces
+from parallel_config import set_threads
 import obspy
 import matplotlib.pyplot as plt
 import numpy as np
 import scipy
 from Parameters_Bootstrap import *
-import random
 import sys
 import os
-from obspy.taup import TauPyModel
+import glob
+from travel_time_tables import get_model
 import time
 from array_info import array
 from extract_peaks import findpeaks_XY
+from cluster_utilities import cluster_utilities
+from sklearn.cluster import dbscan
+from scipy.optimize import linear_sum_assignment
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import multiprocessing
 
-model = TauPyModel(model=pred_model)
-from mpi4py import MPI
 
+## can be run with mpi (backend = "mpi") or with a pool of
+## processes on one machine (backend = "processes")
 
-## to be run with mpi
-comm = MPI.COMM_WORLD
+# arrays and settings every bootstrap sample needs. Filled in directly
+# for mpi and by attach_shared in each worker of the process pool.
+shared = {}
 
-size_cores = comm.size
-processes_per_core = int(Boots / size_cores)
 
-# if directory does not exist, create it
-
-if comm.Get_rank() == 0:
-    if os.path.exists(numpy_dir):
-        pass
-    else:
-        os.makedirs(numpy_dir)
-
-st = obspy.read(filepath)
-
-a = array(st)
-
-event_time = a.eventtime()
-# get travel time information and define a window
-Target_phase_times, time_header_times = a.get_predicted_times(phase)
-
-min_target = int(np.nanmin(Target_phase_times, axis=0)) + cut_min
-max_target = int(np.nanmax(Target_phase_times, axis=0)) + cut_max
-
-stime = event_time + min_target
-etime = event_time + max_target
-
-# trim the stream
-# Normalise and cut seismogram around defined window
-st = st.copy().trim(starttime=stime, endtime=etime)
-st = st.normalize()
+def attach_shared(blocks, settings, threads):
+    """
+    Initialiser for the worker processes. Attaches to the shared memory
+    blocks holding the traces, geometry and distances so they are not
+    copied to every worker.
 
+    Parameters
+    ----------
+    blocks : dict
+        Name of each array mapped to a tuple of the shared memory block
+        name, shape and dtype.
 
-sample_size = len(st)
-# get array metadata
-# this is done after the trimming because the
-#  trmming can remove dodgy traces
-geometry = a.geometry()
-distances = a.distances(type="deg")
-mean_dist = np.mean(distances)
-stations = a.stations()
-centre_x, centre_y = np.mean(geometry[:, 0]), np.mean(geometry[:, 1])
-sampling_rate = st[0].stats.sampling_rate
-evdp = st[0].stats.sac.evdp
+    settings : dict
+        Scalar values used by every bootstrap sample.
 
-# convert elevation to km
-geometry[:,2] /= 1000
-if phase not in phases:
-    phases.append(phase)
-# get predicted slownesses and backazimuths
-predictions = a.pred_baz_slow(phases=phases, one_eighty=True)
+    threads : int
+        Number of numba threads each worker should use.
+    """
 
-# find the line with the predictions for the phase of interest
-row = np.where((predictions == phase))[0]
-P, S, BAZ, PRED_BAZ_X, PRED_BAZ_Y, PRED_AZ_X, PRED_AZ_Y, DIST, TIME = predictions[
-    row, :
-][0]
+    for name, (shm_name, shape, dtype) in blocks.items():
+        try:
+            # the parent unlinks the blocks, stop python >= 3.13 tracking them
+            shm = shared_memory.SharedMemory(name=shm_name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=shm_name)
+        # keep a reference so the buffer stays mapped
+        shared[name + "_shm"] = shm
+        shared[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
 
+    shared.update(settings)
+    set_threads(threads)
 
-# filter
-if Filt == True:
-    st = st.filter("bandpass", freqmin=fmin, freqmax=fmax, corners=2, zerophase=True)
 
-else:
-    pass
+def bootstrap_sample(label):
+    """
+    Beamforms one bootstrap sample of the traces in shared and finds the
+    peaks above the noise.
 
-st.resample(20, window="hann", no_filter=True)
+    Parameters
+    ----------
+    label : int
+        Index of the bootstrap sample. Each label draws its own random
+        sample of the traces from the run seed.
 
-# get the traces and phase traces
-a_processed = array(st)
-Traces = a_processed.traces()
+    Returns
+    -------
+    label : int
+        Index of the bootstrap sample.
 
-incidence = np.sin((1/float(S))/8) #km/s
-incidence = 90 - np.degrees(incidence)
+    lin_tp : 2D numpy array of floats
+        Linear power grid of the sample.
 
-# align the traces and phase traces
-Shifted_Traces = shift_traces(
-    traces=Traces,
-    geometry=geometry,
-    abs_slow=float(S),
-    baz=float(BAZ),
-    distance=float(mean_dist),
-    centre_x=float(centre_x),
-    centre_y=float(centre_y),
-    sampling_rate=sampling_rate,
-    elevation=True,
-    incidence=incidence
-)
+    noise_mean : float
+        Mean noise power of the sample.
 
+    peaks : 2D numpy array of floats
+        Slowness vectors of the peaks found.
+    """
 
-## cut the shifted traces within the defined time window
-## from the t_min and rel_tmax
+    print(label)
 
-arrivals = model.get_travel_times(
-    source_depth_in_km=evdp, distance_in_degree=mean_dist, phase_list=[phase]
-)
+    cut_shifted_traces = shared["traces"]
+    geometry = shared["geometry"]
+    distances = shared["distances"]
 
-pred_point = int(sampling_rate * (arrivals[0].time - min_target))
-point_before = int(pred_point + (t_min * sampling_rate))
-point_after = int(pred_point + (t_max * sampling_rate))
+    ntrace = cut_shifted_traces.shape[0]
+    rng = np.random.default_rng([shared["seed"], label])
 
-cut_shifted_traces = Shifted_Traces[:, point_before:point_after]
-
-# st_shifted = st.copy()
-# for index in range(len(st_shifted)):
-#     # replace unshifted data
-#     #  keep information about geometry etc.
-#     st_shifted[index].data = cut_shifted_traces[index]
-
-# fig = plt.figure()
-# ax = fig.add_subplot(111)
-# for f,trace in enumerate(cut_shifted_traces):
-#     ax.plot(trace + distances[f],color='black')
-#
-# plt.show()
-
-# make lists to store the peaks, noise and theta-p plots
-Lin_list = []
-Noise_list = []
-
-ntrace = len(st)
-indices = list(np.arange(ntrace))
-
-for i in range(0, processes_per_core):
-    print(i)
-
-    label = (i * int(comm.size)) + int(comm.rank)
-    # get a random sample of traces - needs to be in list format
-    rand_indices = random.choices(indices,k=sample_size)
+    # get a random sample of traces with replacement
+    rand_indices = rng.integers(0, ntrace, ntrace)
 
     Traces_new = np.take(cut_shifted_traces, rand_indices, axis=0)
     geometry_new = np.take(geometry, rand_indices, axis=0)
     distances_new = np.take(distances, rand_indices)
     avg_dist = np.mean(distances_new)
-    # get centre
-    centre_x, centre_y, centre_z = (
-        np.mean(geometry_new[:, 0]),
-        np.mean(geometry_new[:, 1]),
-        np.mean(geometry_new[:, 2]),
-    )
 
     start = time.time()
 
-    lin_tp, noise_mean, max_peak = BF_Noise_Threshold_Relative_XY(
+    lin_tp, noise_mean, noise_std, max_peak = BF_Noise_Std_Relative_XY(
         traces=Traces_new,
-        sampling_rate=sampling_rate,
+        sampling_rate=shared["sampling_rate"],
         geometry=geometry_new,
         distance=avg_dist,
         sxmin=slow_min,
@@ -174,24 +120,32 @@ for i in range(0, processes_per_core):
         symax=slow_max,
         s_space=s_space,
         elevation=True,
-        incidence=incidence
+        incidence=shared["incidence"],
+        seed=worker_seed(shared["seed"], label),
+        noise_method=noise_method,
     )
 
     end = time.time()
 
     print(end - start)
 
-    Smoothed_thresh_lin_array = scipy.ndimage.filters.gaussian_filter(
+    Smoothed_thresh_lin_array = scipy.ndimage.gaussian_filter(
         lin_tp, 1, mode="constant"
     )
 
     Threshold_lin_array = np.copy(Smoothed_thresh_lin_array)
-    Threshold_lin_array[Smoothed_thresh_lin_array <= noise_mean * 0] = 0
+    # optionally only keep the powers more than threshold_n_std standard
+    # deviations above the noise
+    if threshold_n_std is None:
+        threshold = noise_mean * 0
+    else:
+        threshold = noise_mean + (threshold_n_std * noise_std)
+    Threshold_lin_array[Smoothed_thresh_lin_array <= threshold] = 0
 
-    sx_min = float(PRED_BAZ_X) + slow_min
-    sx_max = float(PRED_BAZ_X) + slow_max
-    sy_min = float(PRED_BAZ_Y) + slow_min
-    sy_max = float(PRED_BAZ_Y) + slow_max
+    sx_min = shared["pred_x"] + slow_min
+    sx_max = shared["pred_x"] + slow_max
+    sy_min = shared["pred_y"] + slow_min
+    sy_max = shared["pred_y"] + slow_max
 
     peaks, powers = findpeaks_XY(
         Threshold_lin_array,
@@ -202,77 +156,870 @@ for i in range(0, processes_per_core):
         xstep=s_space,
         ystep=s_space,
         N=peak_number,
+        interpolate=interpolate_peaks,
     )
 
     print(peaks)
 
     sys.stdout.flush()
 
-    # add the arrays to a list
-    Lin_list.append(lin_tp)
-    Noise_list.append(noise_mean)
-    if i == 0:
-        threshold_peaks = peaks.copy()
-    else:
-        threshold_peaks =  np.vstack([threshold_peaks, peaks])
+    return label, lin_tp, noise_mean, np.array(peaks)
+
+
+def new_state(grid_shape, peaks_file):
+    """
+    Makes an empty record of completed bootstrap samples. Only running
+    sums of the power grids are kept so the memory used does not grow
+    with the number of samples, and the peaks are appended to a file.
+
+    Parameters
+    ----------
+    grid_shape : tuple of ints
+        Shape of the linear power grids.
+
+    peaks_file : str
+        Path of the file the peaks are appended to. Any existing file is
+        emptied.
+
+    Returns
+    -------
+    state : dict
+        Labels and noise of each completed sample, the running sums and
+        sums of squares of their linear power grids and the peak files
+        with the number of rows written to each.
+    """
+
+    open(peaks_file, "wb").close()
+
+    return {
+        "labels": [],
+        "noise": [],
+        "lin_sum": np.zeros(grid_shape),
+        "lin_sq_sum": np.zeros(grid_shape),
+        "peaks_files": [[peaks_file, 0]],
+    }
+
+
+def add_sample(state, result):
+    """
+    Adds the output of bootstrap_sample to the record of completed samples.
+
+    Parameters
+    ----------
+    state : dict
+        Record of completed samples from new_state.
+
+    result : tuple
+        Output of bootstrap_sample.
+    """
+
+    label, lin_tp, noise_mean, peaks = result
+
+    state["labels"].append(label)
+    state["noise"].append(noise_mean)
+
+    state["lin_sum"] += lin_tp
+    state["lin_sq_sum"] += lin_tp**2
+
+    # rows of label, slow_x, slow_y
+    peaks_file = state["peaks_files"][-1]
+    rows = np.column_stack((np.full(len(peaks), label), peaks)).astype(float)
+    with open(peaks_file[0], "ab") as f:
+        rows.tofile(f)
+    peaks_file[1] += len(rows)
 
-Lin_mean = np.mean(np.array(Lin_list), axis=0)
-print(threshold_peaks)
 
-threshold_peaks_arr = np.array(threshold_peaks)
-# threshold_peaks_arr = np.vstack(threshold_peaks_arr)
-comm.Barrier()  # wait for all cores to synchronize here
+def merge_states(states):
+    """
+    Combines records of completed samples, e.g. from several ranks or
+    checkpoint files.
 
+    Parameters
+    ----------
+    states : list of dicts
+        Records of completed samples from new_state. The power grid sums
+        can be None if they are combined separately.
 
-all_lin_list_combined = np.array(comm.gather(Lin_mean, root=0))
-all_noise_list_combined = np.array(comm.gather(Noise_list, root=0))
-all_thresh_peaks_list_combined = np.array(comm.gather(threshold_peaks_arr, root=0))
+    Returns
+    -------
+    state : dict
+        Record holding all the samples.
+    """
 
+    merged = {
+        "labels": [],
+        "noise": [],
+        "lin_sum": None,
+        "lin_sq_sum": None,
+        "peaks_files": [],
+    }
 
-if comm.Get_rank() == 0:
-    Lin_Mean = np.mean(all_lin_list_combined, axis=0)
+    for state in states:
+        merged["labels"].extend(state["labels"])
+        merged["noise"].extend(state["noise"])
+        merged["peaks_files"].extend(state["peaks_files"])
+        for key in ["lin_sum", "lin_sq_sum"]:
+            if state[key] is not None:
+                if merged[key] is None:
+                    merged[key] = np.copy(state[key])
+                else:
+                    merged[key] += state[key]
 
-    # Lin_list = []
-    Noise_list = []
-    Peaks_list = []
+    if len(set(merged["labels"])) != len(merged["labels"]):
+        raise ValueError("The same bootstrap sample was recorded more than once")
 
-    All_Thresh_Peaks_arr = np.vstack(all_thresh_peaks_list_combined)
-    All_Noise_arr = np.array(Noise_list)
+    return merged
 
 
+def read_peaks(peaks_files):
+    """
+    Reads the peaks written by add_sample.
 
+    Parameters
+    ----------
+    peaks_files : list
+        Path of each peak file and the number of rows to read from it.
+        Rows written after the count (e.g. after the last checkpoint)
+        are ignored.
 
-    # Ok need to get all the probability arrays into one list/array.
-    all_prob_list = []
-    for x in range(0, comm.size):
-        for y in range(0, processes_per_core):
-            Noise_list.append(all_noise_list_combined[x][y])
+    Returns
+    -------
+    peaks : 2D numpy array of floats
+        Rows of label, slow_x, slow_y ordered by label. The peaks of each
+        sample stay in the order findpeaks_XY returned them.
+    """
 
-    # save to the results directory!
-    all_max_peaks_filename = "%sAll_Thresh_Peaks_%s_%s_%s_array" % (
+    peaks = [np.zeros((0, 3))]
+    for peaks_file, n_rows in peaks_files:
+        peaks.append(np.fromfile(peaks_file, count=n_rows * 3).reshape(n_rows, 3))
+    peaks = np.vstack(peaks)
+
+    return peaks[np.argsort(peaks[:, 0], kind="stable")]
+
+
+def write_peaks(peaks, peaks_file):
+    """
+    Writes peaks from read_peaks to a file add_sample can append to.
+
+    Parameters
+    ----------
+    peaks : 2D numpy array of floats
+        Rows of label, slow_x, slow_y.
+
+    peaks_file : str
+        Path of the file to write.
+    """
+
+    temp_filename = peaks_file + ".tmp"
+    with open(temp_filename, "wb") as f:
+        np.ascontiguousarray(peaks, dtype=float).tofile(f)
+    os.replace(temp_filename, peaks_file)
+
+
+def checkpoint_filename(rank):
+    """
+    Name of the checkpoint file written by one rank for this run.
+
+    Parameters
+    ----------
+    rank : int or str
+        MPI rank (0 for the process pool), or "*" to match every rank.
+
+    Returns
+    -------
+    filename : str
+        Path of the checkpoint file in numpy_dir.
+    """
+
+    return "%sBootstrap_Checkpoint_%s_%s_%s_rank_%s.npz" % (
         numpy_dir,
         Boots,
         fmin,
         fmax,
+        rank,
     )
-    lin_mean_arr_filename = "%sMean_Lin_%s_%s_%s_array" % (numpy_dir, Boots, fmin, fmax)
-    all_noise_arr_filename = "%sAll_Noise_%s_%s_%s_array" % (
+
+
+def peaks_filename(rank):
+    """
+    Name of the file one rank appends its peaks to for this run.
+
+    Parameters
+    ----------
+    rank : int or str
+        MPI rank (0 for the process pool), or "*" to match every rank.
+
+    Returns
+    -------
+    filename : str
+        Path of the peak file in numpy_dir.
+    """
+
+    return "%sBootstrap_Peaks_%s_%s_%s_rank_%s.bin" % (
         numpy_dir,
         Boots,
         fmin,
         fmax,
+        rank,
+    )
+
+
+def save_checkpoint(state, run_seed, filename):
+    """
+    Writes the completed samples and the run seed to a checkpoint file.
+    The file is written under a temporary name and then renamed so a job
+    killed while writing still has its previous checkpoint.
+
+    Parameters
+    ----------
+    state : dict
+        Record of completed samples from new_state.
+
+    run_seed : int
+        Seed of the run, needed to redo the missing samples on resume.
+
+    filename : str
+        Path of the checkpoint file.
+    """
+
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "wb") as temp_file:
+        np.savez(
+            temp_file,
+            labels=np.array(state["labels"], dtype=int),
+            noise=np.array(state["noise"], dtype=float),
+            lin_sum=state["lin_sum"],
+            lin_sq_sum=state["lin_sq_sum"],
+            peaks_files=np.array([f for f, n in state["peaks_files"]], dtype=str),
+            peaks_rows=np.array([n for f, n in state["peaks_files"]], dtype=int),
+            # the seed can be too big for an int64
+            seed=np.array(str(run_seed)),
+        )
+    os.replace(temp_filename, filename)
+
+
+def load_checkpoints():
+    """
+    Reads every checkpoint file of this run from numpy_dir.
+
+    Returns
+    -------
+    state : dict
+        Record of all the samples in the checkpoints.
+
+    run_seed : int
+        Seed of the checkpointed run, None if there are no checkpoints.
+
+    filenames : list of str
+        Paths of the checkpoint files read.
+    """
+
+    filenames = sorted(glob.glob(checkpoint_filename("*")))
+
+    states = []
+    seeds = set()
+    for filename in filenames:
+        with np.load(filename) as checkpoint:
+            state = {
+                "labels": list(checkpoint["labels"]),
+                "noise": list(checkpoint["noise"]),
+                "lin_sum": checkpoint["lin_sum"],
+                "lin_sq_sum": checkpoint["lin_sq_sum"],
+                "peaks_files": [
+                    [str(f), int(n)]
+                    for f, n in zip(checkpoint["peaks_files"], checkpoint["peaks_rows"])
+                ],
+            }
+            seeds.add(int(str(checkpoint["seed"])))
+        states.append(state)
+
+    if len(seeds) > 1:
+        raise ValueError("Checkpoint files in %s come from different runs" % numpy_dir)
+
+    run_seed = seeds.pop() if len(seeds) == 1 else None
+
+    return merge_states(states), run_seed, filenames
+
+
+def cluster_summary(peaks, n_samples):
+    """
+    Clusters the peaks with DBSCAN as in Clustering.py and summarises each
+    cluster by its mean and 95% confidence bounds.
+
+    Parameters
+    ----------
+    peaks : 2D numpy array of floats
+        Slowness vectors of the peaks found so far.
+
+    n_samples : int
+        Number of bootstrap samples the peaks come from.
+
+    Returns
+    -------
+    summary : 2D numpy array of floats
+        Row for each cluster of mean slow_x, mean slow_y and the 2.5 and
+        97.5 percentiles of slow_x then slow_y. None if there are no
+        clusters.
+    """
+
+    if len(peaks) == 0:
+        return None
+
+    core_samples, labels = dbscan(
+        X=peaks, eps=epsilon, min_samples=max(int(n_samples * MinPts), 1)
     )
 
-    n_array_names = [
-        all_max_peaks_filename,
-        lin_mean_arr_filename,
-        all_noise_arr_filename,
-    ]
+    if np.amax(labels) < 0:
+        return None
+
+    cu = cluster_utilities(labels=labels, points=peaks)
+    means_xy, means_baz_slow = cu.cluster_means()
+
+    summary = []
+    for mean_xy, points in zip(means_xy, cu.group_points_clusters()):
+        lower_x, upper_x = np.percentile(points[:, 0], [2.5, 97.5])
+        lower_y, upper_y = np.percentile(points[:, 1], [2.5, 97.5])
+        summary.append([mean_xy[0], mean_xy[1], lower_x, upper_x, lower_y, upper_y])
+
+    return np.array(summary)
+
+
+def summary_change(previous, summary):
+    """
+    Largest change in the mean or 95% bounds of any cluster between two
+    summaries from cluster_summary. Clusters are matched to minimise the
+    distance between their means as DBSCAN can number them differently.
+
+    Parameters
+    ----------
+    previous : 2D numpy array of floats
+        Earlier cluster summary.
+
+    summary : 2D numpy array of floats
+        Later cluster summary.
+
+    Returns
+    -------
+    change : float
+        Largest change in s/deg, infinite if either summary is None or
+        the number of clusters has changed.
+    """
+
+    if previous is None or summary is None or previous.shape != summary.shape:
+        return np.inf
+
+    dists = np.sqrt(
+        np.sum((previous[:, None, :2] - summary[None, :, :2]) ** 2, axis=2)
+    )
+    rows, cols = linear_sum_assignment(dists)
+
+    return np.amax(np.absolute(previous[rows] - summary[cols]))
+
+
+def has_converged(state, history):
+    """
+    Checks whether the clusters of the peaks found so far have stopped
+    changing since the last check.
+
+    Parameters
+    ----------
+    state : dict
+        Record of all the completed samples.
+
+    history : dict
+        Holds the cluster summary from the last check, updated in place.
+
+    Returns
+    -------
+    converged : bool
+        True if no cluster mean or bound moved more than adaptive_tol.
+    """
+
+    n_samples = len(state["labels"])
+    peaks = read_peaks(state["peaks_files"])[:, 1:]
+
+    summary = cluster_summary(peaks, n_samples)
+    change = summary_change(history.get("summary"), summary)
+    history["summary"] = summary
+
+    print("%s samples, largest cluster change %s" % (n_samples, change))
+
+    return change <= adaptive_tol
+
+
+def run_samples(labels, state, run_seed, filename, results, history=None):
+    """
+    Adds samples to the record as they finish and checkpoints it every
+    checkpoint_every samples.
+
+    Parameters
+    ----------
+    labels : list of ints
+        Labels of the samples in the order they are returned.
+
+    state : dict
+        Record of completed samples from new_state, updated in place.
+
+    run_seed : int
+        Seed of the run.
+
+    filename : str
+        Path of the checkpoint file.
+
+    results : iterable
+        Output of bootstrap_sample for each label.
+
+    history : dict
+        If given, the clusters are checked every adaptive_batch samples
+        with has_converged and no more samples are taken once they have
+        converged. The state must then hold every completed sample.
+        Default is None.
+
+    Returns
+    -------
+    converged : bool
+        True if the samples were stopped early.
+    """
+
+    converged = False
+    for n, result in enumerate(results):
+        add_sample(state, result)
+        if checkpoint_every is not None and (n + 1) % checkpoint_every == 0:
+            save_checkpoint(state, run_seed, filename)
+        if history is not None and len(state["labels"]) % adaptive_batch == 0:
+            if has_converged(state, history):
+                converged = True
+                break
+
+    if checkpoint_every is not None and len(labels) > 0:
+        save_checkpoint(state, run_seed, filename)
+
+    return converged
+
+
+def run_mpi(labels, state, run_seed):
+    """
+    Spreads the bootstrap samples over the MPI ranks. Rank r does samples
+    labels[r], labels[r + size], labels[r + 2*size]... so all the samples
+    are done however many ranks there are. In adaptive mode the labels
+    are done adaptive_batch at a time and rank 0 checks the clusters
+    after each batch.
+
+    Parameters
+    ----------
+    labels : list of ints
+        Labels of the samples still to do.
+
+    state : dict
+        Record of completed samples on this rank, updated in place.
+
+    run_seed : int
+        Seed of the run.
+
+    Returns
+    -------
+    state : dict
+        Record of the samples from every rank on rank 0, None on the
+        other ranks.
+    """
+
+    from mpi4py import MPI
+
+    comm = MPI.COMM_WORLD
+
+    if adaptive:
+        batches = [
+            labels[i : i + adaptive_batch] for i in range(0, len(labels), adaptive_batch)
+        ]
+    else:
+        batches = [labels]
+
+    history = {}
+    for batch_labels in batches:
+        rank_labels = batch_labels[comm.rank :: comm.size]
+        run_samples(
+            rank_labels,
+            state,
+            run_seed,
+            checkpoint_filename(comm.rank),
+            (bootstrap_sample(label) for label in rank_labels),
+        )
+
+        if adaptive:
+            # rank 0 reads every rank's peaks to check the clusters
+            all_states = comm.gather(dict(state, lin_sum=None, lin_sq_sum=None), root=0)
+            converged = None
+            if comm.Get_rank() == 0:
+                converged = has_converged(merge_states(all_states), history)
+            if comm.bcast(converged, root=0):
+                break
+
+    comm.Barrier()  # wait for all cores to synchronize here
+
+    # sum the power grids with a tree reduce rather than gathering them
+    lin_sum = np.zeros(state["lin_sum"].shape)
+    lin_sq_sum = np.zeros(state["lin_sq_sum"].shape)
+    comm.Reduce(state["lin_sum"], lin_sum, op=MPI.SUM, root=0)
+    comm.Reduce(state["lin_sq_sum"], lin_sq_sum, op=MPI.SUM, root=0)
+
+    state = dict(state, lin_sum=None, lin_sq_sum=None)
+    all_states = comm.gather(state, root=0)
+
+    if comm.Get_rank() == 0:
+        merged = merge_states(all_states)
+        merged["lin_sum"] = lin_sum
+        merged["lin_sq_sum"] = lin_sq_sum
+        return merged
+    else:
+        return None
+
+
+def ordered_results(executor, labels, window):
+    """
+    Submits the bootstrap samples to a pool of workers, keeping at most
+    window samples submitted or finished but not yet returned, and
+    returns their results in label order. Finished samples wait in a
+    small dict until the samples before them are done, so the memory
+    used depends on the window not on the number of samples.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        Pool of workers to run bootstrap_sample.
+
+    labels : list of ints
+        Labels of the samples to do.
+
+    window : int
+        Most samples in flight at once, e.g. twice the number of workers
+        so the workers are kept busy while waiting for a slow sample.
+
+    Yields
+    ------
+    result : tuple
+        Output of bootstrap_sample for each label in order.
+    """
+
+    pending = {}
+    next_submit = 0
+
+    try:
+        for n in range(len(labels)):
+            while next_submit < len(labels) and next_submit - n < window:
+                pending[next_submit] = executor.submit(
+                    bootstrap_sample, labels[next_submit]
+                )
+                next_submit += 1
+
+            yield pending.pop(n).result()
+    finally:
+        # samples not needed once the caller stops early
+        for future in pending.values():
+            future.cancel()
+
+
+def run_processes(blocks, settings, labels, state):
+    """
+    Hands the bootstrap samples out to a pool of worker processes which
+    share the trace matrix and geometry, with only a few samples queued
+    at once (see ordered_results). In adaptive mode the clusters are
+    checked every adaptive_batch samples and the remaining samples are
+    cancelled once they have converged.
+
+    Parameters
+    ----------
+    blocks : dict
+        Name of each array mapped to a tuple of the shared memory block
+        name, shape and dtype.
+
+    settings : dict
+        Scalar values used by every bootstrap sample.
+
+    labels : list of ints
+        Labels of the samples still to do.
+
+    state : dict
+        Record of completed samples, updated in place.
+
+    Returns
+    -------
+    state : dict
+        Record of all the samples.
+    """
+
+    # spawn rather than fork, numba's thread pool does not survive a fork
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=attach_shared,
+        initargs=(blocks, settings, threads_per_worker),
+    ) as executor:
+        # the samples come back in label order so an adaptive run
+        # always stops after the same samples
+        results = ordered_results(executor, labels, 2 * n_workers)
+        converged = run_samples(
+            labels,
+            state,
+            settings["seed"],
+            checkpoint_filename(0),
+            results,
+            history={} if adaptive else None,
+        )
+        if converged:
+            results.close()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    return state
+
+
+def main():
+    model = get_model(pred_model)
+
+    if backend == "mpi":
+        from mpi4py import MPI
+
+        rank = MPI.COMM_WORLD.Get_rank()
+    elif backend == "processes":
+        rank = 0
+    else:
+        raise ValueError("backend must be 'mpi' or 'processes', not %s" % backend)
+
+    # if directory does not exist, create it
+
+    if rank == 0:
+        if os.path.exists(numpy_dir):
+            pass
+        else:
+            os.makedirs(numpy_dir)
+
+    st = obspy.read(filepath)
+
+    a = array(st)
+
+    event_time = a.eventtime()
+    # get travel time information and define a window
+    Target_phase_times, time_header_times = a.get_predicted_times(phase)
+
+    min_target = int(np.nanmin(Target_phase_times, axis=0)) + cut_min
+    max_target = int(np.nanmax(Target_phase_times, axis=0)) + cut_max
+
+    stime = event_time + min_target
+    etime = event_time + max_target
+
+    # trim the stream
+    # Normalise and cut seismogram around defined window
+    st = st.copy().trim(starttime=stime, endtime=etime)
+    st = st.normalize()
+
+    # get array metadata
+    # this is done after the trimming because the
+    #  trmming can remove dodgy traces
+    geometry = a.geometry()
+    distances = a.distances(type="deg")
+    mean_dist = np.mean(distances)
+    centre_x, centre_y = np.mean(geometry[:, 0]), np.mean(geometry[:, 1])
+    sampling_rate = st[0].stats.sampling_rate
+    evdp = st[0].stats.sac.evdp
+
+    # convert elevation to km
+    geometry[:, 2] /= 1000
+    if phase not in phases:
+        phases.append(phase)
+    # get predicted slownesses and backazimuths
+    predictions = a.pred_baz_slow(phases=phases, one_eighty=True)
+
+    # find the line with the predictions for the phase of interest
+    row = np.where((predictions == phase))[0]
+    P, S, BAZ, PRED_BAZ_X, PRED_BAZ_Y, PRED_AZ_X, PRED_AZ_Y, DIST, TIME = predictions[
+        row, :
+    ][0]
+
+    # filter
+    if Filt == True:
+        st = st.filter("bandpass", freqmin=fmin, freqmax=fmax, corners=2, zerophase=True)
+
+    else:
+        pass
+
+    st.resample(20, window="hann", no_filter=True)
+
+    # get the traces and phase traces
+    a_processed = array(st)
+    Traces = a_processed.traces()
+
+    incidence = np.sin((1 / float(S)) / 8)  # km/s
+    incidence = 90 - np.degrees(incidence)
+
+    # align the traces and phase traces
+    Shifted_Traces = shift_traces(
+        traces=Traces,
+        geometry=geometry,
+        abs_slow=float(S),
+        baz=float(BAZ),
+        distance=float(mean_dist),
+        centre_x=float(centre_x),
+        centre_y=float(centre_y),
+        sampling_rate=sampling_rate,
+        elevation=True,
+        incidence=incidence,
+    )
+
+    ## cut the shifted traces within the defined time window
+    ## from the t_min and rel_tmax
+
+    arrivals = model.get_travel_times(
+        source_depth_in_km=evdp, distance_in_degree=mean_dist, phase_list=[phase]
+    )
+
+    pred_point = int(sampling_rate * (arrivals[0].time - min_target))
+    point_before = int(pred_point + (t_min * sampling_rate))
+    point_after = int(pred_point + (t_max * sampling_rate))
+
+    cut_shifted_traces = np.ascontiguousarray(Shifted_Traces[:, point_before:point_after])
+
+    # shape of the power grids from BF_Noise_Threshold_Relative_XY
+    ns = int(np.round(((slow_max - slow_min) / s_space), 0) + 1)
+    grid_shape = (ns, ns)
+
+    # one seed for the run, every sample draws its own stream from it
+    # so a resumed run gives the same samples as an uninterrupted one
+    state = None
+    run_seed = seed
+    done = []
+    if rank == 0:
+        checkpoint_files = glob.glob(checkpoint_filename("*"))
+        old_peaks_files = glob.glob(peaks_filename("*"))
+        if resume and len(checkpoint_files) > 0:
+            state, checkpoint_seed, checkpoint_files = load_checkpoints()
+            if seed is not None and seed != checkpoint_seed:
+                raise ValueError(
+                    "seed %s does not match the checkpointed run seed %s"
+                    % (seed, checkpoint_seed)
+                )
+            run_seed = checkpoint_seed
+            done = state["labels"]
+            print("Resuming with %s of %s samples done" % (len(done), Boots))
+
+            # keep everything in the rank 0 files so the other ranks
+            # can write their own checkpoints and peaks from scratch
+            peaks = read_peaks(state["peaks_files"])
+            write_peaks(peaks, peaks_filename(0))
+            state["peaks_files"] = [[peaks_filename(0), len(peaks)]]
+            save_checkpoint(state, run_seed, checkpoint_filename(0))
+            if checkpoint_filename(0) in checkpoint_files:
+                checkpoint_files.remove(checkpoint_filename(0))
+            if peaks_filename(0) in old_peaks_files:
+                old_peaks_files.remove(peaks_filename(0))
+
+        for filename in checkpoint_files + old_peaks_files:
+            os.remove(filename)
+
+        if run_seed is None:
+            run_seed = np.random.SeedSequence().entropy
+
+    if backend == "mpi":
+        run_seed, done = MPI.COMM_WORLD.bcast((run_seed, done), root=0)
+
+    if state is None:
+        state = new_state(grid_shape, peaks_filename(rank))
+
+    done = set(done)
+    labels = [label for label in range(Boots) if label not in done]
+
+    settings = {
+        "sampling_rate": float(sampling_rate),
+        "incidence": float(incidence),
+        "pred_x": float(PRED_BAZ_X),
+        "pred_y": float(PRED_BAZ_Y),
+        "seed": run_seed,
+    }
+
+    arrays = {
+        "traces": cut_shifted_traces,
+        "geometry": np.ascontiguousarray(geometry),
+        "distances": np.ascontiguousarray(distances, dtype=float),
+    }
+
+    if backend == "mpi":
+        shared.update(arrays)
+        shared.update(settings)
+        state = run_mpi(labels, state, run_seed)
+    else:
+        # copy the arrays into shared memory once for all the workers
+        shms = []
+        blocks = {}
+        try:
+            for name, arr in arrays.items():
+                shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+                shms.append(shm)
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+                blocks[name] = (shm.name, arr.shape, arr.dtype)
+
+            state = run_processes(blocks, settings, labels, state)
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+    if rank == 0:
+        # put the samples back in order whichever worker did them
+        order = np.argsort(state["labels"])
+
+        # fewer than Boots samples if an adaptive run stopped early
+        n_used = len(state["labels"])
+        print("Used %s of at most %s samples" % (n_used, Boots))
+
+        Lin_Mean = state["lin_sum"] / n_used
+        # bootstrap variance of each cell from the running sums
+        Lin_Var = (state["lin_sq_sum"] - (state["lin_sum"] ** 2) / n_used) / max(n_used - 1, 1)
+        Lin_Var[Lin_Var < 0] = 0
+        All_Noise_arr = np.array(state["noise"])[order]
+        All_Thresh_Peaks_arr = read_peaks(state["peaks_files"])[:, 1:]
+
+        print(All_Thresh_Peaks_arr)
+
+        # save to the results directory!
+        all_max_peaks_filename = "%sAll_Thresh_Peaks_%s_%s_%s_array" % (
+            numpy_dir,
+            Boots,
+            fmin,
+            fmax,
+        )
+        lin_mean_arr_filename = "%sMean_Lin_%s_%s_%s_array" % (numpy_dir, Boots, fmin, fmax)
+        lin_var_arr_filename = "%sVar_Lin_%s_%s_%s_array" % (numpy_dir, Boots, fmin, fmax)
+        all_noise_arr_filename = "%sAll_Noise_%s_%s_%s_array" % (
+            numpy_dir,
+            Boots,
+            fmin,
+            fmax,
+        )
+
+        boots_used_filename = "%sBoots_Used_%s_%s_%s_array" % (numpy_dir, Boots, fmin, fmax)
+
+        n_array_names = [
+            boots_used_filename,
+            all_max_peaks_filename,
+            lin_mean_arr_filename,
+            lin_var_arr_filename,
+            all_noise_arr_filename,
+        ]
+
+        for a_name in n_array_names:
+            if os.path.exists(a_name):
+                os.remove(a_name)
+
+        np.save(all_max_peaks_filename, All_Thresh_Peaks_arr)
+        np.save(lin_mean_arr_filename, Lin_Mean)
+        np.save(lin_var_arr_filename, Lin_Var)
+        np.save(all_noise_arr_filename, All_Noise_arr)
+        np.save(boots_used_filename, np.array(n_used))
+
+        # the run is complete so the checkpoints are not needed
+        for filename in glob.glob(checkpoint_filename("*")) + glob.glob(
+            peaks_filename("*")
+        ):
+            os.remove(filename)
 
-    for a_name in n_array_names:
-        if os.path.exists(a_name):
-            os.remove(a_name)
 
-    np.save(all_max_peaks_filename, All_Thresh_Peaks_arr)
-    np.save(lin_mean_arr_filename, Lin_Mean)
-    np.save(all_noise_arr_filename, All_Noise_arr)
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ import cartopy.crs as ccrs
 from array_plotting import plotting
 
 import numpy as np
+import os
 
 # import python packages
 import obspy
@@ -22,9 +23,9 @@ from Parameters_Bootstrap import *
 from array_info import array
 from cluster_utilities import cluster_utilities
 from shift_stack import shift_traces, linear_stack_baz_slow
-from obspy.taup import TauPyModel
+from travel_time_tables import get_model
 
-model = TauPyModel(model=pred_model)
+model = get_model(pred_model)
 
 st = obspy.read(filepath)
 a = array(st)
@@ -84,8 +85,15 @@ All_Thresh_Peaks_arr = np.load(
 )
 Lin_Mean = np.load(numpy_dir + "Mean_Lin_%s_%s_%s_array.npy" % (Boots, fmin, fmax))
 
+# an adaptive bootstrap can stop before Boots samples
+Boots_Used_file = numpy_dir + "Boots_Used_%s_%s_%s_array.npy" % (Boots, fmin, fmax)
+if os.path.exists(Boots_Used_file):
+    Boots_Used = int(np.load(Boots_Used_file))
+else:
+    Boots_Used = Boots
+
 core_samples, labels = dbscan(
-    X=All_Thresh_Peaks_arr, eps=epsilon, min_samples=int(Boots * MinPts)
+    X=All_Thresh_Peaks_arr, eps=epsilon, min_samples=int(Boots_Used * MinPts)
 )
 no_clusters = np.amax(labels) + 1
 
@@ -178,7 +186,7 @@ newlines = cu.create_newlines(
     file_path=Results_filepath,
     phase=phase,
     window=[t_min, t_max],
-    Boots=Boots,
+    Boots=Boots_Used,
     epsilon=epsilon,
     slow_vec_error=slow_vec_error,
     Filter=True,
@@ -189,7 +197,7 @@ newlines_unfiltered = cu.create_newlines(
     file_path=Results_filepath_unfiltered,
     phase=phase,
     window=[t_min, t_max],
-    Boots=Boots,
+    Boots=Boots_Used,
     epsilon=epsilon,
     slow_vec_error=slow_vec_error,
     Filter=False,
@@ -65,12 +65,58 @@ Align = True
 # Number Bootstrap samples
 Boots = 100
 
+# how to spread the bootstrap samples over cores
+# "mpi" to run with mpirun or "processes" for a pool of
+# processes on one machine
+backend = "mpi"
+
+# number of worker processes for the "processes" backend
+# None uses every core
+n_workers = None
+
+# numba threads used by each worker process
+threads_per_worker = 1
+
+# seed for the bootstrap samples, None gives a new seed each run
+seed = None
+
+# save the completed samples to numpy_dir every this many samples
+# None turns checkpointing off
+checkpoint_every = 10
+
+# carry on from the checkpoints in numpy_dir rather than starting again
+resume = False
+
+# stop taking samples once the DBSCAN clusters of the peaks stop changing
+# Boots is then the most samples that will be taken
+adaptive = False
+
+# number of samples between checks of the clusters
+adaptive_batch = 50
+
+# stop when no cluster mean or 95% bound has moved more than this (s/deg)
+adaptive_tol = 0.05
+
+# noise estimate for each sample, "scramble" to stack random scrambles
+# of the traces or "analytic" for the closed form expected noise power
+noise_method = "scramble"
+
 # what to multiply noise estimate by
 threshold_multiplier = 3
 
+# None keeps every smoothed power above zero for the peak search, as
+# before the noise standard deviation was available. Set a number to
+# only keep powers more than this many standard deviations above the
+# noise estimate, e.g. 3. Changes the peaks in All_Thresh_Peaks.
+threshold_n_std = None
+
 # number of peaks above threshold to take
 peak_number = 3
 
+# refine the peaks between grid points with a quadratic fit
+# lets a coarser s_space give similar slowness precision
+interpolate_peaks = False
+
 # deviation threshold
 # above this the arrivals are removed in plotting
 slow_vec_error = 2.5 # s/deg
@@ -7,7 +7,7 @@
 import obspy
 import numpy as np
 import time
-from obspy.taup import TauPyModel
+from travel_time_tables import get_model
 from manual_pick import pick_tw
 
 from output_writing import write_to_file
@@ -19,7 +19,7 @@ import matplotlib.pyplot as plt
 
 # import parameters
 from Parameters_TP_Pol import *
-taup = TauPyModel(model=model)
+taup = get_model(model)
 
 st = obspy.read(filepath)
 array = a(st)
@@ -11,10 +11,10 @@ import obspy
 import numpy as np
 import time
 from Parameters_TP_XY import *
-from obspy.taup import TauPyModel
+from travel_time_tables import get_model
 from output_writing import write_to_file
 from slow_vec_calcs import get_slow_baz
-model = TauPyModel(model=pred_model)
+model = get_model(pred_model)
 
 from array_info import array
 from beamforming_xy import (